@@ -1,17 +1,27 @@
 import logging
+import threading
+import time
 import urllib
+from multiprocessing import TimeoutError
 
 from zope.interface import implements
 from pyramid.httpexceptions import HTTPFound
-from pyramid.interfaces import IRoutePregenerator
+from pyramid.interfaces import IAuthenticationPolicy, IRoutePregenerator
+from pyramid.location import lineage
 from pyramid.response import Response
 from pyramid import security, settings
+from pyramid.compat import is_nonstr_iter
 from pyramid.settings import asbool
-from pyramid.security import Allow
+from pyramid.security import ACLAllowed, ACLDenied, Allow
 from pyramid.view import view_config, forbidden_view_config
 from pyramid.authorization import ACLAuthorizationPolicy
 from pyramid_who.whov2 import WhoV2AuthenticationPolicy
 
+from jcu.common.cache import LRUCache
+from jcu.common.callbacks import (uncached, io_bound, DegradedGroups,
+                                  degraded, is_degraded)
+from jcu.common.instrumentation import get_metrics, timed
+from jcu.common.interfaces import IPrincipalCache
 from jcu.common.resolver import resolve_dotted
 
 RETURN_ROUTE = 'jcu.auth.return_route'
@@ -22,8 +32,34 @@ CONFIG_FILE = 'jcu.auth.who_config_file'
 ENABLE_SLO = 'jcu.auth.enable_single_log_out'
 SSO_URL = 'jcu.auth.sso_url'
 ADMINISTRATORS_KEY = 'jcu.auth.admins'
+#: Request environ keys for per-request memos
+ANONYMOUS_KEY = 'jcu.auth.anonymous'
+GROUPS_KEY = 'jcu.auth.groups'
+PERMISSIONS_KEY = 'jcu.auth.permissions'
+PRINCIPAL_CACHE_TTL = 'jcu.auth.principal_cache_ttl'
+PRINCIPAL_CACHE_SIZE = 'jcu.auth.principal_cache_size'
+PARALLEL_CALLBACKS = 'jcu.auth.parallel_callbacks'
+CALLBACK_POOL_SIZE = 'jcu.auth.callback_pool_size'
+CALLBACK_TIMEOUT = 'jcu.auth.callback_timeout'
+WARM_PRINCIPALS = 'jcu.auth.warm_principals'
+WARM_POOL_SIZE = 'jcu.auth.warm_pool_size'
+WARM_MAX_PENDING = 'jcu.auth.warm_max_pending'
+RELATED_USERS = 'jcu.auth.related_users'
+PUBLIC_PATHS = 'jcu.auth.public_paths'
+API_PATHS = 'jcu.auth.api_paths'
+REQUEST_CLASSIFIER = 'jcu.auth.request_classifier'
+TICKET_CACHE_TTL = 'jcu.auth.ticket_cache_ttl'
+TICKET_CACHE_SIZE = 'jcu.auth.ticket_cache_size'
+REDIRECT_CACHE_SIZE = 'jcu.auth.redirect_cache_size'
+#: Seconds to wait for groups being warmed if callbacks have no timeout
+WARM_TIMEOUT = 5
+#: Kinds of request returned by request classifiers
+PUBLIC = 'public'
+API = 'api'
 
 log = logging.getLogger(__name__)
+_marker = object()
+_callback_pool_lock = threading.Lock()
 
 
 class AuthenticatedPredicate(object):
@@ -57,6 +93,30 @@ class BaseView(object):
         self.request = request
 
 
+def _cached_url(request, key, compute):
+    """ Return the URL for ``key`` from the registry's cache of redirect
+    URLs, calling ``compute`` to build it on a miss.
+    """
+    cache = getattr(request.registry, 'jcu_auth_urls', None)
+    if cache is None:
+        return compute()
+    url = cache.get(key)
+    if url is None:
+        url = compute()
+        cache.set(key, url)
+    return url
+
+
+def _route_url(request, route_name, scheme=None):
+    """ Return ``route_url`` for a route without parameters, cached per
+    host and scheme.
+    """
+    key = ('route', request.host_url, request.script_name, route_name,
+           scheme)
+    return _cached_url(request, key, lambda: request.route_url(
+        route_name, **({'_scheme': scheme} if scheme else {})))
+
+
 @forbidden_view_config(authenticated=False)
 @view_config(route_name='auth-login')
 class LoginView(BaseView):
@@ -64,7 +124,7 @@ class LoginView(BaseView):
         """Challenge for auth if not logged in yet, else redirect to listing.
         """
         force_ssl = self.request.registry.settings[FORCE_SSL]
-        if security.authenticated_userid(self.request) is None:
+        if self.logged_in_userid() is None:
             # Place current URL into the request environment for CAS plugin
             return_url = self.request.referrer or ''
             if return_url and force_ssl:
@@ -77,23 +137,45 @@ class LoginView(BaseView):
             return_url = self.request.params.get('return')
             if not return_url:
                 return_route = self.request.registry.settings[RETURN_ROUTE]
-                return_url = self.request.route_url(
-                    return_route,
-                    _scheme='https' if force_ssl else 'http')
+                return_url = _route_url(self.request, return_route,
+                                        'https' if force_ssl else 'http')
             return HTTPFound(location=return_url)
 
+    def logged_in_userid(self):
+        """ Return the ID of the user if they are logged in.
+
+        When warming is enabled, groups for a user arriving at the login
+        route are computed in the background rather than here, so their
+        redirect isn't held up by auth callbacks.
+        """
+        request = self.request
+        warm = getattr(request.registry, 'jcu_warm_principals', None)
+        if warm is None or getattr(request, 'exception', None) is not None:
+            return security.authenticated_userid(request)
+        user_id = security.unauthenticated_userid(request)
+        if user_id is not None:
+            warm(request.environ['repoze.who.identity'], request)
+        return user_id
+
 
 @view_config(route_name='auth-logout')
 class LogoutView(BaseView):
     def __call__(self):
         """Log the user out by deleting cookies and redirecting to CAS logout.
         """
-        if security.authenticated_userid(self.request):
+        user_id = security.authenticated_userid(self.request)
+        if user_id:
+            # Drop any cached groups so the next login recomputes them.
+            principal_cache = \
+                self.request.registry.queryUtility(IPrincipalCache)
+            if principal_cache is not None:
+                principal_cache.invalidate(user_id)
+
             # Return to this view once we've logged out.
-            here = self.request.route_url(self.request.matched_route.name)
+            here = _route_url(self.request, self.request.matched_route.name)
             return_url = self.request.referrer or \
-                self.request.route_url(
-                    self.request.registry.settings[RETURN_ROUTE])
+                _route_url(self.request,
+                           self.request.registry.settings[RETURN_ROUTE])
             here += '?return=' + return_url
             response = HTTPFound(location=here)
 
@@ -110,8 +192,8 @@ class LogoutView(BaseView):
             # Once cookies are gone, sign out. Either SSO or redirection.
             route = self.request.registry.settings[RETURN_ROUTE]
             # Go back to the original page, or the default
-            return_url = self.request.params.get('return',
-                                                 self.request.route_url(route))
+            return_url = self.request.params.get('return') or \
+                _route_url(self.request, route)
 
             sso_url = self.request.registry.settings[SSO_URL]
             logout_url = (sso_url + '?url=' + return_url) if \
@@ -120,6 +202,182 @@ class LogoutView(BaseView):
             return HTTPFound(location=logout_url)
 
 
+class CachingWhoV2AuthenticationPolicy(WhoV2AuthenticationPolicy):
+    """ ``pyramid_who`` policy that identifies users and runs the callback
+    at most once per request.
+
+    Results are memoised in the request environ, so predicates, permission
+    checks and views asking for the user or their principals share them.
+    """
+
+    #: :class:`jcu.common.instrumentation.Metrics` to time identification
+    metrics = None
+
+    def authenticated_userid(self, request):
+        """ See IAuthenticationPolicy.
+        """
+        identity = self._get_identity(request)
+        if identity is not None and \
+                len(self._get_groups(identity, request)) > 1:
+            return identity['repoze.who.userid']
+
+    def remember(self, request, principal, **kw):
+        """ See IAuthenticationPolicy.
+        """
+        forget_memos(request)
+        return super(CachingWhoV2AuthenticationPolicy, self).remember(
+            request, principal, **kw)
+
+    def forget(self, request):
+        """ See IAuthenticationPolicy.
+        """
+        headers = super(CachingWhoV2AuthenticationPolicy, self).forget(
+            request)
+        forget_memos(request)
+        return headers
+
+    def _get_identity(self, request):
+        if request.environ.get(ANONYMOUS_KEY):
+            return None
+        identity = request.environ.get('repoze.who.identity')
+        if identity is None:
+            start = time.time()
+            identity = self._getAPI(request).authenticate()
+            if self.metrics is not None:
+                self.metrics.timing('auth.identify', time.time() - start)
+            if identity is None:
+                request.environ[ANONYMOUS_KEY] = True
+        return identity
+
+    def _get_groups(self, identity, request):
+        groups = request.environ.get(GROUPS_KEY)
+        if groups is None:
+            groups = super(CachingWhoV2AuthenticationPolicy, self)\
+                ._get_groups(identity, request)
+            request.environ[GROUPS_KEY] = groups
+        return list(groups)
+
+
+def forget_memos(request):
+    """ Drop the identity, groups and permissions memoised for ``request``.
+    """
+    for key in (ANONYMOUS_KEY, GROUPS_KEY, PERMISSIONS_KEY):
+        request.environ.pop(key, None)
+
+
+def has_permission(permission, context, request):
+    """ Memoised form of :func:`pyramid.security.has_permission`.
+
+    Results are kept for the rest of the request, per permission and
+    context.
+    """
+    memo = request.environ.setdefault(PERMISSIONS_KEY, {})
+    key = (permission, id(context))
+    # Keep a reference to the context so its id can't be reused
+    cached_context, result = memo.get(key, (None, None))
+    if cached_context is not context:
+        result = security.has_permission(permission, context, request)
+        memo[key] = (context, result)
+    return result
+
+
+def _under(path, prefixes):
+    """ Return whether ``path`` is one of, or within, ``prefixes``.
+    """
+    for prefix in prefixes:
+        prefix = prefix.rstrip('/')
+        if path == prefix or path.startswith(prefix + '/'):
+            return True
+    return False
+
+
+class PathClassifier(object):
+    """ Classify requests as :data:`PUBLIC` or :data:`API` by their path.
+
+    Requests for anything else are classified as ``None`` and identified
+    by the full ``repoze.who`` configuration as usual.
+    """
+
+    def __init__(self, public_paths=(), api_paths=()):
+        self.public_paths = tuple(public_paths)
+        self.api_paths = tuple(api_paths)
+
+    def __call__(self, request):
+        path = request.path_info
+        if _under(path, self.public_paths):
+            return PUBLIC
+        if _under(path, self.api_paths):
+            return API
+
+
+class TicketValidator(object):
+    """ Identify users from their ``auth_tkt`` cookie alone.
+
+    The ticket's signature is checked by the ``plugin`` once per cookie;
+    the resulting identity is kept in ``cache`` and only its timeout is
+    checked on later requests.
+    """
+
+    def __init__(self, plugin, cache):
+        self.plugin = plugin
+        self.cache = cache
+
+    def identify(self, request):
+        """ Return an identity for the ticket in ``request``, if valid.
+        """
+        cookie = request.cookies.get(self.plugin.cookie_name)
+        if not cookie:
+            return None
+        key = (cookie, request.remote_addr if self.plugin.include_ip
+               else None)
+        identity = self.cache.get(key)
+        if identity is None:
+            identity = self.plugin.identify(request.environ)
+            if identity is None or \
+                    self.plugin.authenticate(request.environ,
+                                             identity) is None:
+                return None
+            identity['identifier'] = identity['authenticator'] = \
+                self.plugin
+            self.cache.set(key, identity)
+        elif self.plugin.timeout and \
+                identity['timestamp'] + self.plugin.timeout < time.time():
+            self.cache.invalidate(key)
+            return None
+        return dict(identity)
+
+
+def fast_auth_tween_factory(handler, registry):
+    """ Tween skipping ``repoze.who`` identification where it's not needed.
+
+    Requests classified as :data:`PUBLIC` are treated as anonymous without
+    any identification.  Requests classified as :data:`API` are identified
+    by their ``auth_tkt`` cookie only, never challenging or consulting CAS.
+    """
+    settings = registry.settings
+    classifier = settings[REQUEST_CLASSIFIER]
+    policy = registry.getUtility(IAuthenticationPolicy)
+    plugin = dict(policy._api_factory.identifiers)[policy._identifier_id]
+    validator = TicketValidator(
+        plugin,
+        LRUCache(max_size=int(settings.get(TICKET_CACHE_SIZE, 1000)),
+                 ttl=float(settings.get(TICKET_CACHE_TTL, 60))))
+
+    def fast_auth_tween(request):
+        environ = request.environ
+        kind = classifier(request)
+        if kind == PUBLIC:
+            environ[ANONYMOUS_KEY] = True
+        elif kind == API and 'repoze.who.identity' not in environ:
+            identity = validator.identify(request)
+            if identity is None:
+                environ[ANONYMOUS_KEY] = True
+            else:
+                environ['repoze.who.identity'] = identity
+        return handler(request)
+    return fast_auth_tween
+
+
 class SchemeSelection(object):
     implements(IRoutePregenerator)
 
@@ -131,11 +389,13 @@ class SchemeSelection(object):
 
 class User(object):
     """ Simple structure representing an authenticated user in the application.
+
+    Everything other than the ``request`` is computed on first access and
+    kept for the life of the instance, so views only pay for what they use.
     """
 
-    attributes = None
-    user_id = None
-    display_name = None
+    __slots__ = ('request', '_user_id', '_attributes', '_display_name',
+                 '_is_manager')
 
     def __init__(self, request, user_id=None):
         """
@@ -143,10 +403,43 @@ class User(object):
         This will help speed things along and short-circuit the ID lookup.
         """
         self.request = request
-        self.user_id = user_id or security.authenticated_user_id(request)
-        identity = request.environ.get('repoze.who.identity')
-        self.attributes = identity and identity.get('attributes')
-        self.display_name = self.get_display_name()
+        self._user_id = user_id or _marker
+        self._attributes = _marker
+        self._display_name = _marker
+        self._is_manager = _marker
+
+    @property
+    def user_id(self):
+        if self._user_id is _marker:
+            self._user_id = security.authenticated_userid(self.request)
+        return self._user_id
+
+    @user_id.setter
+    def user_id(self, value):
+        self._user_id = value
+
+    @property
+    def attributes(self):
+        """ Attributes for the user released by CAS, if any.
+        """
+        if self._attributes is _marker:
+            identity = self.request.environ.get('repoze.who.identity')
+            self._attributes = identity and identity.get('attributes')
+        return self._attributes
+
+    @attributes.setter
+    def attributes(self, value):
+        self._attributes = value
+
+    @property
+    def display_name(self):
+        if self._display_name is _marker:
+            self._display_name = self.get_display_name()
+        return self._display_name
+
+    @display_name.setter
+    def display_name(self, value):
+        self._display_name = value
 
     def get_display_name(self):
         """ Return the user ID or the display name of the user if we know it.
@@ -163,16 +456,152 @@ class User(object):
 
         Checks against the Root object rather than the current context.
         """
-        return security.has_permission('manage',
-                                       self.request.root,
-                                       self.request)
+        if self._is_manager is _marker:
+            self._is_manager = has_permission('manage',
+                                              self.request.root,
+                                              self.request)
+        return self._is_manager
+
+
+def _index_mutator(name):
+    method = getattr(list, name)
+
+    def mutator(self, *args):
+        self._index = None
+        return method(self, *args)
+    mutator.__name__ = name
+    mutator.__doc__ = method.__doc__
+    return mutator
+
+
+class IndexedACL(list):
+    """ ACL list indexed by principal and permission.
+
+    Behaves exactly like a plain list of ACEs, but
+    :class:`IndexedACLAuthorizationPolicy` can find the first entry
+    matching a set of principals without scanning the whole list.  The
+    index is built on first use and rebuilt after any change, so keep the
+    same instance on a resource rather than building one per request.
+    """
+
+    _index = None
+
+    append = _index_mutator('append')
+    extend = _index_mutator('extend')
+    insert = _index_mutator('insert')
+    remove = _index_mutator('remove')
+    pop = _index_mutator('pop')
+    sort = _index_mutator('sort')
+    reverse = _index_mutator('reverse')
+    __setitem__ = _index_mutator('__setitem__')
+    __delitem__ = _index_mutator('__delitem__')
+    __iadd__ = _index_mutator('__iadd__')
+    __imul__ = _index_mutator('__imul__')
+    __setslice__ = _index_mutator('__setslice__')
+    __delslice__ = _index_mutator('__delslice__')
+
+    def __add__(self, other):
+        return IndexedACL(list(self) + list(other))
+
+    def __radd__(self, other):
+        return IndexedACL(list(other) + list(self))
+
+    def _build_index(self):
+        """ Map each principal and permission to its first ACE position.
+
+        Permissions that can't be enumerated, such as
+        ``pyramid.security.ALL_PERMISSIONS``, are kept per principal and
+        tested in turn.
+        """
+        exact = {}
+        other = {}
+        for position, (action, principal, permissions) in enumerate(self):
+            if not is_nonstr_iter(permissions):
+                permissions = (permissions,)
+            if type(permissions) in (list, tuple, set, frozenset):
+                for permission in permissions:
+                    exact.setdefault((principal, permission), position)
+            else:
+                other.setdefault(principal, []).append(
+                    (position, permissions))
+        index = self._index = (exact, other)
+        return index
+
+    def first_match(self, principals, permission):
+        """ Return the first ACE for any of ``principals`` with
+        ``permission``, or ``None``.
+        """
+        exact, other = self._index or self._build_index()
+        first = None
+        for principal in principals:
+            position = exact.get((principal, permission))
+            if position is not None and (first is None or position < first):
+                first = position
+            for position, permissions in other.get(principal, ()):
+                if first is not None and position >= first:
+                    break
+                if permission in permissions:
+                    first = position
+                    break
+        if first is not None:
+            return self[first]
+
+
+def _first_match(acl, principals, permission):
+    """ Return the first ACE in a plain ``acl`` matching, as Pyramid does.
+    """
+    for ace in acl:
+        action, principal, permissions = ace
+        if principal in principals:
+            if not is_nonstr_iter(permissions):
+                permissions = (permissions,)
+            if permission in permissions:
+                return ace
+
+
+class IndexedACLAuthorizationPolicy(ACLAuthorizationPolicy):
+    """ ``ACLAuthorizationPolicy`` using the index of :class:`IndexedACL`.
+
+    Checks against an ``IndexedACL`` take time proportional to the number
+    of principals, rather than the length of the ACL.  Plain ACLs are
+    scanned as usual, and results are the same as Pyramid's in all cases,
+    including the first matching ``Deny`` winning.
+    """
+
+    def permits(self, context, principals, permission):
+        """ See IAuthorizationPolicy.
+        """
+        acl = '<No ACL found on any object in resource lineage>'
+        for location in lineage(context):
+            try:
+                acl = location.__acl__
+            except AttributeError:
+                continue
+            if acl and callable(acl):
+                acl = acl()
+
+            if isinstance(acl, IndexedACL):
+                ace = acl.first_match(principals, permission)
+            else:
+                ace = _first_match(acl, principals, permission)
+            if ace is not None:
+                if ace[0] == Allow:
+                    return ACLAllowed(ace, acl, permission, principals,
+                                      location)
+                return ACLDenied(ace, acl, permission, principals, location)
+
+        return ACLDenied('<default deny>', acl, permission, principals,
+                         context)
 
 
 def allow_acl(identifier):
     """ Create a permissive ACL entry for Pyramid.
+
+    Returns an :class:`IndexedACL`, which stays indexed when added to
+    other lists of entries.
     """
-    return [(Allow, identifier, 'view'),
-            (Allow, identifier, 'edit')]
+    return IndexedACL([(Allow, identifier, 'view'),
+                       (Allow, identifier, 'edit')])
 
 
 def get_user(user_class=User):
@@ -196,7 +625,162 @@ def verify_administators(identity, request):
         return ['group:Administrators']
 
 
-def callback_fn(callbacks):
+def _call(fn, identity, request):
+    """ Run ``fn``, consuming its result in case it is a generator.
+    """
+    result = fn(identity, request)
+    if result and not isinstance(result, list):
+        result = list(result)
+    return result
+
+
+def _run_callbacks(callbacks, identity, request, groups, pool=None,
+                   timeout=None):
+    """ Run each of ``callbacks`` in turn, adding results to ``groups``.
+
+    If a thread ``pool`` is given, callbacks marked with :func:`io_bound`
+    are started on it first and the remainder run on this thread meanwhile.
+    Results are merged in the order of ``callbacks``.  Callbacks on the
+    pool that haven't finished within ``timeout`` seconds, if not None,
+    contribute no groups.  Returns ``False`` if any callback timed out or
+    returned :func:`degraded` groups.
+    """
+    if pool is None:
+        complete = True
+        for fn in callbacks:
+            result = fn(identity, request)
+            if is_degraded(result):
+                complete = False
+            if result:
+                groups.update(result)
+        return complete
+
+    complete = True
+    pending = [(fn, pool.apply_async(_call, (fn, identity, request))
+                if getattr(fn, 'io_bound', False) else None)
+               for fn in callbacks]
+    deadline = time.time() + timeout if timeout is not None else None
+    for fn, async_result in pending:
+        if async_result is None:
+            result = fn(identity, request)
+        else:
+            try:
+                result = async_result.get(
+                    max(0, deadline - time.time())
+                    if deadline is not None else None)
+            except TimeoutError:
+                log.warning("Auth callback %r timed out after %ss",
+                            fn, timeout)
+                complete = False
+                continue
+        if is_degraded(result):
+            complete = False
+        if result:
+            groups.update(result)
+    return complete
+
+
+def callback_pool(registry, size):
+    """ Return the thread pool of ``size`` threads shared for running the
+    auth callbacks of ``registry``.
+
+    The pool is created on first use so that it is never inherited across
+    a fork by worker processes.  Each application's registry has its own
+    pool, so applications in one process may use different sizes.
+    """
+    from multiprocessing.pool import ThreadPool
+    with _callback_pool_lock:
+        pool = getattr(registry, 'jcu_callback_pool', None)
+        if pool is None:
+            pool = registry.jcu_callback_pool = ThreadPool(size)
+    return pool
+
+
+def warm_pool(registry, size):
+    """ Return the thread pool of ``size`` threads shared for warming the
+    principal cache of ``registry``.
+
+    This is separate from :func:`callback_pool` so that warming never
+    waits on callbacks queued behind it.  It too is created on first use.
+    """
+    from multiprocessing.pool import ThreadPool
+    with _callback_pool_lock:
+        pool = getattr(registry, 'jcu_warm_pool', None)
+        if pool is None:
+            pool = registry.jcu_warm_pool = ThreadPool(size)
+    return pool
+
+
+class WarmingRequest(object):
+    """ Stand-in for a request, given to auth callbacks warming the cache.
+
+    Warming outlives the request that started it, and may be for other
+    users, so only the application's ``registry`` and the LDAP
+    ``ldap_connector``, if any, are carried over from ``request``.
+    """
+
+    def __init__(self, request):
+        self.registry = request.registry
+        self.ldap_connector = getattr(request, 'ldap_connector', None)
+
+
+def callback_fn(callbacks, cache=None, pool_size=None, timeout=5,
+                warm_pool_size=None, max_pending=100, related_users=None):
+    cacheable = [fn for fn in callbacks
+                 if getattr(fn, 'cache_principals', True)]
+    uncacheable = [fn for fn in callbacks
+                   if not getattr(fn, 'cache_principals', True)]
+    # Results of warming in progress, by user ID
+    pending = {}
+    pending_lock = threading.Lock()
+
+    def compute(identity, request, pool):
+        """ Run the cacheable callbacks and cache their groups if complete.
+        """
+        computed = set()
+        complete = _run_callbacks(cacheable, identity, request, computed,
+                                  pool, timeout)
+        cached = frozenset(computed)
+        # Don't hold on to partial results from timed out callbacks, or
+        # fallback groups served whilst a callback's source is down
+        if complete:
+            cache.set(identity['repoze.who.userid'], cached)
+        return cached
+
+    def warm_one(identity, request):
+        try:
+            return compute(identity, request, None)
+        except Exception:
+            log.exception("Failed to warm groups for %s",
+                          identity['repoze.who.userid'])
+        finally:
+            with pending_lock:
+                pending.pop(identity['repoze.who.userid'], None)
+
+    def warm(identity, request):
+        """ Start computing groups for ``identity`` in the background.
+
+        Groups are computed for any related users too.  Users whose groups
+        are already cached or being computed are skipped, as is everyone
+        once ``max_pending`` users are waiting.  Callbacks are given a
+        :class:`WarmingRequest` in place of ``request``.
+        """
+        identities = [identity]
+        if related_users is not None:
+            identities.extend({'repoze.who.userid': user_id}
+                              for user_id in related_users(identity, request))
+        pool = warm_pool(request.registry, warm_pool_size)
+        context = WarmingRequest(request)
+        for user_identity in identities:
+            user_id = user_identity['repoze.who.userid']
+            if cache.get(user_id) is not None:
+                continue
+            with pending_lock:
+                if user_id in pending or len(pending) >= max_pending:
+                    continue
+                pending[user_id] = pool.apply_async(
+                    warm_one, (dict(user_identity), context))
+
     def callback(identity, request):
         """ Run all callbacks that were configured within the application.
 
@@ -204,6 +788,13 @@ def callback_fn(callbacks):
         pyramid.security.effective_principals, so you can use them within
         any __acl__ you so desire.
 
+        If a ``cache`` was provided, groups from callbacks not marked with
+        :func:`uncached` are stored against the user's ID and reused until
+        they expire or are invalidated.  If a ``pool_size`` was provided,
+        callbacks marked with :func:`io_bound` run concurrently on a shared
+        thread pool, each given ``timeout`` seconds (5 by default) to
+        complete, or as long as they take if ``timeout`` is None.
+
         *Arguments*
 
         identity: repoze.who Identity dict-like object with user attributes
@@ -212,14 +803,35 @@ def callback_fn(callbacks):
                   released by the CAS server.
         request:  pyramid Request instance representing the current request.
         """
+        pool = (callback_pool(request.registry, pool_size)
+                if pool_size else None)
         groups = set(['group:Authenticated'])
-        for fn in callbacks:
-            result = fn(identity, request)
-            if result:
-                groups.update(result)
+        if cache is None:
+            _run_callbacks(callbacks, identity, request, groups, pool,
+                           timeout)
+        else:
+            user_id = identity['repoze.who.userid']
+            cached = cache.get(user_id)
+            if cached is None:
+                # Wait for groups already being warmed, rather than
+                # looking them up twice
+                warming = pending.get(user_id)
+                if warming is not None:
+                    try:
+                        cached = warming.get(WARM_TIMEOUT if timeout is None
+                                             else timeout)
+                    except TimeoutError:
+                        pass
+            if cached is None:
+                cached = compute(identity, request, pool)
+            groups.update(cached)
+            _run_callbacks(uncacheable, identity, request, groups, pool,
+                           timeout)
         log.debug("Access groups determined: %r", groups)
         return groups
 
+    if cache is not None and warm_pool_size:
+        callback.warm = warm
     return callback
 
 
@@ -232,6 +844,8 @@ def includeme(config):
     """
     config.registry.settings[FORCE_SSL] = \
         asbool(config.registry.settings.get(FORCE_SSL, False))
+    config.include('jcu.common.instrumentation')
+    metrics = get_metrics(config.registry)
     config.add_view_predicate('authenticated', AuthenticatedPredicate)
 
     # Adjust settings in config
@@ -243,30 +857,87 @@ def includeme(config):
     # Resolve callbacks from settings
     callbacks_dotted = config.registry.settings.get(AUTH_CALLBACK, '').split()
     callbacks = [resolve_dotted(dotted) for dotted in callbacks_dotted]
+    if metrics is not None:
+        callbacks = [timed('auth.callback.' + dotted, fn, metrics)
+                     for dotted, fn in zip(callbacks_dotted, callbacks)]
+
+    # Optionally cache callback results per user
+    principal_cache = None
+    cache_ttl = float(config.registry.settings.get(PRINCIPAL_CACHE_TTL, 0))
+    if cache_ttl > 0:
+        cache_size = int(
+            config.registry.settings.get(PRINCIPAL_CACHE_SIZE, 1000))
+        principal_cache = LRUCache(max_size=cache_size, ttl=cache_ttl)
+        config.registry.registerUtility(principal_cache, IPrincipalCache)
+
+    # Optionally run I/O bound callbacks concurrently
+    pool_size = timeout = None
+    if asbool(config.registry.settings.get(PARALLEL_CALLBACKS, False)):
+        pool_size = int(
+            config.registry.settings.get(CALLBACK_POOL_SIZE, 10))
+        timeout = float(config.registry.settings.get(CALLBACK_TIMEOUT, 5))
+
+    # Optionally warm the principal cache in the background at login
+    warm_pool_size = max_pending = related_users = None
+    if principal_cache is not None and \
+            asbool(config.registry.settings.get(WARM_PRINCIPALS, False)):
+        warm_pool_size = int(
+            config.registry.settings.get(WARM_POOL_SIZE, 4))
+        max_pending = int(
+            config.registry.settings.get(WARM_MAX_PENDING, 100))
+        related_users = resolve_dotted(
+            config.registry.settings.get(RELATED_USERS))
 
     # Load pyramid_who configuration
     config_file = config.registry.settings.get(CONFIG_FILE)
-    authentication_policy = WhoV2AuthenticationPolicy(
+    callback = callback_fn(callbacks, principal_cache, pool_size, timeout,
+                           warm_pool_size, max_pending, related_users)
+    authentication_policy = CachingWhoV2AuthenticationPolicy(
         config_file=config_file,
         identifier_id='auth_tkt',
-        callback=callback_fn(callbacks)
+        callback=callback
     )
+    config.registry.jcu_warm_principals = getattr(callback, 'warm', None)
+    authentication_policy.metrics = metrics
 
-    # Figure out the logout URL for CAS
-    for obj in authentication_policy._api_factory.challengers:
-        plugin = obj[1]
-        if hasattr(plugin, 'cas_url'):
-            cas_url = plugin.cas_url
-    config.registry.settings[SSO_URL] = '%slogout' % cas_url
+    # Figure out the logout URL for CAS, unless set explicitly
     config.registry.settings[ENABLE_SLO] = \
         asbool(config.registry.settings.get(ENABLE_SLO, False))
+    if not config.registry.settings.get(SSO_URL):
+        cas_url = None
+        for obj in authentication_policy._api_factory.challengers:
+            plugin = obj[1]
+            if hasattr(plugin, 'cas_url'):
+                cas_url = plugin.cas_url
+        if cas_url:
+            config.registry.settings[SSO_URL] = '%slogout' % cas_url
+        else:
+            config.registry.settings[SSO_URL] = None
+            if config.registry.settings[ENABLE_SLO]:
+                log.warning("No challenger with a CAS URL was found and %s "
+                            "isn't set; disabling single log out.", SSO_URL)
+                config.registry.settings[ENABLE_SLO] = False
+
+    # Cache route URLs for login and logout redirects per host and scheme
+    config.registry.jcu_auth_urls = LRUCache(max_size=int(
+        config.registry.settings.get(REDIRECT_CACHE_SIZE, 1000)))
 
-    authorization_policy = ACLAuthorizationPolicy()
+    authorization_policy = IndexedACLAuthorizationPolicy()
 
     # Session already configured via pyramid_beaker include
     config.set_authentication_policy(authentication_policy)
     config.set_authorization_policy(authorization_policy)
 
+    # Optionally skip full identification for public and API requests
+    classifier_dotted = config.registry.settings.get(REQUEST_CLASSIFIER)
+    public_paths = settings.aslist(
+        config.registry.settings.get(PUBLIC_PATHS, ''))
+    api_paths = settings.aslist(config.registry.settings.get(API_PATHS, ''))
+    if classifier_dotted or public_paths or api_paths:
+        config.registry.settings[REQUEST_CLASSIFIER] = resolve_dotted(
+            classifier_dotted, PathClassifier(public_paths, api_paths))
+        config.add_tween('jcu.common.auth.fast_auth_tween_factory')
+
     # Add a special lazy attributes/methods to the request
     user_class_dotted = config.registry.settings.get(USER_CLASS)
     user_class = resolve_dotted(user_class_dotted, User)
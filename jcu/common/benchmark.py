@@ -0,0 +1,522 @@
+""" Benchmarks for the request paths provided by jcu.common.
+
+Run with ``python -m jcu.common.benchmark``.  Requests are driven through
+a real Pyramid router configured with :mod:`jcu.common.auth`, using the
+stand-ins from :mod:`jcu.common.testing` in place of CAS and LDAP.  With
+``--imports``, the time taken to import each module is measured instead.
+With ``--end-to-end``, a sample app configured from ``who.ini.in`` and
+``ldap.*`` settings is driven against the fake CAS server and in-memory
+directory from :mod:`jcu.common.testing`, as users and groups scale.
+With ``--widgets``, readonly rendering of a large form is timed with and
+without widget render caching.
+"""
+from __future__ import print_function
+import argparse
+import gc
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from pyramid.config import Configurator
+from pyramid.request import Request
+from pyramid.security import Allow
+from pyramid.session import UnencryptedCookieSessionFactoryConfig
+
+from jcu.common import testing
+from jcu.common.auth import io_bound
+from jcu.common.ldap import verify_ldap_roles
+
+#: LDAP stand-in used by :func:`ldap_roles`
+groupfinder = testing.StubGroupFinder(
+    groups=['cn=Role %d, ou=org,dc=example,dc=com' % i for i in range(10)])
+
+
+@io_bound
+def ldap_roles(identity, request):
+    """ Auth callback resolving roles from the stub LDAP group finder.
+    """
+    return verify_ldap_roles(identity, request, _groupfinder=groupfinder)
+
+
+class Root(object):
+    __acl__ = [(Allow, 'group:Administrators', 'manage'),
+               (Allow, 'group:Authenticated', 'view')]
+
+    def __init__(self, request):
+        pass
+
+
+def public_view(request):
+    return request.response
+
+
+def private_view(request):
+    request.user.display_name
+    request.user.is_manager
+    request.route_url('auth-login')
+    return request.response
+
+
+def make_app(directory, settings=None):
+    """ Return a WSGI app using :mod:`jcu.common.auth` with stub plugins.
+    """
+    app_settings = {
+        'jcu.auth.return_route': 'public',
+        'jcu.auth.who_config_file': testing.write_who_config(directory),
+        'jcu.auth.auth_callbacks': 'jcu.common.auth.verify_administators '
+                                   'jcu.common.benchmark.ldap_roles',
+        'jcu.auth.admins': 'admin',
+    }
+    app_settings.update(settings or {})
+    config = Configurator(
+        settings=app_settings, root_factory=Root,
+        session_factory=UnencryptedCookieSessionFactoryConfig('secret'))
+    config.include('jcu.common.auth')
+    add_views(config)
+    return config.make_wsgi_app()
+
+
+#: ``who.ini.in`` from a source checkout, used by ``--end-to-end``
+WHO_TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            os.pardir, os.pardir, 'who.ini.in')
+
+
+def make_sample_app(directory, cas_url, ldap_directory,
+                    template=WHO_TEMPLATE, settings=None):
+    """ Return a WSGI app set up as in production, but for CAS and LDAP.
+
+    ``repoze.who`` middleware configured from the ``who.ini.in`` template
+    (CAS, ``auth_tkt`` and the metadata cache) wraps a Pyramid app using
+    :mod:`jcu.common.auth` and :mod:`jcu.common.ldap`, which log in against
+    the CAS server at ``cas_url`` and look up roles in ``ldap_directory``.
+    """
+    from repoze.who.config import make_middleware_with_config
+    who_config = testing.write_who_config_from(template, directory,
+                                               cas_url=cas_url)
+    app_settings = {
+        'jcu.auth.return_route': 'public',
+        'jcu.auth.who_config_file': who_config,
+        'jcu.auth.auth_callbacks': 'jcu.common.auth.verify_administators '
+                                   'jcu.common.ldap.verify_ldap_roles',
+        'jcu.auth.admins': 'jc000000',
+        'ldap.setup.uri': 'ldap://localhost',
+        'ldap.groups_query.base_dn': 'ou=org,dc=example,dc=com',
+        'ldap.groups_query.filter_tmpl':
+            '(&(cn=Role*)(roleOccupant=%(userdn)s))',
+        'ldap.groups_query.scope': 'ldap.SCOPE_SUBTREE',
+    }
+    app_settings.update(settings or {})
+    config = Configurator(
+        settings=app_settings, root_factory=Root,
+        session_factory=UnencryptedCookieSessionFactoryConfig('secret'))
+    config.include('jcu.common.auth')
+    config.include('jcu.common.ldap')
+    testing.install_fake_ldap(config, ldap_directory)
+    add_views(config)
+    return make_middleware_with_config(config.make_wsgi_app(),
+                                       {'here': directory}, who_config)
+
+
+def add_views(config):
+    config.add_route('public', '/public')
+    config.add_route('private', '/private')
+    config.add_route('api', '/api/private')
+    config.add_view(public_view, route_name='public')
+    config.add_view(private_view, route_name='private', permission='view',
+                    authenticated=True)
+    config.add_view(public_view, route_name='api', permission='view')
+
+
+def percentile(timings, fraction):
+    """ Return the value at ``fraction`` through the sorted ``timings``.
+    """
+    index = min(len(timings) - 1, int(round(fraction * (len(timings) - 1))))
+    return timings[index]
+
+
+def run(app, path, user_id=None, requests=1000, ticket=False):
+    """ Send ``requests`` requests for ``path`` and return statistics.
+
+    The user is logged in by an ``auth_tkt`` cookie if ``ticket`` is true,
+    or else by the stub CAS plugin.  ``objects`` is the number of
+    garbage-collected objects created and not freed by reference counting,
+    per request.
+    """
+    environ = {}
+    if user_id and ticket:
+        environ['HTTP_COOKIE'] = '%s="%s"' % (testing.TICKET_COOKIE,
+                                              testing.make_ticket(user_id))
+    elif user_id:
+        environ[testing.USERID_KEY] = user_id
+    timings = []
+    ldap_calls = groupfinder.calls
+    gc.collect()
+    gc.disable()
+    try:
+        objects = len(gc.get_objects())
+        for i in range(requests):
+            request = Request.blank(path, environ=dict(environ))
+            start = time.time()
+            response = request.get_response(app)
+            timings.append(time.time() - start)
+            assert response.status_int == 200, response.status
+        objects = len(gc.get_objects()) - objects
+    finally:
+        gc.enable()
+    timings.sort()
+    return {'requests': requests,
+            'mean': sum(timings) / len(timings),
+            'p50': percentile(timings, 0.5),
+            'p90': percentile(timings, 0.9),
+            'p99': percentile(timings, 0.99),
+            'objects': float(objects) / requests,
+            'ldap_calls': float(groupfinder.calls - ldap_calls) / requests}
+
+
+def login_round_trip(app, user_id):
+    """ Log ``user_id`` in and out again, as a browser would.
+
+    The stub CAS plugin challenges the anonymous login and is then
+    satisfied by the user ID; logout returns via the SSO URL.
+    """
+    referrer = 'http://localhost/private'
+    steps = [('/login', None, 401),
+             ('/login', user_id, 302),
+             ('/logout', user_id, 302),
+             ('/logout?return=' + referrer, None, 302)]
+    for path, step_user_id, status in steps:
+        environ = {testing.USERID_KEY: step_user_id} if step_user_id else {}
+        request = Request.blank(path, environ=environ,
+                                headers={'Referer': referrer})
+        response = request.get_response(app)
+        assert response.status_int == status, response.status
+
+
+def run_logins(app, requests=1000, concurrency=10):
+    """ Make ``requests`` login and logout round trips, ``concurrency`` at
+    a time, and return statistics per round trip.
+    """
+    from multiprocessing.pool import ThreadPool
+
+    def timed_round_trip(i):
+        start = time.time()
+        login_round_trip(app, 'jc%06d' % (i % 5000))
+        return time.time() - start
+
+    ldap_calls = groupfinder.calls
+    pool = ThreadPool(concurrency)
+    try:
+        start = time.time()
+        timings = sorted(pool.map(timed_round_trip, range(requests)))
+        elapsed = time.time() - start
+    finally:
+        pool.close()
+    return {'requests': requests,
+            'mean': sum(timings) / len(timings),
+            'p50': percentile(timings, 0.5),
+            'p90': percentile(timings, 0.9),
+            'p99': percentile(timings, 0.99),
+            'throughput': requests / elapsed,
+            'objects': 0,
+            'ldap_calls': float(groupfinder.calls - ldap_calls) / requests}
+
+
+def run_first_requests(app, requests=100, think_time=0.05):
+    """ Log in ``requests`` new users and time the login redirect and the
+    first page each then requests, ``think_time`` seconds later.
+
+    Returns statistics for each of the two steps.
+    """
+    results = {}
+    ldap_calls = groupfinder.calls
+    for step in ('login', 'first request'):
+        results[step] = []
+    for i in range(requests):
+        environ = {testing.USERID_KEY: 'jc%06d' % i}
+        for step, path in (('login', '/login'),
+                           ('first request', '/private')):
+            request = Request.blank(path, environ=dict(environ))
+            start = time.time()
+            response = request.get_response(app)
+            results[step].append(time.time() - start)
+            assert response.status_int in (200, 302), response.status
+            if step == 'login':
+                time.sleep(think_time)
+    ldap_calls = float(groupfinder.calls - ldap_calls) / requests
+    for step, timings in results.items():
+        timings.sort()
+        results[step] = {'requests': requests,
+                         'mean': sum(timings) / len(timings),
+                         'p50': percentile(timings, 0.5),
+                         'p90': percentile(timings, 0.9),
+                         'p99': percentile(timings, 0.99),
+                         'objects': 0,
+                         'ldap_calls': ldap_calls}
+    return results
+
+
+def cas_login(app, cas, user_id):
+    """ Log ``user_id`` in to ``app`` through the fake ``cas`` application.
+
+    Returns a ``Cookie`` header value for the user's ``auth_tkt``.
+    """
+    challenge = Request.blank('/login').get_response(app)
+    assert challenge.status_int == 302, challenge.status
+    login = Request.blank(challenge.location + '&username=' + user_id)
+    service = Request.blank(login.get_response(cas).location)
+    response = service.get_response(app)
+    assert response.status_int == 302, response.status
+    cookies = dict(header.split(';')[0].split('=', 1)
+                   for name, header in response.headerlist
+                   if name.lower() == 'set-cookie')
+    return '; '.join('%s=%s' % item for item in cookies.items())
+
+
+def run_end_to_end(users, groups, requests=1000, concurrency=10,
+                   ldap_latency=0, settings=None):
+    """ Log ``users`` users in to a sample app, each occupying ``groups``
+    LDAP roles, then request a protected page ``requests`` times.
+
+    Returns statistics per request, including LDAP searches and the rate
+    of requests and of logins.
+    """
+    from multiprocessing.pool import ThreadPool
+    ldap_directory = testing.make_directory(users, groups, ldap_latency)
+    server = testing.serve_fake_cas()
+    directory = tempfile.mkdtemp()
+    pool = ThreadPool(concurrency)
+    try:
+        app = make_sample_app(directory, server.cas_url, ldap_directory,
+                              settings=settings)
+        user_ids = ['jc%06d' % i for i in range(users)]
+        start = time.time()
+        cookies = pool.map(lambda user_id: cas_login(app, server.cas,
+                                                     user_id), user_ids)
+        logins = users / (time.time() - start)
+
+        def timed_request(i):
+            request = Request.blank(
+                '/private', headers={'Cookie': cookies[i % users]})
+            start = time.time()
+            response = request.get_response(app)
+            assert response.status_int == 200, response.status
+            return time.time() - start
+
+        searches = ldap_directory.searches
+        start = time.time()
+        timings = sorted(pool.map(timed_request, range(requests)))
+        elapsed = time.time() - start
+    finally:
+        pool.close()
+        server.shutdown()
+        shutil.rmtree(directory)
+    return {'requests': requests,
+            'mean': sum(timings) / len(timings),
+            'p50': percentile(timings, 0.5),
+            'p90': percentile(timings, 0.9),
+            'p99': percentile(timings, 0.99),
+            'throughput': requests / elapsed,
+            'logins': logins,
+            'ldap_calls': float(ldap_directory.searches - searches) /
+            requests}
+
+
+def widget_form(fields=200, section_size=10):
+    """ Return a schema of ``fields`` string fields and an appstruct for it,
+    in sections rendered by :class:`jcu.common.widgets.InlineMappingWidget`.
+    """
+    import colander
+    schema = colander.SchemaNode(colander.Mapping())
+    appstruct = {}
+    for section in range(fields // section_size):
+        name = 'section%d' % section
+        node = colander.SchemaNode(colander.Mapping(), name=name)
+        appstruct[name] = {}
+        for field in range(section_size):
+            node.add(colander.SchemaNode(colander.String(),
+                                         name='field%d' % field))
+            appstruct[name]['field%d' % field] = 'value %d' % field
+        schema.add(node)
+    return schema, appstruct
+
+
+def run_widgets(fields=200, requests=100):
+    """ Time readonly renderings of a form of ``fields`` fields, with and
+    without caching of each section's output.
+    """
+    import deform
+    from pkg_resources import resource_filename
+    from jcu.common.cache import LRUCache
+    from jcu.common.widgets import InlineMappingWidget
+    renderer = deform.ZPTRendererFactory(
+        (resource_filename('jcu.common', 'templates/deform'),
+         resource_filename('deform', 'templates')))
+    schema, appstruct = widget_form(fields)
+    results = {}
+    for name, cache in (('uncached', None), ('cached', LRUCache())):
+        for node in schema.children:
+            node.widget = InlineMappingWidget(render_cache=cache)
+        timings = []
+        for i in range(requests + 1):
+            start = time.time()
+            form = deform.Form(schema, renderer=renderer)
+            html = form.render(appstruct, readonly=True)
+            timings.append(time.time() - start)
+        # The first rendering fills the cache, so is left out
+        timings = sorted(timings[1:])
+        results[name] = {'requests': requests,
+                         'mean': sum(timings) / len(timings),
+                         'p50': percentile(timings, 0.5),
+                         'p90': percentile(timings, 0.9),
+                         'p99': percentile(timings, 0.99),
+                         'objects': 0,
+                         'ldap_calls': 0,
+                         'html': html}
+    assert results['cached']['html'] == results['uncached']['html']
+    return results
+
+
+def report(name, stats):
+    print('%-24s %8.3fms %8.3fms %8.3fms %8.3fms %8.1f %8.2f' % (
+        name,
+        stats['mean'] * 1000,
+        stats['p50'] * 1000,
+        stats['p90'] * 1000,
+        stats['p99'] * 1000,
+        stats['objects'],
+        stats['ldap_calls']))
+
+
+def import_time(module, repeat=5):
+    """ Return the median seconds taken to import ``module`` from cold.
+
+    Each import happens in a fresh interpreter.
+    """
+    code = ('import time; start = time.time(); import %s; '
+            'print(time.time() - start)' % module)
+    timings = sorted(float(subprocess.check_output([sys.executable, '-c',
+                                                    code]))
+                     for i in range(repeat))
+    return timings[len(timings) // 2]
+
+
+#: Modules timed by ``--imports``
+MODULES = [
+    'jcu.common.auth',
+    'jcu.common.ldap',
+    'jcu.common.json',
+    'jcu.common.widgets',
+    'jcu.common.resources',
+]
+
+#: Name, path, user ID and whether to log in by ``auth_tkt`` cookie.  Try
+#: ``--setting jcu.auth.public_paths=/public`` and
+#: ``--setting jcu.auth.api_paths=/api`` to compare the fast auth tween.
+SCENARIOS = [
+    ('anonymous', '/public', None, False),
+    ('authenticated', '/private', 'jc123456', False),
+    ('administrator', '/private', 'admin', False),
+    ('api', '/api/private', 'jc123456', True),
+]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-n', '--requests', type=int, default=1000,
+                        help='Requests per scenario (default 1000)')
+    parser.add_argument('--ldap-latency', type=float, default=0,
+                        help='Seconds each stub LDAP lookup takes')
+    parser.add_argument('--setting', action='append', default=[],
+                        metavar='KEY=VALUE',
+                        help='Extra application setting; may be repeated')
+    parser.add_argument('--imports', action='store_true',
+                        help='Time cold imports of each module instead')
+    parser.add_argument('--logins', action='store_true',
+                        help='Drive concurrent login and logout round '
+                             'trips instead')
+    parser.add_argument('--first-requests', action='store_true',
+                        help='Time logins of new users and their first '
+                             'request instead')
+    parser.add_argument('--think-time', type=float, default=0.05,
+                        help='Seconds between login and first request '
+                             '(default 0.05)')
+    parser.add_argument('-c', '--concurrency', type=int, default=10,
+                        help='Concurrent round trips or requests for '
+                             '--logins and --end-to-end (default 10)')
+    parser.add_argument('--end-to-end', action='store_true',
+                        help='Drive a sample app using who.ini.in against '
+                             'fake CAS and LDAP servers instead')
+    parser.add_argument('--widgets', action='store_true',
+                        help='Time readonly rendering of a form with and '
+                             'without widget render caching instead')
+    parser.add_argument('--fields', type=int, default=200,
+                        help='Fields in the form for --widgets '
+                             '(default 200)')
+    parser.add_argument('--users', default='10,100,1000',
+                        help='Comma separated user counts for --end-to-end')
+    parser.add_argument('--groups', default='1,10,100',
+                        help='Comma separated counts of roles per user for '
+                             '--end-to-end')
+    args = parser.parse_args(argv)
+
+    if args.imports:
+        print('%-24s %10s' % ('module', 'import'))
+        for module in MODULES:
+            print('%-24s %8.1fms' % (module, import_time(module) * 1000))
+        return
+
+    if args.widgets:
+        results = run_widgets(args.fields, args.requests)
+        print('%-24s %10s %10s %10s %10s %8s %8s' % (
+            'rendering', 'mean', 'p50', 'p90', 'p99', 'objects', 'ldap'))
+        for name in ('uncached', 'cached'):
+            report(name, results[name])
+        return
+
+    groupfinder.latency = args.ldap_latency
+    settings = dict(s.split('=', 1) for s in args.setting)
+    if args.end_to_end:
+        print('%6s %6s %10s %10s %10s %10s %10s %8s %10s' % (
+            'users', 'groups', 'req/s', 'mean', 'p50', 'p90', 'p99', 'ldap',
+            'logins/s'))
+        for users in [int(n) for n in args.users.split(',')]:
+            for groups in [int(n) for n in args.groups.split(',')]:
+                stats = run_end_to_end(users, groups, args.requests,
+                                       args.concurrency, args.ldap_latency,
+                                       settings)
+                print('%6d %6d %10.1f %8.3fms %8.3fms %8.3fms %8.3fms '
+                      '%8.2f %10.1f' % (
+                          users, groups, stats['throughput'],
+                          stats['mean'] * 1000, stats['p50'] * 1000,
+                          stats['p90'] * 1000, stats['p99'] * 1000,
+                          stats['ldap_calls'], stats['logins']))
+        return
+    directory = tempfile.mkdtemp()
+    try:
+        app = make_app(directory, settings)
+        print('%-24s %10s %10s %10s %10s %8s %8s' % (
+            'scenario', 'mean', 'p50', 'p90', 'p99', 'objects', 'ldap'))
+        if args.logins:
+            stats = run_logins(app, args.requests, args.concurrency)
+            report('login/logout', stats)
+            print('%.0f round trips/s' % stats['throughput'])
+            return
+        if args.first_requests:
+            results = run_first_requests(app, args.requests,
+                                         args.think_time)
+            for step in ('login', 'first request'):
+                report(step, results[step])
+            return
+        for name, path, user_id, ticket in SCENARIOS:
+            # Warm up before measuring
+            run(app, path, user_id, 10, ticket)
+            report(name, run(app, path, user_id, args.requests, ticket))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
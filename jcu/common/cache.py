@@ -0,0 +1,79 @@
+import threading
+import time
+from collections import OrderedDict
+
+_marker = object()
+
+
+class LRUCache(object):
+    """ Thread-safe, size-bounded mapping with optional expiry of entries.
+
+    Entries are evicted least-recently-used first once ``max_size`` is
+    reached.  If ``ttl`` (seconds) is given, entries older than this are
+    treated as missing and dropped on their next lookup.
+    """
+
+    def __init__(self, max_size=1000, ttl=None, clock=time.time):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """ Return the value for ``key``, or ``default`` if missing/expired.
+        """
+        with self._lock:
+            try:
+                expires, value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires <= self.clock():
+                self.misses += 1
+                return default
+            self._data[key] = (expires, value)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=_marker):
+        """ Store ``value`` against ``key``, evicting old entries if full.
+
+        ``ttl`` overrides the cache-wide expiry for this entry only; pass
+        ``None`` to store an entry that never expires.
+        """
+        ttl = self.ttl if ttl is _marker else ttl
+        expires = self.clock() + ttl if ttl else None
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (expires, value)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        """ Drop ``key`` from the cache if present.
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """ Drop all entries from the cache.
+        """
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """ Return a dict of hit/miss counters and current size.
+        """
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._data),
+                'max_size': self.max_size}
+
+    def __contains__(self, key):
+        return self.get(key, _marker) is not _marker
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,47 @@
+""" Markers for auth callbacks and their results.
+
+These have no dependencies, so modules providing callbacks (such as
+``jcu.common.ldap``) can use them without loading ``jcu.common.auth``,
+which re-exports them.
+"""
+
+
+def uncached(fn):
+    """ Mark an auth callback so its groups are never held in the cache.
+
+    Use this for callbacks whose result depends on the request rather than
+    just the user (eg source IP checks), or which must always be current.
+    """
+    fn.cache_principals = False
+    return fn
+
+
+def io_bound(fn):
+    """ Mark an auth callback as safe to run on a worker thread.
+
+    With ``jcu.auth.parallel_callbacks`` enabled, callbacks marked this way
+    run concurrently with each other and with the remaining callbacks.
+    """
+    fn.io_bound = True
+    return fn
+
+
+class DegradedGroups(list):
+    """ Groups an auth callback could only approximate; see :func:`degraded`.
+    """
+    degraded = True
+
+
+def degraded(groups):
+    """ Mark ``groups`` returned by an auth callback as approximate.
+
+    Return this from a callback that couldn't reach its source of truth and
+    fell back to stale or default groups.  These are used for the current
+    request, but the user's groups aren't cached, so that they're computed
+    afresh once the source recovers.
+    """
+    return DegradedGroups(groups)
+
+
+def is_degraded(result):
+    return getattr(result, 'degraded', False)
@@ -0,0 +1,242 @@
+""" Opt-in timing of authentication and LDAP lookups.
+
+Include this module (it is included by :mod:`jcu.common.auth`) and set
+``jcu.instrumentation.enabled = true`` to record counters and latency
+histograms.  When disabled, nothing is wrapped or registered.
+"""
+import bisect
+import logging
+import socket
+import threading
+import time
+
+from pyramid.settings import asbool, aslist
+
+from jcu.common.interfaces import IMetrics
+
+ENABLED = 'jcu.instrumentation.enabled'
+SINKS = 'jcu.instrumentation.sinks'
+STATSD_HOST = 'jcu.instrumentation.statsd_host'
+STATSD_PORT = 'jcu.instrumentation.statsd_port'
+STATSD_PREFIX = 'jcu.instrumentation.statsd_prefix'
+SNAPSHOT_PATH = 'jcu.instrumentation.snapshot_path'
+
+#: Upper bounds, in seconds, of histogram buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+           2.5, 5.0, 10.0)
+
+log = logging.getLogger(__name__)
+
+
+class Histogram(object):
+    """ Count, total and bucketed distribution of recorded timings.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def as_dict(self):
+        bounds = [str(bound) for bound in self.buckets] + ['+Inf']
+        return {'count': self.count,
+                'total': self.total,
+                'mean': self.total / self.count if self.count else 0,
+                'buckets': dict(zip(bounds, self.counts))}
+
+
+class MemorySink(object):
+    """ Keep a histogram per operation and each counter in memory, for
+    :func:`snapshot_view`.
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def timing(self, name, seconds):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(seconds)
+
+    def incr(self, name, count=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + count
+
+    def snapshot(self):
+        """ Return each histogram as a dict, and each counter as a dict of
+        its ``count``.
+        """
+        with self._lock:
+            snapshot = dict((name, {'count': count})
+                            for name, count in self.counters.items())
+            snapshot.update((name, histogram.as_dict())
+                            for name, histogram in self.histograms.items())
+            return snapshot
+
+
+class LogSink(object):
+    """ Log each timing at debug level.
+    """
+
+    def timing(self, name, seconds):
+        log.debug('%s took %.3fms', name, seconds * 1000)
+
+    def incr(self, name, count=1):
+        log.debug('%s increased by %d', name, count)
+
+
+class StatsdSink(object):
+    """ Send each timing to a statsd-compatible server over UDP.
+    """
+
+    def __init__(self, host='localhost', port=8125, prefix='jcu'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def timing(self, name, seconds):
+        self.send(name, '%.3f|ms' % (seconds * 1000))
+
+    def incr(self, name, count=1):
+        self.send(name, '%d|c' % count)
+
+    def send(self, name, value):
+        name = name.replace(':', '_').replace('|', '_').replace(' ', '_')
+        data = '%s.%s:%s' % (self.prefix, name, value)
+        try:
+            self.socket.sendto(data, self.address)
+        except socket.error:
+            # Metrics are best-effort; never fail a request over them
+            pass
+
+
+class Metrics(object):
+    """ Record timings and counts to each of the configured ``sinks``.
+    """
+
+    def __init__(self, sinks):
+        self.sinks = list(sinks)
+
+    def timing(self, name, seconds):
+        for sink in self.sinks:
+            sink.timing(name, seconds)
+
+    def incr(self, name, count=1):
+        for sink in self.sinks:
+            sink.incr(name, count)
+
+    def snapshot(self):
+        """ Return histograms and counters from the first in-memory sink,
+        if any.
+        """
+        for sink in self.sinks:
+            if isinstance(sink, MemorySink):
+                return sink.snapshot()
+        return {}
+
+
+def get_metrics(registry):
+    """ Return the :class:`Metrics` for ``registry``, or ``None`` if
+    instrumentation isn't enabled.
+    """
+    return registry.queryUtility(IMetrics)
+
+
+def timed(name, fn, metrics):
+    """ Wrap the callable ``fn`` so each call is recorded as ``name``.
+
+    Iterable results are consumed within the timing, so that generator
+    callbacks are measured for the work they actually do.  Attributes of
+    ``fn`` (eg ``cache_principals``) are copied to the wrapper.
+    """
+    def wrapper(*args, **kw):
+        start = time.time()
+        try:
+            result = fn(*args, **kw)
+            if result is not None and \
+                    not isinstance(result, (list, tuple, set, frozenset)):
+                result = list(result)
+            return result
+        finally:
+            metrics.timing(name, time.time() - start)
+    wrapper.__dict__.update(getattr(fn, '__dict__', {}))
+    wrapper.__doc__ = fn.__doc__
+    return wrapper
+
+
+def instrumentation_tween_factory(handler, registry):
+    """ Tween recording the time taken to handle each request.
+    """
+    metrics = get_metrics(registry)
+
+    def instrumentation_tween(request):
+        start = time.time()
+        try:
+            return handler(request)
+        finally:
+            metrics.timing('request', time.time() - start)
+    return instrumentation_tween
+
+
+def snapshot_view(request):
+    """ Return the in-memory histograms and counters.
+    """
+    return get_metrics(request.registry).snapshot()
+
+
+def includeme(config):
+    """Include this within Pyramid to time auth and LDAP operations.
+
+    All options are shown below with their defaults, other than
+    ``snapshot_path``, which is unset by default.  Available sinks are
+    ``memory``, ``log`` and ``statsd``.  If a snapshot path is given, the
+    in-memory histograms are available there as JSON to users with the
+    ``manage`` permission.
+
+    .. code:: ini
+
+        jcu.instrumentation.enabled = false
+        jcu.instrumentation.sinks = memory
+        jcu.instrumentation.statsd_host = localhost
+        jcu.instrumentation.statsd_port = 8125
+        jcu.instrumentation.statsd_prefix = jcu
+        jcu.instrumentation.snapshot_path = /_instrumentation
+    """
+    settings = config.registry.settings
+    if not asbool(settings.get(ENABLED, False)) or \
+            get_metrics(config.registry) is not None:
+        return
+
+    sinks = []
+    for name in aslist(settings.get(SINKS, 'memory')):
+        if name == 'memory':
+            sinks.append(MemorySink())
+        elif name == 'log':
+            sinks.append(LogSink())
+        elif name == 'statsd':
+            sinks.append(StatsdSink(settings.get(STATSD_HOST, 'localhost'),
+                                    int(settings.get(STATSD_PORT, 8125)),
+                                    settings.get(STATSD_PREFIX, 'jcu')))
+        else:
+            raise ValueError('Unknown instrumentation sink: %r' % name)
+    config.registry.registerUtility(Metrics(sinks), IMetrics)
+    config.add_tween(
+        'jcu.common.instrumentation.instrumentation_tween_factory')
+
+    snapshot_path = settings.get(SNAPSHOT_PATH)
+    if snapshot_path:
+        config.add_route('jcu-instrumentation', snapshot_path)
+        config.add_view(snapshot_view,
+                        route_name='jcu-instrumentation',
+                        renderer='json',
+                        permission='manage')
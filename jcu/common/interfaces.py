@@ -0,0 +1,70 @@
+from zope.interface import Interface
+
+
+class IPrincipalCache(Interface):
+    """ Cache of groups computed by auth callbacks, keyed by user ID.
+
+    See :class:`jcu.common.cache.LRUCache` for the default implementation.
+    """
+
+    def get(key, default=None):
+        """ Return the cached groups for ``key`` or ``default``.
+        """
+
+    def set(key, value):
+        """ Store the groups ``value`` for the user ``key``.
+        """
+
+    def invalidate(key):
+        """ Drop any cached groups for the user ``key``.
+        """
+
+
+class IMetrics(Interface):
+    """ Recorder of timings and counts for instrumented code paths.
+
+    See :class:`jcu.common.instrumentation.Metrics`.
+    """
+
+    def timing(name, seconds):
+        """ Record that the operation ``name`` took ``seconds``.
+        """
+
+    def incr(name, count=1):
+        """ Add ``count`` to the counter ``name``.
+        """
+
+
+class IRoleLookupGuard(Interface):
+    """ Circuit breaker and caches around LDAP role lookups.
+
+    See :class:`jcu.common.ldap.RoleLookupGuard`.
+    """
+
+    def allow_lookup():
+        """ Return whether a lookup should be attempted now.
+        """
+
+    def succeeded(roles):
+        """ Record a successful lookup of the ``roles`` dict.
+        """
+
+    def failed():
+        """ Record a failed lookup.
+        """
+
+    def fallback(user_id):
+        """ Return roles to use for ``user_id`` if lookups are failing.
+        """
+
+
+class IThumbnailCache(Interface):
+    """ On-disk cache of image previews.
+
+    See :class:`jcu.common.tempstore.ThumbnailCache`.
+    """
+
+    def get(digest, source):
+        """ Return the path to a thumbnail of the image file ``source``, or
+        ``None`` if it can't be read as an image.
+        """
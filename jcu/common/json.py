@@ -1,19 +1,177 @@
 from __future__ import absolute_import
+import datetime
+import decimal
+import uuid
 from json import JSONEncoder
 
+
+def _isoformat(value):
+    return value.isoformat()
+
+#: Conversions for common non-JSON types, keyed by exact type
+CONVERTERS = {
+    datetime.datetime: _isoformat,
+    datetime.date: _isoformat,
+    datetime.time: _isoformat,
+    decimal.Decimal: str,
+    uuid.UUID: str,
+}
+
+#: Keys of all mapped columns, by class
+_column_plans = {}
+
+
+def column_plan(cls, columns=None):
+    """ Return a tuple of the mapped column keys for a mapped class.
+
+    If ``columns`` is given, only those keys are included, in that order.
+    The keys of all columns are computed once per class and cached
+    thereafter.  Plans for other ``columns``, which may come from clients,
+    are checked against these on each call rather than cached.
+    """
+    keys = _column_plans.get(cls)
+    if keys is None:
+        keys = _column_plans[cls] = tuple(cls.__mapper__.columns.keys())
+    if columns is None:
+        return keys
+    unknown = set(columns).difference(keys)
+    if unknown:
+        raise ValueError('%s has no columns %s' % (
+            cls.__name__, ', '.join(sorted(unknown))))
+    return tuple(columns)
+
+
+def _load_rows(rows, columns):
+    """ Return ``rows``, loading only ``columns`` if it is a query.
+    """
+    if columns is not None and hasattr(rows, 'options'):
+        from sqlalchemy.orm import load_only
+        rows = rows.options(load_only(*columns))
+    return rows
+
+
+def to_dicts(rows, columns=None):
+    """ Return a list of dicts of the loaded column values of ``rows``.
+
+    ``rows`` is a sequence of mapped objects or a query.  If ``columns`` is
+    given, only those are included and, for a query, only those are
+    selected from the database.  As with :class:`SQLAlchemyJSONEncoder`,
+    attributes that aren't loaded are left out rather than loaded lazily.
+    """
+    plans = {}
+    result = []
+    append = result.append
+    for obj in _load_rows(rows, columns):
+        cls = type(obj)
+        plan = plans.get(cls)
+        if plan is None:
+            plan = plans[cls] = column_plan(cls, columns)
+        state = obj.__dict__
+        append({key: state[key] for key in plan if key in state})
+    return result
+
+
+def to_columns(rows, columns=None):
+    """ Return a dict of lists of column values of ``rows``, by column key.
+
+    All of ``rows`` must be of the same mapped class.  Values that aren't
+    loaded are given as ``None``.  See :func:`to_dicts` for ``columns``.
+    """
+    rows = _load_rows(rows, columns)
+    plan = None
+    values = []
+    for obj in rows:
+        if plan is None:
+            cls = type(obj)
+            plan = column_plan(cls, columns)
+            values = [[] for key in plan]
+        elif type(obj) is not cls:
+            raise ValueError('Expected %s, not %s' % (
+                cls.__name__, type(obj).__name__))
+        get = obj.__dict__.get
+        for key, column in zip(plan, values):
+            column.append(get(key))
+    if plan is None:
+        return dict((key, []) for key in columns or ())
+    return dict(zip(plan, values))
+
+
 class SQLAlchemyJSONEncoder(JSONEncoder):
     """JSON encoder for mapped SQLAlchemy models.
+
+    Dates and times are encoded in ISO 8601 format, and ``Decimal`` and
+    ``UUID`` values as strings.
     """
 
     def default(self, obj):
         """Return default implementation if not mapped class, else return
         only mapped fields and values.
         """
+        converter = CONVERTERS.get(type(obj))
+        if converter is not None:
+            return converter(obj)
         if not hasattr(obj, '__mapper__'):
+            for cls, converter in CONVERTERS.items():
+                if isinstance(obj, cls):
+                    return converter(obj)
             return super(SQLAlchemyJSONEncoder, self).default(obj)
         else:
-            mapped = obj.__mapper__.columns.keys()
-            return {key: value for key, value in vars(obj).iteritems() \
-                    if key in mapped}
+            # Only include loaded attributes to avoid triggering lazy loads
+            state = vars(obj)
+            return {key: state[key] for key in column_plan(type(obj))
+                    if key in state}
 
 
+def iterencode_rows(rows, encoder=None, batch_size=1000, ndjson=False):
+    """ Encode ``rows`` as JSON, yielding one chunk per ``batch_size`` rows.
+
+    ``rows`` may be any iterable; SQLAlchemy queries are fetched
+    ``batch_size`` rows at a time via ``yield_per``.  Output is a JSON array,
+    or newline-delimited JSON objects if ``ndjson`` is true.  Chunks are
+    UTF-8 encoded strings suitable for use as a WSGI ``app_iter``.
+    """
+    if encoder is None:
+        encoder = SQLAlchemyJSONEncoder()
+    if hasattr(rows, 'yield_per'):
+        rows = rows.yield_per(batch_size)
+    encode = encoder.encode
+    separator = '\n' if ndjson else ','
+    first = True
+    batch = []
+    for row in rows:
+        batch.append(encode(row))
+        if len(batch) >= batch_size:
+            yield _chunk(batch, separator, first, ndjson)
+            first = False
+            batch = []
+    if batch:
+        yield _chunk(batch, separator, first, ndjson)
+        first = False
+    if not ndjson:
+        yield '[]' if first else ']'
+
+
+def _chunk(batch, separator, first, ndjson):
+    """ Join a batch of encoded rows into a chunk of output.
+    """
+    if ndjson:
+        data = separator.join(batch) + '\n'
+    else:
+        data = ('[' if first else ',') + separator.join(batch)
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+    return data
+
+
+def streaming_json_response(rows, encoder=None, batch_size=1000,
+                            ndjson=False):
+    """ Return a Pyramid response streaming ``rows`` as JSON.
+
+    See :func:`iterencode_rows` for arguments.
+    """
+    from pyramid.response import Response
+    content_type = 'application/x-ndjson' if ndjson else 'application/json'
+    return Response(content_type=content_type,
+                    charset='utf-8',
+                    app_iter=iterencode_rows(rows, encoder, batch_size,
+                                             ndjson))
@@ -1,33 +1,269 @@
 from __future__ import absolute_import
+import difflib
 import inspect
+import logging
+import re
+import threading
+import time
 
-from pyramid.settings import asbool
-from pyramid.path import DottedNameResolver
+import ldap
+from ldap.filter import escape_filter_chars
+from ldappool import BackendError, MaxConnectionReachedError
+from pyramid.exceptions import ConfigurationError
+from pyramid.settings import asbool, aslist
 import pyramid_ldap
 
+from jcu.common.cache import LRUCache
+from jcu.common.callbacks import degraded, io_bound
+from jcu.common.instrumentation import get_metrics
+from jcu.common.interfaces import IRoleLookupGuard
+from jcu.common.resolver import resolve_dotted
 
+#: Template for a user's DN, given their user ID
+USER_DN = 'uid=%s,ou=users,dc=jcu,dc=edu,dc=au'
+#: Maximum number of users to combine into a single groups search
+BATCH_SIZE = 50
+#: Prefix of settings for :class:`RoleLookupGuard`
+ROLES_PREFIX = 'ldap.roles.'
+#: Coercion of settings for :class:`RoleLookupGuard`
+ROLES_COERCION = {'failure_threshold': int,
+                  'reset_timeout': float,
+                  'negative_ttl': float,
+                  'max_stale': float,
+                  'fallback_groups': lambda v: aslist(v, flatten=False),
+                  'cache_size': int}
+#: Exceptions indicating the LDAP server couldn't answer a lookup
+LOOKUP_ERRORS = (ldap.LDAPError, BackendError, MaxConnectionReachedError)
+
+log = logging.getLogger(__name__)
+
+_fn_args = {}
+_MEMBER_TERM = re.compile(r'\(([\w.;-]+)=%\(userdn\)s\)')
+
+
+def normalise_dn(dn):
+    """ Strip out spaces after commas in a DN and decode it to unicode.
+
+    This causes problems since LDAP ignores spaces, but string matching in
+    ACLs do not.
+    """
+    if isinstance(dn, str):
+        dn = dn.decode('utf-8')
+    return dn.replace(', ', ',')
+
+
+class RoleLookupGuard(object):
+    """ Protects requests from a slow or unavailable LDAP server.
+
+    After ``failure_threshold`` consecutive failed lookups, the circuit
+    opens and lookups are skipped for ``reset_timeout`` seconds, after which
+    a single lookup is let through to test the server again.  Whilst open
+    or on failure, each user's last known roles are served, provided they
+    were found within ``max_stale`` seconds, or ``fallback_groups`` if
+    not.  These are marked :func:`jcu.common.callbacks.degraded`, so aren't
+    cached as the user's groups.  Users found to have no roles aren't
+    looked up again for ``negative_ttl`` seconds.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30,
+                 negative_ttl=60, fallback_groups=(), cache_size=10000,
+                 max_stale=3600, clock=time.time):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.fallback_groups = [normalise_dn(dn) for dn in fallback_groups]
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.last_known = LRUCache(max_size=cache_size, ttl=max_stale,
+                                   clock=clock)
+        self.no_roles = LRUCache(max_size=cache_size, ttl=negative_ttl,
+                                 clock=clock)
+        self._lock = threading.Lock()
+
+    def allow_lookup(self):
+        """ Return whether a lookup should be attempted now.
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self.clock() - self.opened_at >= self.reset_timeout:
+                # Half-open: let this lookup through and re-arm the timer
+                self.opened_at = self.clock()
+                return True
+            return False
+
+    def succeeded(self, roles):
+        """ Record a successful lookup of ``roles`` for each user.
+        """
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+        for user_id, groups in roles.items():
+            if groups:
+                self.last_known.set(user_id, groups)
+            else:
+                self.no_roles.set(user_id, True)
+
+    def failed(self):
+        """ Record a failed lookup, opening the circuit if need be.
+        """
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold and \
+                    self.opened_at is None:
+                log.warning("LDAP role lookups failed %d times; serving "
+                            "cached roles for %ss", self.failures,
+                            self.reset_timeout)
+                self.opened_at = self.clock()
+
+    def fallback(self, user_id):
+        """ Return the last known roles for ``user_id`` or the fallback,
+        marked as degraded.
+        """
+        return degraded(self.last_known.get(user_id) or
+                        self.fallback_groups)
+
+
+def resolve_ldap_roles(user_ids,
+                       request,
+                       batch_size=BATCH_SIZE,
+                       _groupfinder=pyramid_ldap.groupfinder):
+    """ Return a dict mapping each of ``user_ids`` to their LDAP role DNs.
+
+    A single user is looked up via ``_groupfinder``, and so the groups
+    query.  Several users are looked up ``batch_size`` at a time by
+    rewriting the member term of the configured groups query (eg
+    ``(roleOccupant=%(userdn)s)``) into an OR of every user's DN, using a
+    single pooled connection.  These searches are cached for the groups
+    query's ``cache_period`` and decoded as ``pyramid_ldap`` does.  If the
+    groups query has no such term, each user is looked up in turn via
+    ``_groupfinder`` instead.
+
+    If a :class:`RoleLookupGuard` is configured, failures are absorbed by
+    it and users known to have no roles are skipped.  Roles it serves in
+    place of a lookup are marked :func:`jcu.common.callbacks.degraded`.
+    """
+    user_ids = sorted(set(user_ids))
+    guard = request.registry.queryUtility(IRoleLookupGuard)
+    if guard is None:
+        return _lookup_ldap_roles(user_ids, request, batch_size,
+                                  _groupfinder)
+
+    roles = dict((user_id, []) for user_id in user_ids
+                 if user_id in guard.no_roles)
+    pending = [user_id for user_id in user_ids if user_id not in roles]
+    if not pending:
+        return roles
+    if guard.allow_lookup():
+        try:
+            found = _lookup_ldap_roles(pending, request, batch_size,
+                                       _groupfinder)
+        except LOOKUP_ERRORS:
+            log.debug('LDAP role lookup failed', exc_info=True)
+            guard.failed()
+        else:
+            guard.succeeded(found)
+            roles.update(found)
+            return roles
+    roles.update((user_id, guard.fallback(user_id)) for user_id in pending)
+    return roles
+
+
+def _lookup_ldap_roles(user_ids, request, batch_size, _groupfinder):
+    """ Look up roles as per :func:`resolve_ldap_roles`, unguarded.
+    """
+    roles = dict((user_id, []) for user_id in user_ids)
+    metrics = get_metrics(request.registry)
+    search = getattr(request.registry, 'ldap_groups_query', None)
+    match = search and _MEMBER_TERM.search(search.filter_tmpl)
+
+    if len(user_ids) == 1 or not match or '%(' in search.base_dn:
+        for user_id in user_ids:
+            start = time.time()
+            groups = _groupfinder(USER_DN % user_id, request)
+            if metrics is not None:
+                metrics.timing('ldap.groupfinder', time.time() - start)
+            if groups is None:
+                # pyramid_ldap swallows LDAP errors and returns None
+                raise ldap.LDAPError('Group lookup failed for %s' % user_id)
+            roles[user_id] = [normalise_dn(group) for group in groups]
+        return roles
+
+    attribute = match.group(1)
+    query = _batch_query(request.registry, search, match)
+    connector = pyramid_ldap.get_ldap_connector(request)
+    with connector.manager.connection() as conn:
+        for offset in range(0, len(user_ids), batch_size):
+            batch = user_ids[offset:offset + batch_size]
+            dns = dict((normalise_dn(USER_DN % user_id).lower(), user_id)
+                       for user_id in batch)
+            members = ''.join(
+                '(%s=%s)' % (attribute, escape_filter_chars(USER_DN % uid))
+                for uid in batch)
+            start = time.time()
+            results = pyramid_ldap._ldap_decode(
+                query.execute(conn, members=members))
+            if metrics is not None:
+                metrics.timing('ldap.groups_query', time.time() - start)
+            for dn, attrs in results:
+                if dn is None:
+                    # Search continuation references
+                    continue
+                values = [v for k, v in attrs.items()
+                          if k.lower() == attribute.lower()]
+                for member in (values and values[0] or ()):
+                    user_id = dns.get(normalise_dn(member).lower())
+                    if user_id is not None:
+                        roles[user_id].append(normalise_dn(dn))
+    return roles
+
+
+def _batch_query(registry, search, match):
+    """ Return a query for the groups of many users, like ``search``.
+
+    The query is built once per groups query, so that its results are
+    cached for the same ``cache_period``.
+    """
+    batch = getattr(registry, 'jcu_ldap_batch_query', None)
+    if batch is None or batch[0] is not search:
+        filter_tmpl = (search.filter_tmpl[:match.start()] +
+                       '(|%(members)s)' + search.filter_tmpl[match.end():])
+        batch = registry.jcu_ldap_batch_query = (
+            search, pyramid_ldap._LDAPQuery(search.base_dn, filter_tmpl,
+                                            search.scope,
+                                            search.cache_period))
+    return batch[1]
+
+
+@io_bound
 def verify_ldap_roles(identity,
                       request,
                       _groupfinder=pyramid_ldap.groupfinder):
     """ Return groups to indicate the LDAP roles that a user has.
 
-    This strips out spaces from DNs from LDAP. This causes problems since
-    LDAP ignores spaces, but string matching in ACLs do not.
+    See :func:`resolve_ldap_roles` for how roles are looked up.
     """
     user_id = identity['repoze.who.userid']
-    groups = _groupfinder('uid=' + user_id + ',ou=users,dc=jcu,dc=edu,dc=au',
-                          request)
-    for group in groups:
-        yield group.replace(', ', ',')
+    return resolve_ldap_roles([user_id], request,
+                              _groupfinder=_groupfinder)[user_id]
 
 
 def extract_settings(settings, prefix, keys=()):
     """ Extract options from a settings structure, stripping the ``prefix``.
     """
-    kwarg_names = [prefix + k for k in keys]
+    keys = frozenset(keys)
     size = len(prefix)
-    return dict(((k[size:], settings[k]) for k in settings.keys()
-                 if k in kwarg_names))
+    return dict((k[size:], v) for k, v in settings.items()
+                if k.startswith(prefix) and k[size:] in keys)
+
+
+def fn_args(fn):
+    """ Return the argument names of ``fn``, introspecting it only once.
+    """
+    args = _fn_args.get(fn)
+    if args is None:
+        args = _fn_args[fn] = tuple(inspect.getargspec(fn).args)
+    return args
 
 
 def extract_settings_fn_args(settings, prefix, fn):
@@ -36,8 +272,55 @@ def extract_settings_fn_args(settings, prefix, fn):
     This method inspects the given callable and uses its arguments to
     determine the keys to extract from the settings.
     """
-    keys = inspect.getargspec(fn).args
-    return extract_settings(settings, prefix, keys)
+    return extract_settings(settings, prefix, fn_args(fn))
+
+
+def index_settings(settings, prefixes):
+    """ Group ``settings`` by which of ``prefixes`` they start with.
+
+    Returns a dict of each prefix to a dict of its options, with the
+    prefix stripped, built in a single pass over ``settings``.  Where
+    prefixes overlap, each key belongs only to the longest matching one.
+    """
+    index = dict((prefix, {}) for prefix in prefixes)
+    longest_first = sorted(prefixes, key=len, reverse=True)
+    for key, value in settings.items():
+        for prefix in longest_first:
+            if key.startswith(prefix):
+                index[prefix][key[len(prefix):]] = value
+                break
+    return index
+
+
+def validate_settings(settings, prefix, allowed):
+    """ Raise a ``ConfigurationError`` if any of ``settings`` aren't allowed.
+
+    ``settings`` are the options found under ``prefix``, with the prefix
+    stripped, and ``allowed`` the names of options that are understood.
+    Close matches are suggested for mistyped options.
+    """
+    unknown = sorted(set(settings) - set(allowed))
+    if unknown:
+        messages = []
+        for key in unknown:
+            message = prefix + key
+            matches = difflib.get_close_matches(key, allowed, 1)
+            if matches:
+                message += ' (did you mean %s%s?)' % (prefix, matches[0])
+            messages.append(message)
+        raise ConfigurationError('Unknown LDAP settings: %s' %
+                                 ', '.join(messages))
+    return settings
+
+
+def fn_settings(index, prefix, fn):
+    """ Return validated options from ``index`` under ``prefix`` for ``fn``.
+
+    ``index`` is the result of :func:`index_settings`.  The ``config``
+    argument of configurator directives isn't available as an option.
+    """
+    allowed = [arg for arg in fn_args(fn) if arg != 'config']
+    return validate_settings(index[prefix], prefix, allowed)
 
 
 def coerce_settings(settings, coercion):
@@ -66,7 +349,7 @@ def as_ldap_scope(value):
     or will accept the the specific integer relating to the value.
     """
     try:
-        return DottedNameResolver().resolve(value)
+        return resolve_dotted(value)
     except ImportError:
         try:
             return int(value)
@@ -125,15 +408,38 @@ def includeme(config):
             (&(cn=RoleName)(roleOccupant=${userdn}))
         ldap.groups_query.scope = ldap.SCOPE_SUBTREE
         ldap.groups_query.cache_period = 600
+
+    If any ``ldap.roles.`` options are given, role lookups are protected by
+    a :class:`RoleLookupGuard`, so that an LDAP outage doesn't hold up
+    every request.  The defaults are as follows, other than
+    ``fallback_groups`` (one DN per line), which is empty by default.
+
+    .. code:: ini
+
+        ldap.roles.failure_threshold = 5
+        ldap.roles.reset_timeout = 30
+        ldap.roles.negative_ttl = 60
+        ldap.roles.max_stale = 3600
+        ldap.roles.cache_size = 10000
+        ldap.roles.fallback_groups =
+            cn=Guest,ou=org,dc=example,dc=com
     """
     config.include('pyramid_ldap')
 
+    settings = config.registry.settings
+    setup_prefix = settings.get('pyramid_ldap.setup.prefix', 'ldap.setup.')
+    login_query_prefix = settings.get('pyramid_ldap.login_query.prefix',
+                                      'ldap.login_query.')
+    groups_query_prefix = settings.get('pyramid_ldap.groups_query.prefix',
+                                       'ldap.groups_query.')
+    index = index_settings(settings, (setup_prefix,
+                                      login_query_prefix,
+                                      groups_query_prefix,
+                                      ROLES_PREFIX))
+
     # General LDAP setup
-    prefix = config.registry.settings.get('pyramid_ldap.setup.prefix',
-                                          'ldap.setup.')
-    setup_settings = extract_settings_fn_args(config.registry.settings,
-                                              prefix,
-                                              pyramid_ldap.ldap_setup)
+    setup_settings = fn_settings(index, setup_prefix,
+                                 pyramid_ldap.ldap_setup)
 
     if setup_settings:
         setup_coercion = {'pool_size': int,
@@ -145,12 +451,8 @@ def includeme(config):
         config.ldap_setup(**coerce_settings(setup_settings, setup_coercion))
 
     # Configure LDAP Login query
-    prefix = config.registry.settings.get('pyramid_ldap.login_query.prefix',
-                                          'ldap.login_query.')
-    login_query_settings = extract_settings_fn_args(
-        config.registry.settings,
-        prefix,
-        pyramid_ldap.ldap_set_login_query)
+    login_query_settings = fn_settings(index, login_query_prefix,
+                                       pyramid_ldap.ldap_set_login_query)
 
     if login_query_settings:
         # Ensure ``filter_tmpl`` is converted for string formatting of login
@@ -162,12 +464,8 @@ def includeme(config):
         config.ldap_set_login_query(**coerce_settings(login_query_settings,
                                                       login_query_coercion))
     # Configure LDAP Groups query
-    prefix = config.registry.settings.get('pyramid_ldap.groups_query.prefix',
-                                          'ldap.groups_query.')
-    groups_query_settings = extract_settings_fn_args(
-        config.registry.settings,
-        prefix,
-        pyramid_ldap.ldap_set_groups_query)
+    groups_query_settings = fn_settings(index, groups_query_prefix,
+                                        pyramid_ldap.ldap_set_groups_query)
 
     if groups_query_settings:
         # Ensure ``filter_tmpl`` is converted for string formatting of userdn
@@ -178,3 +476,11 @@ def includeme(config):
         }
         config.ldap_set_groups_query(**coerce_settings(groups_query_settings,
                                                        groups_query_coercion))
+
+    # Protect role lookups from LDAP outages
+    roles_settings = validate_settings(index[ROLES_PREFIX], ROLES_PREFIX,
+                                       ROLES_COERCION.keys())
+    if roles_settings:
+        guard = RoleLookupGuard(**coerce_settings(roles_settings,
+                                                  ROLES_COERCION))
+        config.registry.registerUtility(guard, IRoleLookupGuard)
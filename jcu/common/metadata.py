@@ -0,0 +1,164 @@
+from __future__ import absolute_import
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from zope.interface import implements
+from repoze.who.plugins.metadata_cache.base import (MetadataCachePluginBase,
+                                                    IMetadataCache)
+
+from jcu.common.cache import LRUCache
+
+
+class MemoryBackend(object):
+    """ Bounded, in-process store for cached metadata.
+    """
+
+    def __init__(self, max_size=1000, ttl=None):
+        self.cache = LRUCache(max_size=max_size, ttl=ttl)
+
+    def fetch(self, key):
+        return self.cache.get(key)
+
+    def store(self, key, value):
+        self.cache.set(key, value)
+
+    def stats(self):
+        return self.cache.stats()
+
+
+class SQLiteBackend(object):
+    """ Store for cached metadata shared by all processes on a host.
+
+    Metadata is kept as JSON in the SQLite database at ``path``, which is
+    created (along with its directory) if necessary.  Entries older than
+    ``ttl`` seconds are ignored, and every so often the oldest entries
+    beyond ``max_size`` are removed.
+    """
+
+    #: Number of stores between removals of expired and excess entries
+    prune_interval = 100
+
+    def __init__(self, path, max_size=10000, ttl=None):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._stores = 0
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        # Set up with a connection of its own, so none is left open to be
+        # inherited by worker processes forked after configuration
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            with conn:
+                conn.execute('CREATE TABLE IF NOT EXISTS metadata '
+                             '(key TEXT PRIMARY KEY, value TEXT, '
+                             'stored REAL)')
+                conn.execute('CREATE INDEX IF NOT EXISTS metadata_stored '
+                             'ON metadata (stored)')
+        finally:
+            conn.close()
+
+    def _connection(self):
+        """ Return this thread's connection to the database.
+
+        Connections must not be used across a fork, so one made in another
+        process is replaced rather than reused.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=5)
+            self._local.pid = os.getpid()
+        return conn
+
+    def fetch(self, key):
+        row = self._connection().execute(
+            'SELECT value, stored FROM metadata WHERE key = ?',
+            (key,)).fetchone()
+        if row is None or (self.ttl and row[1] + self.ttl <= time.time()):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def store(self, key, value):
+        with self._connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO metadata VALUES (?, ?, ?)',
+                         (key, json.dumps(value), time.time()))
+            self._stores += 1
+            if self._stores % self.prune_interval == 0:
+                self.prune(conn)
+
+    def prune(self, conn):
+        """ Remove expired entries and the oldest entries beyond max_size.
+        """
+        if self.ttl:
+            conn.execute('DELETE FROM metadata WHERE stored <= ?',
+                         (time.time() - self.ttl,))
+        conn.execute('DELETE FROM metadata WHERE key NOT IN '
+                     '(SELECT key FROM metadata ORDER BY stored DESC '
+                     'LIMIT ?)', (self.max_size,))
+
+    def stats(self):
+        size = self._connection().execute(
+            'SELECT COUNT(*) FROM metadata').fetchone()[0]
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'size': size,
+                'max_size': self.max_size}
+
+
+class MetadataCachePlugin(MetadataCachePluginBase):
+    """ ``repoze.who`` metadata cache plugin with a pluggable backend.
+
+    A drop-in replacement for ``repoze.who.plugins.metadata_cache.memory``
+    that stores attributes in any object with ``fetch``, ``store`` and
+    ``stats`` methods, such as :class:`MemoryBackend` or
+    :class:`SQLiteBackend`.
+    """
+    implements(IMetadataCache)
+
+    def __init__(self, name='attributes', backend=None):
+        super(MetadataCachePlugin, self).__init__(name=name)
+        self.backend = backend or MemoryBackend()
+
+    def get_attributes(self, environ, identity):
+        return identity.get(self.name)
+
+    def store(self, key, value):
+        self.backend.store(key, value)
+
+    def fetch(self, key):
+        value = self.backend.fetch(key)
+        return {} if value is None else value
+
+    def stats(self):
+        """ Return hit and miss counts and size of the backend.
+        """
+        return self.backend.stats()
+
+
+def make_plugin(name='attributes', backend='memory', path=None,
+                max_size='1000', ttl=None):
+    """ Create a :class:`MetadataCachePlugin` from ``who.ini`` options.
+
+    ``backend`` is either ``memory`` or ``sqlite``, the latter requiring a
+    database ``path``.  ``ttl`` is in seconds; entries never expire if it
+    is omitted.
+    """
+    ttl = float(ttl) if ttl else None
+    if backend == 'memory':
+        store = MemoryBackend(max_size=int(max_size), ttl=ttl)
+    elif backend == 'sqlite':
+        if not path:
+            raise ValueError('The sqlite metadata cache requires a path')
+        store = SQLiteBackend(path, max_size=int(max_size), ttl=ttl)
+    else:
+        raise ValueError('Unknown metadata cache backend: %r' % backend)
+    return MetadataCachePlugin(name=name, backend=store)
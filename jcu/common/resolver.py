@@ -1,7 +1,19 @@
 from pyramid.path import DottedNameResolver
 
+_resolver = DottedNameResolver()
+_resolved = {}
+
+
 def resolve_dotted(dotted, default=None):
     """ Resolve a dotted class string into an actual callable.
-    """
-    return DottedNameResolver().resolve(dotted) if dotted else default
 
+    Each dotted name is only resolved once; later calls return the same
+    object.
+    """
+    if not dotted:
+        return default
+    try:
+        return _resolved[dotted]
+    except KeyError:
+        obj = _resolved[dotted] = _resolver.resolve(dotted)
+        return obj
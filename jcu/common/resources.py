@@ -1,4 +1,235 @@
-from fanstatic import Library, Resource
+""" Fanstatic resources, and serving of them with far-future caching.
+
+Wrap your application with :func:`fanstatic_app` (or the ``fanstatic``
+Paste filter from this package) to have resources served from URLs
+fingerprinted by their content, bundled where possible, and compressed
+ahead of time by :func:`compress_library`.
+"""
+from __future__ import print_function
+import gzip
+import io
+import os
+import sys
+
+import fanstatic
+from fanstatic import (BUNDLE_PREFIX, VERSION_PREFIX, ConfigurationError,
+                       Delegator, Injector, Library, LibraryRegistry,
+                       Publisher, Resource, get_library_registry)
+from fanstatic.config import convert_config
+from fanstatic.registry import InjectorRegistry
+from webob import Request
+
+from jcu.common.cache import LRUCache
 
 library = Library('jcu.common', 'static')
 alerts = Resource(library, 'bootstrap-alerts.css')
+
+#: Fanstatic options applied by :func:`fanstatic_app` unless overridden
+FANSTATIC_DEFAULTS = {
+    'versioning': True,
+    'versioning_use_md5': True,
+    'recompute_hashes': False,
+    'bundle': True,
+}
+#: Extensions of files worth compressing
+COMPRESSIBLE = ('.css', '.js', '.map', '.json', '.svg', '.html', '.txt',
+                '.xml', '.ttf', '.eot')
+#: Content encodings and file suffixes of compressed variants, by preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+#: Files smaller than this many bytes aren't compressed
+MIN_SIZE = 256
+
+
+def _gzip(data):
+    """ Return ``data`` gzipped, without a timestamp so output is stable.
+    """
+    buf = io.BytesIO()
+    with gzip.GzipFile(filename='', mode='wb', fileobj=buf, mtime=0) as out:
+        out.write(data)
+    return buf.getvalue()
+
+
+def _compressors():
+    """ Return available compressors by file suffix.
+    """
+    compressors = {'.gz': _gzip}
+    try:
+        import brotli
+    except ImportError:
+        pass
+    else:
+        compressors['.br'] = brotli.compress
+    return compressors
+
+
+def compress_library(library, min_size=MIN_SIZE):
+    """ Write compressed variants of each compressible file in ``library``.
+
+    Files are gzipped, and compressed with Brotli too if the ``brotli``
+    module is installed.  Variants are written next to the original as
+    ``.gz`` or ``.br``, only where they are smaller, and only rewritten if
+    the original has since changed.  Returns the paths written.
+    """
+    compressors = _compressors()
+    written = []
+    for dirpath, dirnames, filenames in os.walk(library.path):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if not filename.endswith(COMPRESSIBLE) or \
+                    os.path.getsize(path) < min_size:
+                continue
+            mtime = os.path.getmtime(path)
+            data = None
+            for suffix, compress in compressors.items():
+                target = path + suffix
+                if os.path.exists(target) and \
+                        os.path.getmtime(target) >= mtime:
+                    continue
+                if data is None:
+                    with open(path, 'rb') as source:
+                        data = source.read()
+                compressed = compress(data)
+                if len(compressed) < len(data):
+                    with open(target, 'wb') as output:
+                        output.write(compressed)
+                    written.append(target)
+                elif os.path.exists(target):
+                    os.remove(target)
+    return written
+
+
+def _is_fresh(variant, path):
+    """ Return whether ``variant`` exists and is no older than ``path``.
+    """
+    try:
+        return os.path.getmtime(variant) >= os.path.getmtime(path)
+    except OSError:
+        return False
+
+
+def _accepts(request, encoding):
+    """ Return whether ``request`` explicitly accepts ``encoding``.
+    """
+    return 'Accept-Encoding' in request.headers and \
+        encoding in request.accept_encoding
+
+
+class PrecompressedPublisher(object):
+    """ Serve compressed variants of files from a Fanstatic ``publisher``.
+
+    Where the browser accepts it and :func:`compress_library` has written
+    a Brotli or gzip variant of the requested file since it last changed,
+    the variant is served in place of the original.  Bundles are gzipped on first request and
+    kept in memory.
+    """
+
+    def __init__(self, publisher, registry=None, bundle_cache_size=100):
+        self.publisher = publisher
+        self.registry = registry or LibraryRegistry.instance()
+        self.bundles = LRUCache(max_size=bundle_cache_size)
+
+    def __call__(self, environ, start_response):
+        request = Request(environ)
+        path_info = request.path_info
+        response = request.get_response(self.publisher)
+        if response.status_int == 200 and request.range is None:
+            if BUNDLE_PREFIX in path_info:
+                self.compress_bundle(request, path_info, response)
+            else:
+                self.use_variant(request, self.file_path(path_info),
+                                 response)
+        return response(environ, start_response)
+
+    def file_path(self, path_info):
+        """ Return the path to the file published at ``path_info``.
+        """
+        parts = path_info.lstrip('/').split('/')
+        library = self.registry.get(parts[0])
+        if library is None:
+            return None
+        parts = parts[1:]
+        if parts and parts[0].startswith(VERSION_PREFIX):
+            parts = parts[1:]
+        root = os.path.abspath(library.path)
+        path = os.path.abspath(os.path.join(root, *parts))
+        if path.startswith(root + os.sep):
+            return path
+
+    def use_variant(self, request, path, response):
+        if path is None:
+            return
+        for encoding, suffix in ENCODINGS:
+            variant = path + suffix
+            # Variants older than the original were compressed from a
+            # previous version of it
+            if _accepts(request, encoding) and _is_fresh(variant, path):
+                close = getattr(response.app_iter, 'close', None)
+                if close is not None:
+                    close()
+                with open(variant, 'rb') as variant_file:
+                    response.body = variant_file.read()
+                self.encoded(response, encoding)
+                return
+        response.vary = ('Accept-Encoding',)
+
+    def compress_bundle(self, request, path_info, response):
+        response.vary = ('Accept-Encoding',)
+        if not _accepts(request, 'gzip'):
+            return
+        body = self.bundles.get(path_info)
+        if body is None:
+            body = _gzip(response.body)
+            self.bundles.set(path_info, body)
+        response.body = body
+        self.encoded(response, 'gzip')
+
+    def encoded(self, response, encoding):
+        response.content_encoding = encoding
+        response.vary = ('Accept-Encoding',)
+        if response.etag:
+            response.etag = '%s-%s' % (response.etag, encoding)
+
+
+def fanstatic_app(app, publisher_signature=None, injector=None, **config):
+    """ Wrap ``app`` with Fanstatic, serving compressed variants.
+
+    Options are as for ``fanstatic.Fanstatic``, defaulting to
+    :data:`FANSTATIC_DEFAULTS`: URLs carry a hash of each library's
+    content (so may be cached forever) and resources are bundled.
+    """
+    signature = publisher_signature or fanstatic.DEFAULT_SIGNATURE
+    options = dict(FANSTATIC_DEFAULTS)
+    options.update(config)
+    injector_middleware = Injector(app, publisher_signature=signature,
+                                   injector=injector, **options)
+    registry = LibraryRegistry.instance()
+    publisher = PrecompressedPublisher(Publisher(registry), registry)
+    return Delegator(injector_middleware, publisher,
+                     publisher_signature=signature)
+
+
+def make_fanstatic(app, global_config, **local_config):
+    """ Paste filter factory for :func:`fanstatic_app`.
+    """
+    local_config = convert_config(local_config)
+    injector_name = local_config.pop('injector', 'topbottom')
+    injector_factory = InjectorRegistry.instance().get(injector_name)
+    if injector_factory is None:
+        raise ConfigurationError(
+            'No injector found for name %s' % injector_name)
+    options = dict(FANSTATIC_DEFAULTS)
+    options.update(local_config)
+    return fanstatic_app(app, injector=injector_factory(options), **options)
+
+
+def main(argv=None):
+    """ Compress the named Fanstatic libraries, or all of them.
+    """
+    names = sys.argv[1:] if argv is None else argv
+    registry = get_library_registry()
+    for name in names or sorted(registry.keys()):
+        for path in compress_library(registry[name]):
+            print(path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+""" Compact, size-limited Beaker sessions for Pyramid.
+
+Include this module in place of ``pyramid_beaker`` to serialise sessions
+with :class:`CompactSerializer`, write sessions only when their data has
+actually changed, and warn about (or refuse to store) sessions that grow
+beyond ``jcu.session.max_size`` bytes.
+"""
+from __future__ import absolute_import
+import hashlib
+import json
+import logging
+import math
+import pickle
+import threading
+import time
+import zlib
+
+from pyramid.settings import asbool
+from pyramid_beaker import (BeakerSessionFactoryConfig,
+                            session_factory_from_settings as
+                            beaker_factory_from_settings)
+
+from jcu.common.instrumentation import get_metrics
+
+MAX_SIZE = 'jcu.session.max_size'
+OVERSIZED = 'jcu.session.oversized'
+COMPRESS_SIZE = 'jcu.session.compress_size'
+SKIP_UNCHANGED = 'jcu.session.skip_unchanged'
+
+#: Leading byte of data written by :class:`CompactSerializer`
+VERSION = b'\x01'
+#: Formats of the payload following :data:`VERSION`
+JSON, PICKLE, JSON_ZLIB, PICKLE_ZLIB = b'j', b'p', b'J', b'P'
+#: Payloads smaller than this many bytes aren't compressed
+MIN_COMPRESS_SIZE = 128
+#: Keys Beaker maintains itself, ignored when checking for changes
+BOOKKEEPING_KEYS = frozenset(['_accessed_time', '_creation_time',
+                              '_expires'])
+#: What to do with sessions over the size budget
+OVERSIZED_ACTIONS = ('log', 'drop')
+
+log = logging.getLogger(__name__)
+
+
+def _is_json(value):
+    """ Return whether ``value`` reads back from JSON as an equal value of
+    exactly the same types.
+
+    Byte strings (read back as unicode), tuples (as lists), longs, dict
+    keys other than unicode, non-finite floats and subclasses of these
+    types all aren't.
+    """
+    kind = type(value)
+    if kind in (unicode, int, bool) or value is None:
+        return True
+    if kind is float:
+        return not (math.isinf(value) or math.isnan(value))
+    if kind is list:
+        return all(_is_json(item) for item in value)
+    if kind is dict:
+        return all(type(key) is unicode and _is_json(item)
+                   for key, item in value.items())
+    return False
+
+
+class CompactSerializer(object):
+    """ Versioned session serialiser, for Beaker's ``data_serializer``.
+
+    Data is written as compact JSON where it would be read back unchanged
+    (see :func:`_is_json`), otherwise as a pickle, and compressed with zlib
+    once it reaches ``compress_size`` bytes.  A leading version byte allows
+    the format to change later; data without it is read as a pickle, as
+    Beaker writes by default.
+    """
+
+    def __init__(self, compress_size=MIN_COMPRESS_SIZE, level=6):
+        self.compress_size = compress_size
+        self.level = level
+
+    def encode(self, data):
+        """ Return the format and uncompressed payload for ``data``.
+        """
+        if _is_json(data):
+            return JSON, json.dumps(data, separators=(',', ':'),
+                                    sort_keys=True)
+        return PICKLE, pickle.dumps(data, 2)
+
+    def dumps(self, data):
+        return self.pack(*self.encode(data))
+
+    def pack(self, fmt, payload):
+        """ Return ``payload`` from :meth:`encode`, compressed if worthwhile
+        and marked with its format and version.
+        """
+        if len(payload) >= self.compress_size:
+            compressed = zlib.compress(payload, self.level)
+            if len(compressed) < len(payload):
+                fmt, payload = fmt.upper(), compressed
+        return VERSION + fmt + payload
+
+    def loads(self, data):
+        if data[:1] != VERSION:
+            return pickle.loads(data)
+        fmt, payload = data[1:2], data[2:]
+        if fmt in (JSON_ZLIB, PICKLE_ZLIB):
+            payload = zlib.decompress(payload)
+        if fmt.lower() == JSON:
+            return json.loads(payload)
+        return pickle.loads(payload)
+
+
+class SessionBudget(object):
+    """ Per-session size limit, and a record of sessions exceeding it.
+
+    ``oversized`` counts sessions found over ``max_size`` bytes and
+    ``largest`` is the biggest size seen.  With the ``drop`` action,
+    changes that would take a session over budget aren't saved.
+    """
+
+    def __init__(self, max_size=4096, action='log'):
+        if action not in OVERSIZED_ACTIONS:
+            raise ValueError('Unknown oversized session action: %r' % action)
+        self.max_size = max_size
+        self.action = action
+        self.oversized = 0
+        self.largest = 0
+        self._lock = threading.Lock()
+
+    def check(self, size, data):
+        """ Record a session of ``size`` bytes and return whether to save it.
+        """
+        if size <= self.max_size:
+            return True
+        with self._lock:
+            self.oversized += 1
+            self.largest = max(self.largest, size)
+        sizes = sorted(((len(repr(value)), key)
+                        for key, value in data.items()), reverse=True)
+        log.warning('Session of %d bytes exceeds budget of %d bytes; '
+                    'largest keys: %s', size, self.max_size,
+                    ', '.join('%s (~%d)' % (key, length)
+                              for length, key in sizes[:3]))
+        return self.action != 'drop'
+
+
+def _data(session):
+    return dict((key, value) for key, value in session.items()
+                if key not in BOOKKEEPING_KEYS)
+
+
+def _compact(base, serializer, budget, metrics, skip_unchanged):
+    """ Return a subclass of the pyramid_beaker session class ``base``
+    saving only changed sessions, within ``budget``.
+    """
+
+    class CompactSessionObject(base):
+
+        def _session(self):
+            loaded = self.__dict__['_sess'] is None
+            session = base._session(self)
+            if loaded and skip_unchanged:
+                self.__dict__['_fingerprint'] = self.fingerprint(
+                    session, serializer.encode(_data(session))[1])
+            return session
+
+        def fingerprint(self, session, payload):
+            return (getattr(session, 'id', None),
+                    hashlib.sha1(payload).digest())
+
+        def persist(self):
+            if self.dirty() and not self.changes_saveable():
+                self.__dict__['_dirty'] = False
+            base.persist(self)
+            params = self.__dict__['_params']
+            if not (self.dirty() or self._session().is_new or
+                    params.get('auto') or
+                    params.get('save_accessed_time', True)):
+                # Cookie sessions are re-encoded as they're loaded; don't
+                # send them again if nothing is being saved
+                self.__dict__['_headers']['set_cookie'] = False
+
+        def changes_saveable(self):
+            """ Return whether the session's data should be saved.
+            """
+            session = self._session()
+            data = _data(session)
+            start = time.time()
+            fmt, payload = serializer.encode(data)
+            if skip_unchanged and self.fingerprint(session, payload) == \
+                    self.__dict__.get('_fingerprint'):
+                return False
+            if budget is None:
+                return True
+            # Compress the payload already encoded for the fingerprint
+            size = len(serializer.pack(fmt, payload))
+            if metrics is not None:
+                metrics.timing('session.serialize', time.time() - start)
+                if size > budget.max_size:
+                    metrics.incr('session.oversized')
+            return budget.check(size, data)
+
+    CompactSessionObject.budget = budget
+    return CompactSessionObject
+
+
+def CompactSessionFactoryConfig(serializer=None, budget=None, metrics=None,
+                                skip_unchanged=True, **options):
+    """ Return a Pyramid session factory using Beaker session settings
+    supplied directly as ``**options``, storing data with ``serializer``.
+
+    Sessions are written only if their data differs from that loaded,
+    even if marked as changed, unless ``skip_unchanged`` is false.  Sizes
+    are checked against the :class:`SessionBudget` ``budget`` and timed to
+    ``metrics``, if given.
+    """
+    serializer = serializer or CompactSerializer()
+    options.setdefault('data_serializer', serializer)
+    return _compact(BeakerSessionFactoryConfig(**options), serializer,
+                    budget, metrics, skip_unchanged)
+
+
+def session_factory_from_settings(settings, registry=None):
+    """ Return a Pyramid session factory from Beaker's ``session.*``
+    settings and this module's ``jcu.session.*`` settings.
+
+    Sizes are recorded to the ``jcu.common.instrumentation`` metrics of
+    ``registry``, if given and enabled.
+    """
+    serializer = CompactSerializer(
+        int(settings.get(COMPRESS_SIZE, MIN_COMPRESS_SIZE)))
+    budget = None
+    if settings.get(MAX_SIZE):
+        budget = SessionBudget(int(settings[MAX_SIZE]),
+                               settings.get(OVERSIZED, 'log'))
+    metrics = get_metrics(registry) if registry is not None else None
+    # Beaker's own settings are parsed as by pyramid_beaker
+    base = beaker_factory_from_settings(settings)
+    base._options.setdefault('data_serializer', serializer)
+    return _compact(base, serializer, budget, metrics,
+                    asbool(settings.get(SKIP_UNCHANGED, True)))
+
+
+def includeme(config):
+    """Include this within Pyramid, in place of ``pyramid_beaker``, to use
+    compact Beaker sessions.
+
+    Beaker's ``session.*`` settings are used as for ``pyramid_beaker``,
+    although ``session.data_serializer`` defaults to
+    :class:`CompactSerializer`.  Beaker only applies this serialiser to
+    cookie sessions, or other sessions with ``session.encrypt_key`` set.
+    Options and their defaults are as follows; without ``max_size``, sizes
+    aren't checked.
+
+    .. code:: ini
+
+        jcu.session.max_size = 4096
+        jcu.session.oversized = log
+        jcu.session.compress_size = 128
+        jcu.session.skip_unchanged = true
+
+    Set ``oversized`` to ``drop`` to keep the last saved session rather
+    than saving changes that take it over ``max_size``.  The session
+    factory's ``budget`` counts oversized sessions.  Set Beaker's
+    ``session.save_accessed_time = false`` so unchanged sessions aren't
+    rewritten at all.
+    """
+    config.include('jcu.common.instrumentation')
+    config.set_session_factory(session_factory_from_settings(
+        config.registry.settings, config.registry))
@@ -0,0 +1,319 @@
+""" Temporary storage of uploaded files between form submissions.
+"""
+import hashlib
+import logging
+import os
+import re
+import struct
+import tempfile
+import threading
+import time
+
+from pyramid.exceptions import ConfigurationError
+from pyramid.httpexceptions import HTTPNotFound, HTTPUnsupportedMediaType
+from pyramid.response import FileResponse
+
+from jcu.common.interfaces import IThumbnailCache
+
+TEMPSTORE_DIR = 'jcu.tempstore.dir'
+TEMPSTORE_MAX_AGE = 'jcu.tempstore.max_age'
+TEMPSTORE_SWEEP_INTERVAL = 'jcu.tempstore.sweep_interval'
+THUMBNAIL_DIR = 'jcu.tempstore.thumbnail_dir'
+THUMBNAIL_SIZE = 'jcu.tempstore.thumbnail_size'
+THUMBNAIL_MAX_ENTRIES = 'jcu.tempstore.thumbnail_max_entries'
+#: Key of the session dict holding details of each upload
+SESSION_KEY = 'jcu.tempstore'
+#: Bytes read and written at a time when storing uploads
+CHUNK_SIZE = 64 * 1024
+#: Seconds browsers may reuse a thumbnail; its content never changes
+THUMBNAIL_CACHE_MAX_AGE = 86400
+
+log = logging.getLogger(__name__)
+_marker = object()
+_digest = re.compile(r'^[0-9a-f]{40}$')
+_last_sweeps = {}
+_sweep_lock = threading.Lock()
+
+
+def sweep(directory, max_age):
+    """ Remove stored files not written or read within ``max_age`` seconds.
+
+    Stored files are referenced from many sessions, which can't all be
+    seen from here, so a file's modification time records when any session
+    last used it.
+    """
+    cutoff = time.time() - max_age
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            # Removed or replaced by another process meanwhile
+            pass
+
+
+def sweep_in_background(directory, max_age, interval):
+    """ Start :func:`sweep` on a thread, at most once per ``interval``.
+    """
+    now = time.time()
+    with _sweep_lock:
+        if now - _last_sweeps.get(directory, 0) < interval:
+            return
+        _last_sweeps[directory] = now
+    thread = threading.Thread(target=sweep, args=(directory, max_age))
+    thread.daemon = True
+    thread.start()
+
+
+class DiskFileUploadTempStore(object):
+    """ deform upload temporary store keeping file data on disk.
+
+    Like ``pyramid_deform.SessionFileUploadTempStore``, file data is kept
+    on disk and only the upload's filename, type, size and a reference are
+    kept in the session.  Unlike it, data is streamed in chunks to a file
+    in the ``jcu.tempstore.dir`` directory named after the SHA-1 of its
+    content, so identical uploads share a file, and files aren't kept
+    forever.  Each write or read of a file marks it as in use; files not
+    used within ``jcu.tempstore.max_age`` seconds (default 3600) are
+    removed by a background sweep.  An upload whose file has been removed
+    is treated as missing, so the user is asked for it again.
+
+    See :class:`deform.interfaces.FileUploadTempStore` for the API.
+    """
+
+    def __init__(self, request):
+        settings = request.registry.settings
+        try:
+            self.directory = settings[TEMPSTORE_DIR]
+        except KeyError:
+            raise ConfigurationError(
+                'To use DiskFileUploadTempStore, you must set a "%s" key in '
+                'your .ini settings.' % TEMPSTORE_DIR)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self.max_age = float(settings.get(TEMPSTORE_MAX_AGE, 3600))
+        self.sweep_interval = float(
+            settings.get(TEMPSTORE_SWEEP_INTERVAL, 600))
+        self.request = request
+        self.session = request.session
+
+    @property
+    def tempstore(self):
+        """ Details of uploads kept in the session, by field uid.
+
+        Only :meth:`__setitem__` adds these to the session, so rendering a
+        form doesn't mark the session as changed.
+        """
+        return self.session.get(SESSION_KEY, {})
+
+    def path(self, digest):
+        """ Return the path of the file holding data with ``digest``.
+        """
+        return os.path.join(self.directory, digest)
+
+    def preview_url(self, uid):
+        """ Return the URL of a thumbnail for image uploads, if available.
+
+        Thumbnails are available once this module has been included.
+        """
+        data = self.tempstore.get(uid) or {}
+        digest = data.get('digest')
+        if digest and (data.get('mimetype') or '').startswith('image/') and \
+                self.request.registry.queryUtility(IThumbnailCache):
+            return self.request.route_url('jcu-thumbnail', digest=digest)
+
+    def __contains__(self, name):
+        return name in self.tempstore
+
+    def __setitem__(self, name, data):
+        newdata = dict(data)
+        stream = newdata.pop('fp', None)
+        if stream is not None:
+            newdata['digest'] = self.write(stream)
+        self.session.setdefault(SESSION_KEY, {})[name] = newdata
+        newdata['preview_url'] = self.preview_url(name)
+        self.session.changed()
+        sweep_in_background(self.directory, self.max_age,
+                            self.sweep_interval)
+
+    def __getitem__(self, name):
+        data = self.get(name, _marker)
+        if data is _marker:
+            raise KeyError(name)
+        return data
+
+    def get(self, name, default=None):
+        data = self.tempstore.get(name)
+        if data is None:
+            return default
+        newdata = dict(data)
+        digest = newdata.get('digest')
+        if digest is not None:
+            path = self.path(digest)
+            try:
+                # Mark as still in use so it isn't swept
+                os.utime(path, None)
+                newdata['fp'] = open(path, 'rb')
+            except (IOError, OSError):
+                # Swept since it was uploaded
+                del self.tempstore[name]
+                self.session.changed()
+                return default
+        return newdata
+
+    def write(self, stream):
+        """ Store the data from ``stream`` and return its digest.
+        """
+        digest = hashlib.sha1()
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+            path = self.path(digest.hexdigest())
+            if os.path.exists(path):
+                # Already stored; mark it as in use again
+                os.utime(path, None)
+                os.remove(temp_path)
+            else:
+                os.rename(temp_path, path)
+        except:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return digest.hexdigest()
+
+
+class ThumbnailCache(object):
+    """ Bounded-size image previews, generated once and cached on disk.
+
+    Thumbnails are JPEGs no larger than ``size`` (a ``(width, height)``
+    tuple), stored in ``directory`` by the digest of their source.  Once
+    there are more than ``max_entries``, the least recently used are
+    removed.  Requires PIL or Pillow.
+    """
+
+    def __init__(self, directory, size=(200, 200), max_entries=1000):
+        self.directory = directory
+        self.size = size
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest + '.jpg')
+
+    def get(self, digest, source):
+        """ Return the path to a thumbnail of the image file ``source``, or
+        ``None`` if it isn't an image PIL can read.
+        """
+        path = self.path(digest)
+        if os.path.exists(path):
+            os.utime(path, None)
+            return path
+
+        from PIL import Image
+        # Raised for corrupt, truncated, unsupported or oversized images
+        errors = (IOError, OSError, SyntaxError, ValueError, IndexError,
+                  struct.error, getattr(Image, 'DecompressionBombError',
+                                        ValueError))
+        try:
+            image = Image.open(source)
+            image.thumbnail(self.size, Image.ANTIALIAS)
+            # Decode now, if thumbnail() didn't need to, to catch errors
+            image.load()
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+        except errors:
+            log.debug('Unable to read image %s', source, exc_info=True)
+            return None
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                image.save(temp_file, 'JPEG')
+            os.rename(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        self.evict()
+        return path
+
+    def evict(self):
+        """ Remove the least recently used thumbnails beyond max_entries.
+        """
+        with self._lock:
+            paths = [os.path.join(self.directory, name)
+                     for name in os.listdir(self.directory)
+                     if name.endswith('.jpg')]
+            if len(paths) <= self.max_entries:
+                return
+            entries = []
+            for path in paths:
+                try:
+                    entries.append((os.path.getmtime(path), path))
+                except OSError:
+                    pass
+            entries.sort()
+            for mtime, path in entries[:len(entries) - self.max_entries]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+def thumbnail_view(request):
+    """ Serve a thumbnail of an image in the current user's uploads.
+    """
+    digest = request.matchdict['digest']
+    uploads = request.session.get(SESSION_KEY, {})
+    if not _digest.match(digest) or \
+            digest not in [data.get('digest') for data in uploads.values()]:
+        raise HTTPNotFound()
+    source = os.path.join(request.registry.settings[TEMPSTORE_DIR], digest)
+    if not os.path.exists(source):
+        raise HTTPNotFound()
+    thumbnails = request.registry.getUtility(IThumbnailCache)
+    path = thumbnails.get(digest, source)
+    if path is None:
+        raise HTTPUnsupportedMediaType()
+    response = FileResponse(path, request=request,
+                            content_type='image/jpeg',
+                            cache_max_age=THUMBNAIL_CACHE_MAX_AGE)
+    # Thumbnails never change for a digest, but are only for this user
+    response.cache_control.private = True
+    response.etag = digest
+    response.conditional_response = True
+    return response
+
+
+def includeme(config):
+    """Include this within Pyramid to serve thumbnails of uploaded images.
+
+    Thumbnails are generated for uploads kept by
+    :class:`DiskFileUploadTempStore` and shown by the ``image_upload``
+    widget.  Options and their defaults are as follows; thumbnails are
+    stored in a ``thumbnails`` directory within ``jcu.tempstore.dir`` by
+    default.
+
+    .. code:: ini
+
+        jcu.tempstore.thumbnail_dir = %(here)s/var/uploads/thumbnails
+        jcu.tempstore.thumbnail_size = 200x200
+        jcu.tempstore.thumbnail_max_entries = 1000
+    """
+    settings = config.registry.settings
+    directory = settings.get(THUMBNAIL_DIR) or \
+        os.path.join(settings[TEMPSTORE_DIR], 'thumbnails')
+    size = tuple(int(v) for v in
+                 settings.get(THUMBNAIL_SIZE, '200x200').split('x'))
+    max_entries = int(settings.get(THUMBNAIL_MAX_ENTRIES, 1000))
+    config.registry.registerUtility(
+        ThumbnailCache(directory, size, max_entries), IThumbnailCache)
+    config.add_route('jcu-thumbnail', '/thumbnails/{digest}')
+    config.add_view(thumbnail_view, route_name='jcu-thumbnail')
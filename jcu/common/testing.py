@@ -0,0 +1,410 @@
+""" Stand-ins for CAS and LDAP, for use in benchmarks and application tests.
+"""
+import contextlib
+import itertools
+import os
+import re
+import threading
+import time
+from xml.sax.saxutils import escape as xml_escape
+
+from zope.interface import implements
+from repoze.who.interfaces import IIdentifier, IAuthenticator, IChallenger
+
+#: Environ key the stub plugin reads the current user's ID from
+USERID_KEY = 'jcu.testing.userid'
+#: Secret and cookie name of the ``auth_tkt`` plugin in the stub config
+TICKET_SECRET = 'secret'
+TICKET_COOKIE = 'auth_tkt'
+
+STUB_WHO_CONFIG = """\
+[plugin:stub]
+use = jcu.common.testing:make_stub_plugin
+cas_url = %(cas_url)s
+
+[plugin:auth_tkt]
+use = repoze.who.plugins.auth_tkt:make_plugin
+secret = %(secret)s
+cookie_name = %(cookie_name)s
+
+[general]
+request_classifier = repoze.who.classifiers:default_request_classifier
+challenge_decider = repoze.who.classifiers:default_challenge_decider
+remote_user_key = REMOTE_USER
+
+[identifiers]
+plugins =
+    stub
+    auth_tkt
+
+[authenticators]
+plugins =
+    stub
+    auth_tkt
+
+[challengers]
+plugins = stub
+"""
+
+
+class StubWhoPlugin(object):
+    """ ``repoze.who`` plugin identifying users from the WSGI environ.
+
+    Requests are authenticated as the user ID found under
+    :data:`USERID_KEY`, with ``attributes`` like those released by CAS.
+    The ``cas_url`` attribute lets :func:`jcu.common.auth.includeme`
+    derive its SSO URL as it would from the real CAS plugin.
+    """
+    implements(IIdentifier, IAuthenticator, IChallenger)
+
+    def __init__(self, cas_url='http://cas.example.com/cas/'):
+        self.cas_url = cas_url
+
+    # IIdentifier
+    def identify(self, environ):
+        user_id = environ.get(USERID_KEY)
+        if user_id:
+            return {'login': user_id,
+                    'attributes': {'givenname': 'Test',
+                                   'surname': user_id}}
+
+    def remember(self, environ, identity):
+        return []
+
+    def forget(self, environ, identity):
+        return []
+
+    # IAuthenticator
+    def authenticate(self, environ, identity):
+        return identity.get('login')
+
+    # IChallenger
+    def challenge(self, environ, status, app_headers, forget_headers):
+        from webob.exc import HTTPUnauthorized
+        return HTTPUnauthorized()
+
+
+def make_stub_plugin(cas_url='http://cas.example.com/cas/'):
+    return StubWhoPlugin(cas_url=cas_url)
+
+
+def write_who_config(directory, cas_url='http://cas.example.com/cas/'):
+    """ Write a ``who.ini`` using :class:`StubWhoPlugin` and return its path.
+    """
+    path = os.path.join(directory, 'who.ini')
+    with open(path, 'w') as config_file:
+        config_file.write(STUB_WHO_CONFIG % {'cas_url': cas_url,
+                                             'secret': TICKET_SECRET,
+                                             'cookie_name': TICKET_COOKIE})
+    return path
+
+
+def make_ticket(user_id, secret=TICKET_SECRET):
+    """ Return an ``auth_tkt`` cookie value logging in ``user_id``.
+    """
+    from repoze.who._auth_tkt import AuthTicket
+    return AuthTicket(secret, user_id, '0.0.0.0').cookie_value()
+
+
+class StubGroupFinder(object):
+    """ Replacement for ``pyramid_ldap.groupfinder`` with canned results.
+
+    Every user is a member of ``groups``, and each lookup sleeps for
+    ``latency`` seconds to imitate a directory round trip.
+    """
+
+    def __init__(self, groups=(), latency=0):
+        self.groups = list(groups)
+        self.latency = latency
+        self.calls = 0
+
+    def __call__(self, userdn, request):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return list(self.groups)
+
+
+#: Values substituted into ``who.ini.in`` by :func:`write_who_config_from`
+WHO_TEMPLATE_SETTINGS = {
+    'cas-url': 'http://127.0.0.1/cas/',
+    'auth-tkt-secret': TICKET_SECRET,
+    'auth-tkt-cookie-name': TICKET_COOKIE,
+    'auth-tkt-secure': 'False',
+    'metadata-cache-plugin':
+        'repoze.who.plugins.metadata_cache.memory:make_plugin',
+    'metadata-cache-options': '',
+}
+
+_template_setting = re.compile(r'\$\{settings:([\w-]+)\}')
+
+
+def write_who_config_from(template, directory, **values):
+    """ Render a buildout ``who.ini.in`` template into ``directory``.
+
+    ``${settings:...}`` references are filled from
+    :data:`WHO_TEMPLATE_SETTINGS`, overridden by ``values`` (with
+    underscores in place of dashes, eg ``cas_url``).  Returns the path to
+    the rendered ``who.ini``.
+    """
+    settings = dict(WHO_TEMPLATE_SETTINGS)
+    settings.update((key.replace('_', '-'), value)
+                    for key, value in values.items())
+    with open(template) as template_file:
+        config = _template_setting.sub(lambda match: settings[match.group(1)],
+                                       template_file.read())
+    path = os.path.join(directory, 'who.ini')
+    with open(path, 'w') as config_file:
+        config_file.write(config)
+    return path
+
+
+class FakeCAS(object):
+    """ WSGI application speaking enough of the CAS 2.0 protocol to log in.
+
+    ``/login?service=...&username=...`` logs ``username`` in without a
+    password and redirects back to the service with a ticket, which
+    ``/serviceValidate`` (or ``/p3/serviceValidate``) then validates once,
+    releasing ``givenname`` and ``surname`` attributes.  ``/logout``
+    redirects to the given service.  Serve it with :func:`serve_fake_cas`
+    so that ``repoze.who.plugins.cas`` can reach it over HTTP.
+    """
+
+    def __init__(self):
+        self.tickets = {}
+        self.logins = 0
+        self.validations = 0
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        from webob import Request, Response
+        from webob.exc import HTTPBadRequest, HTTPFound, HTTPNotFound
+        request = Request(environ)
+        action = request.path_info.rstrip('/').rsplit('/', 1)[-1]
+        service = request.params.get('service')
+        if action == 'login':
+            user_id = request.params.get('username')
+            if not service or not user_id:
+                response = HTTPBadRequest()
+            else:
+                response = HTTPFound(location=self.login(service, user_id))
+        elif action == 'serviceValidate':
+            user_id = self.validate(service, request.params.get('ticket'))
+            response = Response(self.validation_response(user_id),
+                                content_type='text/xml')
+        elif action == 'logout':
+            response = HTTPFound(location=service or '/')
+        else:
+            response = HTTPNotFound()
+        return response(environ, start_response)
+
+    def login(self, service, user_id):
+        """ Issue a ticket for ``user_id`` and return the service URL.
+        """
+        with self._lock:
+            self.logins += 1
+            ticket = 'ST-%d-fake' % next(self._counter)
+            self.tickets[ticket] = (service, user_id)
+        separator = '&' if '?' in service else '?'
+        return '%s%sticket=%s' % (service, separator, ticket)
+
+    def validate(self, service, ticket):
+        """ Return the user ID for a ticket issued for ``service``, if any.
+        """
+        with self._lock:
+            self.validations += 1
+            issued = self.tickets.pop(ticket, None)
+        if issued is not None and issued[0] == service:
+            return issued[1]
+
+    def validation_response(self, user_id):
+        if user_id is None:
+            return CAS_FAILURE
+        return CAS_SUCCESS % {'user_id': xml_escape(user_id)}
+
+
+CAS_SUCCESS = """\
+<cas:serviceResponse xmlns:cas="http://www.yale.edu/tp/cas">
+  <cas:authenticationSuccess>
+    <cas:user>%(user_id)s</cas:user>
+    <cas:attributes>
+      <cas:givenname>Test</cas:givenname>
+      <cas:surname>%(user_id)s</cas:surname>
+    </cas:attributes>
+  </cas:authenticationSuccess>
+</cas:serviceResponse>
+"""
+
+CAS_FAILURE = """\
+<cas:serviceResponse xmlns:cas="http://www.yale.edu/tp/cas">
+  <cas:authenticationFailure code="INVALID_TICKET">
+    Ticket not recognised
+  </cas:authenticationFailure>
+</cas:serviceResponse>
+"""
+
+
+def serve_fake_cas(cas=None, host='127.0.0.1', port=0):
+    """ Serve a :class:`FakeCAS` on a background thread.
+
+    Returns the server, with ``cas`` and ``cas_url`` attributes for the
+    application and its base URL.  Call ``shutdown()`` on it when done.
+    """
+    from SocketServer import ThreadingMixIn
+    from wsgiref.simple_server import (make_server, WSGIServer,
+                                       WSGIRequestHandler)
+
+    class Server(ThreadingMixIn, WSGIServer):
+        daemon_threads = True
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+    cas = cas or FakeCAS()
+    server = make_server(host, port, cas, server_class=Server,
+                         handler_class=QuietHandler)
+    server.cas = cas
+    server.cas_url = 'http://%s:%d/cas/' % server.server_address
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+#: Search scopes, as numbered by python-ldap
+SCOPE_BASE, SCOPE_ONELEVEL, SCOPE_SUBTREE = 0, 1, 2
+
+_filter_escape = re.compile(r'\\([0-9a-fA-F]{2})')
+
+
+def _parse_filter(text, position=0):
+    """ Parse the LDAP filter starting at ``position`` in ``text``.
+
+    Returns a predicate accepting a dict of lower-cased attribute names to
+    sets of lower-cased values, and the position after the filter.
+    Supports ``&``, ``|``, ``!``, equality, presence and ``*`` wildcards.
+    """
+    if text[position] != '(':
+        raise ValueError('Bad filter at %d: %r' % (position, text))
+    position += 1
+    operator = text[position]
+    if operator in '&|!':
+        position += 1
+        terms = []
+        while text[position] == '(':
+            term, position = _parse_filter(text, position)
+            terms.append(term)
+        if operator == '&':
+            predicate = lambda attrs: all(term(attrs) for term in terms)
+        elif operator == '|':
+            predicate = lambda attrs: any(term(attrs) for term in terms)
+        else:
+            predicate = lambda attrs: not terms[0](attrs)
+        return predicate, position + 1
+
+    end = text.index(')', position)
+    attribute, value = text[position:end].split('=', 1)
+    attribute = attribute.lower()
+    if value == '*':
+        return (lambda attrs: bool(attrs.get(attribute))), end + 1
+    parts = [_filter_escape.sub(lambda m: chr(int(m.group(1), 16)), part)
+             for part in value.lower().split('*')]
+    if len(parts) == 1:
+        return (lambda attrs: parts[0] in attrs.get(attribute, ())), end + 1
+    pattern = re.compile('^%s$' % '.*'.join(re.escape(part)
+                                            for part in parts))
+    return (lambda attrs: any(pattern.match(v)
+                              for v in attrs.get(attribute, ()))), end + 1
+
+
+class FakeLDAPDirectory(object):
+    """ In-memory stand-in for an LDAP server and ``ldappool`` manager.
+
+    Install it with :func:`install_fake_ldap` and ``pyramid_ldap`` and
+    :mod:`jcu.common.ldap` will search it in place of a real directory.
+    Each search sleeps for ``latency`` seconds and is counted in
+    ``searches``.
+    """
+
+    def __init__(self, latency=0):
+        self.entries = {}
+        self._matchable = {}
+        self.latency = latency
+        self.searches = 0
+        self._lock = threading.Lock()
+
+    def add(self, dn, **attrs):
+        """ Add an entry, with attributes given as lists of values.
+        """
+        self.entries[dn] = dict((name, list(values))
+                                for name, values in attrs.items())
+        self._matchable[dn] = dict(
+            (name.lower(), set(value.lower() for value in values))
+            for name, values in attrs.items())
+
+    @contextlib.contextmanager
+    def connection(self, bind=None, passwd=None):
+        yield self
+
+    def search_s(self, base, scope, filterstr='(objectClass=*)',
+                 attrlist=None):
+        with self._lock:
+            self.searches += 1
+        if self.latency:
+            time.sleep(self.latency)
+        predicate = _parse_filter(filterstr)[0]
+        base = base.lower()
+        results = []
+        for dn, attrs in self.entries.items():
+            if not self._in_scope(dn.lower(), base, scope):
+                continue
+            if predicate(self._matchable[dn]):
+                if attrlist:
+                    wanted = set(name.lower() for name in attrlist)
+                    attrs = dict((name, values)
+                                 for name, values in attrs.items()
+                                 if name.lower() in wanted)
+                results.append((dn, attrs))
+        return results
+
+    def _in_scope(self, dn, base, scope):
+        if scope == SCOPE_BASE:
+            return dn == base
+        if not dn.endswith(',' + base):
+            return False
+        return scope == SCOPE_SUBTREE or \
+            ',' not in dn[:-len(base) - 1].replace('\\,', '')
+
+
+def make_directory(users=100, groups=10, latency=0,
+                   user_dn='uid=%s,ou=users,dc=jcu,dc=edu,dc=au',
+                   group_dn='cn=Role %d,ou=org,dc=example,dc=com'):
+    """ Return a :class:`FakeLDAPDirectory` of ``users`` users, each of
+    whom occupies every one of ``groups`` roles.
+
+    User IDs are ``jc000000`` onwards.
+    """
+    directory = FakeLDAPDirectory(latency=latency)
+    user_ids = ['jc%06d' % i for i in range(users)]
+    for user_id in user_ids:
+        directory.add(user_dn % user_id, uid=[user_id])
+    occupants = [user_dn % user_id for user_id in user_ids]
+    for i in range(groups):
+        directory.add(group_dn % i, cn=['Role %d' % i],
+                      roleOccupant=occupants)
+    return directory
+
+
+def install_fake_ldap(config, directory):
+    """ Have ``pyramid_ldap`` connections use ``directory``.
+
+    Call this after including :mod:`jcu.common.ldap` with ``ldap.setup.``
+    and ``ldap.groups_query.`` settings.
+    """
+    import pyramid_ldap
+
+    def get_connector(request):
+        return pyramid_ldap.Connector(request.registry, directory)
+    config.set_request_property(get_connector, 'ldap_connector', reify=True)
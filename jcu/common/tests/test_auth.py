@@ -0,0 +1,740 @@
+import unittest
+
+from pyramid import testing
+
+from jcu.common.cache import LRUCache
+
+
+def identity(user_id='jc123456'):
+    return {'repoze.who.userid': user_id}
+
+
+class Callback(object):
+    """ Auth callback counting its calls.
+    """
+
+    def __init__(self, groups):
+        self.groups = groups
+        self.calls = 0
+
+    def __call__(self, identity, request):
+        self.calls += 1
+        return list(self.groups)
+
+
+class CallbackFnTests(unittest.TestCase):
+
+    def _callFUT(self, callbacks, cache=None, **kw):
+        from jcu.common.auth import callback_fn
+        return callback_fn(callbacks, cache, **kw)
+
+    def test_without_cache(self):
+        fn = Callback(['group:a'])
+        callback = self._callFUT([fn])
+        request = testing.DummyRequest()
+        self.assertEqual(callback(identity(), request),
+                         set(['group:Authenticated', 'group:a']))
+        callback(identity(), request)
+        self.assertEqual(fn.calls, 2)
+
+    def test_cached_per_user(self):
+        fn = Callback(['group:a'])
+        cache = LRUCache()
+        callback = self._callFUT([fn], cache)
+        request = testing.DummyRequest()
+        callback(identity(), request)
+        groups = callback(identity(), request)
+        self.assertEqual(fn.calls, 1)
+        self.assertEqual(groups, set(['group:Authenticated', 'group:a']))
+        callback(identity('jc000001'), request)
+        self.assertEqual(fn.calls, 2)
+
+    def test_cache_expiry(self):
+        from jcu.common.tests.test_cache import Clock
+        clock = Clock()
+        fn = Callback(['group:a'])
+        callback = self._callFUT([fn], LRUCache(ttl=60, clock=clock))
+        request = testing.DummyRequest()
+        callback(identity(), request)
+        clock.now += 61
+        callback(identity(), request)
+        self.assertEqual(fn.calls, 2)
+
+    def test_invalidation(self):
+        fn = Callback(['group:a'])
+        cache = LRUCache()
+        callback = self._callFUT([fn], cache)
+        request = testing.DummyRequest()
+        callback(identity(), request)
+        cache.invalidate('jc123456')
+        callback(identity(), request)
+        self.assertEqual(fn.calls, 2)
+
+    def test_uncached_callbacks_always_run(self):
+        from jcu.common.auth import uncached
+        cached = Callback(['group:a'])
+        always = Callback(['group:b'])
+        uncached(always)
+        callback = self._callFUT([cached, always], LRUCache())
+        request = testing.DummyRequest()
+        callback(identity(), request)
+        groups = callback(identity(), request)
+        self.assertEqual((cached.calls, always.calls), (1, 2))
+        self.assertEqual(groups, set(['group:Authenticated', 'group:a',
+                                      'group:b']))
+
+
+class CachingWhoV2AuthenticationPolicyTests(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.directory)
+
+    def _makeOne(self, groups=('group:Authenticated', 'group:a')):
+        from jcu.common import testing as jcu_testing
+        from jcu.common.auth import CachingWhoV2AuthenticationPolicy
+        self.calls = 0
+
+        def callback(identity, request):
+            self.calls += 1
+            return list(groups)
+        return CachingWhoV2AuthenticationPolicy(
+            config_file=jcu_testing.write_who_config(self.directory),
+            identifier_id='auth_tkt',
+            callback=callback)
+
+    def _makeRequest(self, user_id=None):
+        from pyramid.request import Request
+        from jcu.common.testing import USERID_KEY
+        environ = {USERID_KEY: user_id} if user_id else {}
+        return Request.blank('/', environ=environ)
+
+    def test_groups_computed_once(self):
+        policy = self._makeOne()
+        request = self._makeRequest('jc123456')
+        self.assertEqual(policy.authenticated_userid(request), 'jc123456')
+        principals = policy.effective_principals(request)
+        self.assertEqual(policy.authenticated_userid(request), 'jc123456')
+        self.assertTrue('group:a' in principals)
+        self.assertEqual(self.calls, 1)
+
+    def test_anonymous_memoised(self):
+        from jcu.common.auth import ANONYMOUS_KEY
+        policy = self._makeOne()
+        request = self._makeRequest()
+        self.assertEqual(policy.authenticated_userid(request), None)
+        self.assertTrue(request.environ[ANONYMOUS_KEY])
+        request.environ['jcu.testing.userid'] = 'jc123456'
+        self.assertEqual(policy.authenticated_userid(request), None)
+
+    def test_forget_drops_memos(self):
+        from jcu.common.auth import GROUPS_KEY
+        policy = self._makeOne()
+        request = self._makeRequest('jc123456')
+        policy.authenticated_userid(request)
+        policy.forget(request)
+        self.assertFalse(GROUPS_KEY in request.environ)
+
+
+class HasPermissionTests(unittest.TestCase):
+
+    def setUp(self):
+        from pyramid.interfaces import IAuthorizationPolicy
+        config = testing.setUp()
+        config.testing_securitypolicy(userid='jc123456', permissive=True)
+        policy = config.registry.queryUtility(IAuthorizationPolicy)
+        self.checks = []
+        permits = policy.permits
+
+        def counting_permits(context, principals, permission):
+            self.checks.append((context, permission))
+            return permits(context, principals, permission)
+        policy.permits = counting_permits
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def test_memoised_per_permission_and_context(self):
+        from jcu.common.auth import has_permission
+        request = testing.DummyRequest()
+        context, other = object(), object()
+        self.assertTrue(has_permission('view', context, request))
+        self.assertTrue(has_permission('view', context, request))
+        has_permission('edit', context, request)
+        has_permission('view', other, request)
+        self.assertEqual(len(self.checks), 3)
+
+    def test_forget_memos(self):
+        from jcu.common.auth import forget_memos, has_permission
+        request = testing.DummyRequest()
+        context = object()
+        has_permission('view', context, request)
+        forget_memos(request)
+        has_permission('view', context, request)
+        self.assertEqual(len(self.checks), 2)
+
+
+class UserTests(unittest.TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+        self.config.testing_securitypolicy(userid='jc123456')
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _makeOne(self, request, user_id=None):
+        from jcu.common.auth import User
+        return User(request, user_id=user_id)
+
+    def test_user_id(self):
+        user = self._makeOne(testing.DummyRequest())
+        self.assertEqual(user.user_id, 'jc123456')
+        user = self._makeOne(testing.DummyRequest(), 'jc000001')
+        self.assertEqual(user.user_id, 'jc000001')
+
+    def test_display_name_from_attributes(self):
+        request = testing.DummyRequest(environ={'repoze.who.identity': {
+            'attributes': {'givenname': 'Test', 'surname': 'User'}}})
+        user = self._makeOne(request)
+        self.assertEqual(user.display_name, 'Test User')
+        user.display_name = 'Other'
+        self.assertEqual(user.display_name, 'Other')
+
+    def test_display_name_without_attributes(self):
+        user = self._makeOne(testing.DummyRequest())
+        self.assertEqual(user.attributes, None)
+        self.assertEqual(user.display_name, 'jc123456')
+
+    def test_is_manager_computed_once(self):
+        request = testing.DummyRequest()
+        request.root = object()
+        self.config.testing_securitypolicy(userid='jc123456',
+                                           permissive=False)
+        user = self._makeOne(request)
+        self.assertFalse(user.is_manager)
+
+    def test_slots(self):
+        user = self._makeOne(testing.DummyRequest())
+        self.assertRaises(AttributeError, setattr, user, 'other', 1)
+
+
+class ParallelCallbacksTests(unittest.TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _callFUT(self, callbacks, cache=None, timeout=1):
+        from jcu.common.auth import callback_fn
+        return callback_fn(callbacks, cache, pool_size=2, timeout=timeout)
+
+    def _slow(self, seconds, groups):
+        import time
+        from jcu.common.auth import io_bound
+
+        @io_bound
+        def slow(identity, request):
+            time.sleep(seconds)
+            return groups
+        return slow
+
+    def test_io_bound_callbacks_merged(self):
+        from jcu.common.auth import io_bound
+        callback = self._callFUT([io_bound(Callback(['group:a'])),
+                                  Callback(['group:b'])])
+        self.assertEqual(callback(identity(), testing.DummyRequest()),
+                         set(['group:Authenticated', 'group:a', 'group:b']))
+
+    def test_timed_out_groups_not_cached(self):
+        cache = LRUCache()
+        callback = self._callFUT([self._slow(0.5, ['group:slow']),
+                                  Callback(['group:a'])], cache, 0.05)
+        groups = callback(identity(), testing.DummyRequest())
+        self.assertEqual(groups, set(['group:Authenticated', 'group:a']))
+        self.assertEqual(cache.get('jc123456'), None)
+
+    def test_default_timeout(self):
+        from jcu.common.auth import callback_fn, io_bound
+        callback = callback_fn([io_bound(Callback(['group:a']))],
+                               pool_size=2)
+        self.assertEqual(callback(identity(), testing.DummyRequest()),
+                         set(['group:Authenticated', 'group:a']))
+
+    def test_no_timeout(self):
+        callback = self._callFUT([self._slow(0.05, ['group:slow'])],
+                                 timeout=None)
+        self.assertEqual(callback(identity(), testing.DummyRequest()),
+                         set(['group:Authenticated', 'group:slow']))
+
+    def test_pool_per_registry(self):
+        from pyramid.registry import Registry
+        from jcu.common.auth import callback_pool
+        registry = self.config.registry
+        pool = callback_pool(registry, 2)
+        self.assertTrue(callback_pool(registry, 2) is pool)
+        other = callback_pool(Registry(), 3)
+        self.assertFalse(other is pool)
+        self.assertEqual(len(other._pool), 3)
+        for each in (pool, other):
+            each.terminate()
+
+
+class DegradedTests(unittest.TestCase):
+
+    def setUp(self):
+        testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _callFUT(self, callbacks, cache, **kw):
+        from jcu.common.auth import callback_fn
+        return callback_fn(callbacks, cache, **kw)
+
+    def _degraded(self, groups):
+        from jcu.common.auth import degraded, io_bound
+
+        @io_bound
+        def fallback(identity, request):
+            return degraded(groups)
+        return fallback
+
+    def test_degraded_groups_not_cached(self):
+        cache = LRUCache()
+        callback = self._callFUT([self._degraded(['group:guest']),
+                                  Callback(['group:a'])], cache)
+        groups = callback(identity(), testing.DummyRequest())
+        self.assertEqual(groups, set(['group:Authenticated', 'group:guest',
+                                      'group:a']))
+        self.assertEqual(cache.get('jc123456'), None)
+
+    def test_empty_degraded_groups_not_cached(self):
+        cache = LRUCache()
+        callback = self._callFUT([self._degraded([])], cache)
+        callback(identity(), testing.DummyRequest())
+        self.assertEqual(cache.get('jc123456'), None)
+
+    def test_degraded_on_pool_not_cached(self):
+        cache = LRUCache()
+        callback = self._callFUT([self._degraded(['group:guest'])], cache,
+                                 pool_size=2, timeout=1)
+        groups = callback(identity(), testing.DummyRequest())
+        self.assertTrue('group:guest' in groups)
+        self.assertEqual(cache.get('jc123456'), None)
+
+
+class PathClassifierTests(unittest.TestCase):
+
+    def _makeOne(self):
+        from jcu.common.auth import PathClassifier
+        return PathClassifier(['/static/'], ['/api'])
+
+    def _classify(self, path):
+        from pyramid.request import Request
+        return self._makeOne()(Request.blank(path))
+
+    def test_public(self):
+        from jcu.common.auth import PUBLIC
+        self.assertEqual(self._classify('/static'), PUBLIC)
+        self.assertEqual(self._classify('/static/app.css'), PUBLIC)
+
+    def test_api(self):
+        from jcu.common.auth import API
+        self.assertEqual(self._classify('/api/items'), API)
+
+    def test_other(self):
+        self.assertEqual(self._classify('/'), None)
+        self.assertEqual(self._classify('/statical'), None)
+        self.assertEqual(self._classify('/apis'), None)
+
+
+class FastAuthTweenTests(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        from pyramid.interfaces import IAuthenticationPolicy
+        from jcu.common import testing as jcu_testing
+        from jcu.common.auth import (CachingWhoV2AuthenticationPolicy,
+                                     PathClassifier, REQUEST_CLASSIFIER)
+        self.directory = tempfile.mkdtemp()
+        self.config = testing.setUp(settings={
+            REQUEST_CLASSIFIER: PathClassifier(['/static'], ['/api'])})
+        self.policy = CachingWhoV2AuthenticationPolicy(
+            config_file=jcu_testing.write_who_config(self.directory),
+            identifier_id='auth_tkt')
+        self.config.registry.registerUtility(self.policy,
+                                             IAuthenticationPolicy)
+
+    def tearDown(self):
+        import shutil
+        testing.tearDown()
+        shutil.rmtree(self.directory)
+
+    def _makeOne(self):
+        from jcu.common.auth import fast_auth_tween_factory
+        self.handled = []
+
+        def handler(request):
+            self.handled.append(self.policy.authenticated_userid(request))
+            return request.response
+        return fast_auth_tween_factory(handler, self.config.registry)
+
+    def _request(self, path, user_id=None, ticket=None):
+        from pyramid.request import Request
+        from jcu.common.testing import TICKET_COOKIE, USERID_KEY
+        environ = {USERID_KEY: user_id} if user_id else {}
+        request = Request.blank(path, environ=environ)
+        request.registry = self.config.registry
+        if ticket:
+            request.cookies[TICKET_COOKIE] = ticket
+        return request
+
+    def test_public_anonymous(self):
+        tween = self._makeOne()
+        tween(self._request('/static/app.css', user_id='jc123456'))
+        self.assertEqual(self.handled, [None])
+
+    def test_api_ticket(self):
+        from jcu.common.testing import make_ticket
+        tween = self._makeOne()
+        ticket = make_ticket('jc123456')
+        # The stub CAS identifier isn't consulted for API requests
+        tween(self._request('/api/items', user_id='jc000001', ticket=ticket))
+        tween(self._request('/api/items', ticket=ticket))
+        self.assertEqual(self.handled, ['jc123456', 'jc123456'])
+
+    def test_api_without_ticket(self):
+        tween = self._makeOne()
+        tween(self._request('/api/items', user_id='jc123456'))
+        tween(self._request('/api/items', ticket='invalid'))
+        self.assertEqual(self.handled, [None, None])
+
+    def test_other_paths_identified_as_usual(self):
+        tween = self._makeOne()
+        tween(self._request('/', user_id='jc123456'))
+        self.assertEqual(self.handled, ['jc123456'])
+
+
+class TicketValidatorTests(unittest.TestCase):
+
+    def _makeOne(self, timeout=None):
+        from repoze.who.plugins.auth_tkt import AuthTktCookiePlugin
+        from jcu.common.auth import TicketValidator
+        from jcu.common.testing import TICKET_COOKIE, TICKET_SECRET
+        plugin = AuthTktCookiePlugin(TICKET_SECRET, TICKET_COOKIE,
+                                     timeout=timeout,
+                                     reissue_time=timeout and timeout / 2)
+        return TicketValidator(plugin, LRUCache())
+
+    def _request(self, ticket):
+        from pyramid.request import Request
+        from jcu.common.testing import TICKET_COOKIE
+        request = Request.blank('/api')
+        request.cookies[TICKET_COOKIE] = ticket
+        return request
+
+    def test_valid_ticket_cached(self):
+        from jcu.common.testing import make_ticket
+        validator = self._makeOne()
+        request = self._request(make_ticket('jc123456'))
+        identity = validator.identify(request)
+        self.assertEqual(identity['repoze.who.userid'], 'jc123456')
+        self.assertTrue(identity['identifier'] is validator.plugin)
+        self.assertEqual(len(validator.cache), 1)
+        # Callers get their own copy of the cached identity
+        identity['repoze.who.userid'] = 'other'
+        self.assertEqual(validator.identify(request)['repoze.who.userid'],
+                         'jc123456')
+
+    def test_invalid_ticket(self):
+        from jcu.common.testing import make_ticket
+        validator = self._makeOne()
+        request = self._request(make_ticket('jc123456', secret='other'))
+        self.assertEqual(validator.identify(request), None)
+        self.assertEqual(len(validator.cache), 0)
+
+    def test_no_cookie(self):
+        from pyramid.request import Request
+        self.assertEqual(self._makeOne().identify(Request.blank('/')), None)
+
+    def test_timeout_rechecked(self):
+        import time
+        from jcu.common.testing import make_ticket
+        validator = self._makeOne(timeout=60)
+        request = self._request(make_ticket('jc123456'))
+        identity = validator.identify(request)
+        self.assertNotEqual(identity, None)
+        key = list(validator.cache._data)[0]
+        validator.cache.get(key)['timestamp'] = time.time() - 120
+        self.assertEqual(validator.identify(request), None)
+        self.assertEqual(len(validator.cache), 0)
+
+
+class Resource(object):
+
+    def __init__(self, acl=None, parent=None):
+        if acl is not None:
+            self.__acl__ = acl
+        self.__parent__ = parent
+
+
+class IndexedACLAuthorizationPolicyTests(unittest.TestCase):
+    """ Results must match Pyramid's ``ACLAuthorizationPolicy`` exactly.
+    """
+
+    def _assertEquivalent(self, context, principals, permission):
+        from pyramid.authorization import ACLAuthorizationPolicy
+        from jcu.common.auth import IndexedACLAuthorizationPolicy
+        expected = ACLAuthorizationPolicy().permits(context, principals,
+                                                    permission)
+        result = IndexedACLAuthorizationPolicy().permits(context, principals,
+                                                         permission)
+        self.assertEqual(
+            (type(result), result.ace, result.acl, result.context),
+            (type(expected), expected.ace, expected.acl, expected.context))
+        return result
+
+    def _check_all(self, context, permissions=('view', 'edit', 'delete'),
+                   principals=('system.Everyone', 'group:a', 'group:b',
+                               'jc123456')):
+        import itertools
+        for permission in permissions:
+            for count in range(len(principals) + 1):
+                for subset in itertools.combinations(principals, count):
+                    self._assertEquivalent(context, list(subset), permission)
+
+    def _acls(self, aces):
+        from jcu.common.auth import IndexedACL
+        return [list(aces), IndexedACL(aces)]
+
+    def test_first_match_wins(self):
+        from pyramid.security import Allow, Deny
+        for acl in self._acls([(Deny, 'group:a', 'edit'),
+                               (Allow, 'group:b', ('view', 'edit')),
+                               (Allow, 'group:a', ['view', 'edit']),
+                               (Deny, 'group:b', 'view')]):
+            self._check_all(Resource(acl))
+
+    def test_deny_all(self):
+        from pyramid.security import Allow, DENY_ALL
+        for acl in self._acls([(Allow, 'group:a', 'view'), DENY_ALL,
+                               (Allow, 'group:b', 'view')]):
+            context = Resource(acl, Resource([(Allow, 'group:b', 'view')]))
+            self._check_all(context)
+
+    def test_all_permissions(self):
+        from pyramid.security import Allow, Deny, ALL_PERMISSIONS
+        for acl in self._acls([(Deny, 'group:b', 'delete'),
+                               (Allow, 'group:a', 'view'),
+                               (Allow, 'group:b', ALL_PERMISSIONS),
+                               (Deny, 'group:a', ALL_PERMISSIONS)]):
+            self._check_all(Resource(acl))
+
+    def test_lineage(self):
+        from pyramid.security import Allow, Deny
+        for root_acl, acl in zip(
+                self._acls([(Allow, 'group:a', 'view'),
+                            (Allow, 'system.Everyone', 'delete')]),
+                self._acls([(Deny, 'group:b', 'view'),
+                            (Allow, 'group:b', 'edit')])):
+            root = Resource(root_acl)
+            self._check_all(Resource(parent=Resource(acl, root)))
+
+    def test_callable_and_empty_acls(self):
+        from pyramid.security import Allow
+        for acl in self._acls([(Allow, 'group:a', 'view')]):
+            root = Resource(lambda: acl)
+            self._check_all(Resource([], root))
+
+    def test_no_acl(self):
+        self._check_all(Resource(parent=Resource()))
+
+    def test_non_string_permissions(self):
+        from pyramid.security import Allow
+        for acl in self._acls([(Allow, 'group:a', 1),
+                               (Allow, 'group:b', u'view')]):
+            self._check_all(Resource(acl), permissions=(1, 'view', u'view'))
+
+    def test_index_rebuilt_on_change(self):
+        from pyramid.security import Allow, Deny
+        from jcu.common.auth import IndexedACL
+        acl = IndexedACL([(Allow, 'group:a', 'view')])
+        context = Resource(acl)
+        self.assertTrue(self._assertEquivalent(context, ['group:a'], 'view'))
+        acl.insert(0, (Deny, 'group:a', 'view'))
+        self.assertFalse(self._assertEquivalent(context, ['group:a'],
+                                                'view'))
+        acl += [(Allow, 'group:b', 'view')]
+        self.assertTrue(self._assertEquivalent(context, ['group:b'], 'view'))
+
+    def test_added_acls_stay_indexed(self):
+        from pyramid.security import Allow
+        from jcu.common.auth import IndexedACL, allow_acl
+        acl = allow_acl('group:a') + [(Allow, 'group:b', 'view')]
+        self.assertTrue(isinstance(acl, IndexedACL))
+        self._check_all(Resource(acl))
+
+
+class RedirectTests(unittest.TestCase):
+
+    def setUp(self):
+        from jcu.common.auth import FORCE_SSL, RETURN_ROUTE
+        self.config = testing.setUp(settings={FORCE_SSL: True,
+                                              RETURN_ROUTE: 'home'})
+        self.config.add_route('home', '/')
+        self.config.add_route('auth-login', '/login')
+        self.config.add_route('auth-logout', '/logout')
+        self.cache = self.config.registry.jcu_auth_urls = LRUCache()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _login(self, **kw):
+        from jcu.common.auth import LoginView
+        environ = {'SERVER_NAME': 'example.com', 'SERVER_PORT': '80'}
+        request = testing.DummyRequest(environ=environ, **kw)
+        return LoginView(None, request)(), request
+
+    def test_login_challenge_per_referrer(self):
+        self.config.testing_securitypolicy(userid=None)
+        for path in ('/a', '/b'):
+            response, request = self._login(
+                referrer='http://example.com' + path)
+            self.assertEqual(response.status_int, 401)
+            self.assertEqual(request.environ['QUERY_STRING'],
+                             'return=https%3A%2F%2Fexample.com' +
+                             path.replace('/', '%2F'))
+        # Referrers are chosen by clients, so never cached
+        self.assertEqual(len(self.cache), 0)
+
+    def test_login_return(self):
+        self.config.testing_securitypolicy(userid='jc123456')
+        response, request = self._login(params={'return': '/somewhere'})
+        self.assertEqual(response.location, '/somewhere')
+        response, request = self._login()
+        self.assertEqual(response.location, 'https://example.com/')
+        self.assertEqual(len(self.cache), 1)
+        response, request = self._login()
+        self.assertEqual(response.location, 'https://example.com/')
+        self.assertEqual(len(self.cache), 1)
+
+    def test_logout_return_per_request(self):
+        from pyramid.interfaces import IRoutesMapper
+        from jcu.common.auth import LogoutView
+        self.config.testing_securitypolicy(userid='jc123456')
+        mapper = self.config.registry.getUtility(IRoutesMapper)
+        for path in ('/a', '/b'):
+            request = testing.DummyRequest(
+                referrer='http://example.com' + path)
+            request.matched_route = mapper.get_route('auth-logout')
+            response = LogoutView(None, request)()
+            self.assertEqual(response.location,
+                             'http://example.com/logout?return='
+                             'http://example.com' + path)
+        self.assertEqual(len(self.cache), 1)
+
+
+class WarmTests(unittest.TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+
+    def tearDown(self):
+        pool = getattr(self.config.registry, 'jcu_warm_pool', None)
+        if pool is not None:
+            pool.terminate()
+        testing.tearDown()
+
+    def _callFUT(self, callbacks, cache, **kw):
+        from jcu.common.auth import callback_fn
+        kw.setdefault('warm_pool_size', 2)
+        return callback_fn(callbacks, cache, **kw)
+
+    def _wait(self, cache, *user_ids):
+        import time
+        deadline = time.time() + 5
+        while time.time() < deadline and \
+                None in [cache.get(user_id) for user_id in user_ids]:
+            time.sleep(0.01)
+
+    def test_warm_with_stand_in_request(self):
+        from jcu.common.auth import WarmingRequest
+        seen = []
+
+        def record(identity, request):
+            seen.append((identity['repoze.who.userid'], request))
+            return ['group:a']
+        cache = LRUCache()
+        callback = self._callFUT([record], cache,
+                                 related_users=lambda identity, request:
+                                 ['jc000001'])
+        request = testing.DummyRequest()
+        request.ldap_connector = connector = object()
+        callback.warm(identity(), request)
+        self._wait(cache, 'jc123456', 'jc000001')
+        self.assertEqual(sorted(user_id for user_id, _ in seen),
+                         ['jc000001', 'jc123456'])
+        for user_id, context in seen:
+            self.assertTrue(isinstance(context, WarmingRequest))
+            self.assertTrue(context.registry is request.registry)
+            self.assertTrue(context.ldap_connector is connector)
+        self.assertEqual(cache.get('jc000001'), frozenset(['group:a']))
+
+    def test_waits_for_warming(self):
+        import threading
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def slow(identity, request):
+            calls.append(request)
+            started.set()
+            release.wait(5)
+            return ['group:a']
+        callback = self._callFUT([slow], LRUCache())
+        request = testing.DummyRequest()
+        callback.warm(identity(), request)
+        started.wait(5)
+        threading.Timer(0.05, release.set).start()
+        self.assertTrue('group:a' in callback(identity(), request))
+        self.assertEqual(len(calls), 1)
+
+    def test_wait_bounded_without_timeout(self):
+        import threading
+        from jcu.common import auth
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def stuck(identity, request):
+            # Warming never finishes; lookups on the request thread do
+            calls.append(request)
+            if len(calls) == 1:
+                started.set()
+                release.wait(5)
+            return ['group:a']
+        callback = self._callFUT([stuck], LRUCache(), timeout=None)
+        request = testing.DummyRequest()
+        callback.warm(identity(), request)
+        started.wait(5)
+        timeout, auth.WARM_TIMEOUT = auth.WARM_TIMEOUT, 0.05
+        try:
+            self.assertTrue('group:a' in callback(identity(), request))
+        finally:
+            auth.WARM_TIMEOUT = timeout
+            release.set()
+        self.assertEqual(calls[1:], [request])
+
+    def test_pool_per_registry(self):
+        from pyramid.registry import Registry
+        from jcu.common.auth import warm_pool
+        pool = warm_pool(self.config.registry, 2)
+        self.assertTrue(warm_pool(self.config.registry, 2) is pool)
+        other = warm_pool(Registry(), 1)
+        self.assertFalse(other is pool)
+        other.terminate()
@@ -0,0 +1,52 @@
+import shutil
+import tempfile
+import unittest
+
+
+class BenchmarkTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _makeApp(self, settings=None):
+        from jcu.common.benchmark import make_app
+        return make_app(self.directory, settings)
+
+    def test_percentile(self):
+        from jcu.common.benchmark import percentile
+        timings = range(101)
+        self.assertEqual(percentile(timings, 0.5), 50)
+        self.assertEqual(percentile(timings, 0.99), 99)
+        self.assertEqual(percentile([1], 0.9), 1)
+
+    def test_scenarios(self):
+        from jcu.common.benchmark import SCENARIOS, run
+        app = self._makeApp()
+        for name, path, user_id, ticket in SCENARIOS:
+            stats = run(app, path, user_id, 3, ticket)
+            self.assertEqual(stats['requests'], 3)
+            self.assertTrue(stats['p50'] <= stats['p99'])
+
+    def test_roles_looked_up_once_per_request(self):
+        from jcu.common.benchmark import run
+        stats = run(self._makeApp(), '/private', 'jc123456', 3)
+        self.assertEqual(stats['ldap_calls'], 1)
+
+
+class StubWhoPluginTests(unittest.TestCase):
+
+    def test_identify(self):
+        from jcu.common.testing import StubWhoPlugin, USERID_KEY
+        plugin = StubWhoPlugin()
+        identity = plugin.identify({USERID_KEY: 'jc123456'})
+        self.assertEqual(plugin.authenticate({}, identity), 'jc123456')
+        self.assertEqual(plugin.identify({}), None)
+
+    def test_stub_group_finder(self):
+        from jcu.common.testing import StubGroupFinder
+        finder = StubGroupFinder(['cn=a'])
+        self.assertEqual(finder('uid=x', None), ['cn=a'])
+        self.assertEqual(finder.calls, 1)
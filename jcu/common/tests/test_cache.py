@@ -0,0 +1,92 @@
+import unittest
+
+from jcu.common.cache import LRUCache
+
+
+class Clock(object):
+    """ Clock advanced by hand.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class LRUCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+
+    def test_get_missing(self):
+        cache = LRUCache()
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('a', 'default'), 'default')
+        self.assertEqual(cache.stats()['misses'], 2)
+
+    def test_set_get(self):
+        cache = LRUCache()
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertTrue('a' in cache)
+        self.assertEqual(len(cache), 1)
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(len(cache), 2)
+
+    def test_ttl_expiry(self):
+        cache = LRUCache(ttl=10, clock=self.clock)
+        cache.set('a', 1)
+        self.clock.now += 9.9
+        self.assertEqual(cache.get('a'), 1)
+        self.clock.now += 0.1
+        self.assertEqual(cache.get('a'), None)
+        self.assertFalse('a' in cache)
+
+    def test_ttl_per_entry(self):
+        cache = LRUCache(ttl=10, clock=self.clock)
+        cache.set('short', 1, ttl=1)
+        cache.set('forever', 2, ttl=None)
+        self.clock.now += 5
+        self.assertEqual(cache.get('short'), None)
+        self.clock.now += 1e6
+        self.assertEqual(cache.get('forever'), 2)
+
+    def test_set_refreshes_expiry(self):
+        cache = LRUCache(ttl=10, clock=self.clock)
+        cache.set('a', 1)
+        self.clock.now += 8
+        cache.set('a', 2)
+        self.clock.now += 8
+        self.assertEqual(cache.get('a'), 2)
+
+    def test_invalidate(self):
+        cache = LRUCache()
+        cache.set('a', 1)
+        cache.invalidate('a')
+        cache.invalidate('missing')
+        self.assertEqual(cache.get('a'), None)
+
+    def test_clear(self):
+        cache = LRUCache()
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_stats(self):
+        cache = LRUCache(max_size=5)
+        cache.set('a', 1)
+        cache.get('a')
+        cache.get('b')
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1, 'size': 1,
+                                         'max_size': 5})
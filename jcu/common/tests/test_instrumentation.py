@@ -0,0 +1,129 @@
+import unittest
+
+from pyramid import testing
+
+
+class HistogramTests(unittest.TestCase):
+
+    def _makeOne(self, buckets=(0.1, 1.0)):
+        from jcu.common.instrumentation import Histogram
+        return Histogram(buckets)
+
+    def test_empty(self):
+        self.assertEqual(self._makeOne().as_dict(),
+                         {'count': 0, 'total': 0.0, 'mean': 0,
+                          'buckets': {'0.1': 0, '1.0': 0, '+Inf': 0}})
+
+    def test_buckets(self):
+        histogram = self._makeOne()
+        for seconds in (0.05, 0.1, 0.5, 2.0):
+            histogram.add(seconds)
+        result = histogram.as_dict()
+        self.assertEqual(result['count'], 4)
+        self.assertAlmostEqual(result['total'], 2.65)
+        self.assertAlmostEqual(result['mean'], 2.65 / 4)
+        self.assertEqual(result['buckets'],
+                         {'0.1': 2, '1.0': 1, '+Inf': 1})
+
+
+class MetricsTests(unittest.TestCase):
+
+    def test_sinks(self):
+        from jcu.common.instrumentation import Metrics, MemorySink
+        first, second = MemorySink(), MemorySink()
+        metrics = Metrics([first, second])
+        metrics.timing('ldap', 0.002)
+        self.assertEqual(first.snapshot()['ldap']['count'], 1)
+        self.assertEqual(second.snapshot()['ldap']['count'], 1)
+        self.assertEqual(metrics.snapshot(), first.snapshot())
+
+    def test_snapshot_without_memory_sink(self):
+        from jcu.common.instrumentation import Metrics, LogSink
+        metrics = Metrics([LogSink()])
+        metrics.timing('ldap', 0.002)
+        self.assertEqual(metrics.snapshot(), {})
+
+
+class TimedTests(unittest.TestCase):
+
+    def _callFUT(self, fn):
+        from jcu.common.instrumentation import timed, Metrics, MemorySink
+        metrics = Metrics([MemorySink()])
+        return timed('callback', fn, metrics), metrics
+
+    def test_generator_consumed(self):
+        def callback(user_id, request):
+            yield 'group:%s' % user_id
+        callback.cache_principals = True
+        wrapper, metrics = self._callFUT(callback)
+        self.assertEqual(wrapper('jc123456', None), ['group:jc123456'])
+        self.assertTrue(wrapper.cache_principals)
+        self.assertEqual(metrics.snapshot()['callback']['count'], 1)
+
+    def test_none(self):
+        wrapper, metrics = self._callFUT(lambda: None)
+        self.assertEqual(wrapper(), None)
+
+    def test_recorded_on_error(self):
+        def callback():
+            raise ValueError()
+        wrapper, metrics = self._callFUT(callback)
+        self.assertRaises(ValueError, wrapper)
+        self.assertEqual(metrics.snapshot()['callback']['count'], 1)
+
+
+class IncludemeTests(unittest.TestCase):
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _include(self, **settings):
+        from jcu.common.instrumentation import get_metrics
+        config = testing.setUp(settings=settings)
+        config.include('jcu.common.instrumentation')
+        config.commit()
+        return get_metrics(config.registry)
+
+    def test_disabled(self):
+        self.assertEqual(self._include(), None)
+
+    def test_enabled(self):
+        from jcu.common.instrumentation import LogSink, MemorySink
+        metrics = self._include(**{
+            'jcu.instrumentation.enabled': 'true',
+            'jcu.instrumentation.sinks': 'memory log'})
+        self.assertEqual([type(sink) for sink in metrics.sinks],
+                         [MemorySink, LogSink])
+
+    def test_unknown_sink(self):
+        self.assertRaises(ValueError, self._include, **{
+            'jcu.instrumentation.enabled': 'true',
+            'jcu.instrumentation.sinks': 'other'})
+
+
+class CounterTests(unittest.TestCase):
+
+    def test_memory(self):
+        from jcu.common.instrumentation import Metrics, MemorySink
+        metrics = Metrics([MemorySink()])
+        metrics.incr('session.oversized')
+        metrics.incr('session.oversized', 2)
+        metrics.timing('ldap', 0.002)
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['session.oversized'], {'count': 3})
+        self.assertEqual(snapshot['ldap']['count'], 1)
+
+    def test_statsd(self):
+        import socket
+        from jcu.common.instrumentation import StatsdSink
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.bind(('127.0.0.1', 0))
+        receiver.settimeout(5)
+        try:
+            sink = StatsdSink(*receiver.getsockname(), prefix='app')
+            sink.incr('session oversized')
+            self.assertEqual(receiver.recv(100), 'app.session_oversized:1|c')
+            sink.timing('ldap', 0.0025)
+            self.assertEqual(receiver.recv(100), 'app.ldap:2.500|ms')
+        finally:
+            receiver.close()
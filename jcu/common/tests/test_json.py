@@ -0,0 +1,163 @@
+import datetime
+import decimal
+import json
+import unittest
+import uuid
+
+from sqlalchemy import Column, Date, Integer, String, create_engine
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+Base = declarative_base()
+
+
+class Person(Base):
+    __tablename__ = 'people'
+    id = Column(Integer, primary_key=True)
+    name = Column(String(50))
+    born = Column(Date)
+
+
+def make_session(count=3):
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    for i in range(count):
+        session.add(Person(id=i, name='Person %d' % i,
+                           born=datetime.date(2000, 1, i + 1)))
+    session.commit()
+    session.expunge_all()
+    return session
+
+
+class SQLAlchemyJSONEncoderTests(unittest.TestCase):
+
+    def _encode(self, obj):
+        from jcu.common.json import SQLAlchemyJSONEncoder
+        return json.loads(json.dumps(obj, cls=SQLAlchemyJSONEncoder))
+
+    def test_mapped_object(self):
+        person = make_session().query(Person).get(1)
+        self.assertEqual(self._encode(person), {'id': 1, 'name': 'Person 1',
+                                                'born': '2000-01-02'})
+
+    def test_unloaded_attributes_left_out(self):
+        session = make_session()
+        person = session.query(Person).get(1)
+        session.expire(person, ['name'])
+        self.assertEqual(sorted(self._encode(person)), ['born', 'id'])
+
+    def test_converters(self):
+        value = uuid.uuid4()
+        self.assertEqual(self._encode([datetime.datetime(2000, 1, 2, 3, 4),
+                                       datetime.time(5, 6),
+                                       decimal.Decimal('1.50'),
+                                       value]),
+                         ['2000-01-02T03:04:00', '05:06:00', '1.50',
+                          str(value)])
+
+    def test_converter_subclass(self):
+        class Date(datetime.date):
+            pass
+        self.assertEqual(self._encode(Date(2000, 1, 2)), '2000-01-02')
+
+    def test_unknown_type(self):
+        self.assertRaises(TypeError, self._encode, object())
+
+    def test_column_plan_cached(self):
+        from jcu.common.json import column_plan
+        plan = column_plan(Person)
+        self.assertEqual(sorted(plan), ['born', 'id', 'name'])
+        self.assertTrue(column_plan(Person) is plan)
+
+    def test_column_plan_subset(self):
+        from jcu.common.json import column_plan, _column_plans
+        self.assertEqual(column_plan(Person, ['name', 'id']), ('name', 'id'))
+        self.assertRaises(ValueError, column_plan, Person, ['name', 'other'])
+        # Only plans of all columns are kept, one per class
+        for count in range(1, 4):
+            column_plan(Person, ['id'] * count)
+        self.assertTrue(all(isinstance(key, type) for key in _column_plans))
+
+
+class IterencodeRowsTests(unittest.TestCase):
+
+    def _callFUT(self, rows, **kw):
+        from jcu.common.json import iterencode_rows
+        return list(iterencode_rows(rows, **kw))
+
+    def test_empty(self):
+        self.assertEqual(self._callFUT([]), ['[]'])
+        self.assertEqual(self._callFUT([], ndjson=True), [])
+
+    def test_array_in_batches(self):
+        chunks = self._callFUT(range(5), batch_size=2)
+        self.assertEqual(chunks, ['[0,1', ',2,3', ',4', ']'])
+        self.assertEqual(json.loads(''.join(chunks)), range(5))
+
+    def test_ndjson(self):
+        chunks = self._callFUT([{'a': 1}, {'a': 2}, {'a': 3}], batch_size=2,
+                               ndjson=True)
+        lines = ''.join(chunks).splitlines()
+        self.assertEqual([json.loads(line) for line in lines],
+                         [{'a': 1}, {'a': 2}, {'a': 3}])
+
+    def test_query(self):
+        query = make_session(5).query(Person).order_by(Person.id)
+        data = json.loads(''.join(self._callFUT(query, batch_size=2)))
+        self.assertEqual([row['id'] for row in data], range(5))
+
+    def test_utf8(self):
+        chunks = self._callFUT([u'\xe9'])
+        self.assertTrue(all(isinstance(chunk, str) for chunk in chunks))
+
+    def test_streaming_response(self):
+        from jcu.common.json import streaming_json_response
+        response = streaming_json_response([1, 2], ndjson=True)
+        self.assertEqual(response.content_type, 'application/x-ndjson')
+        self.assertEqual(response.body, '1\n2\n')
+
+
+class ToDictsTests(unittest.TestCase):
+
+    def test_query(self):
+        from jcu.common.json import to_dicts
+        session = make_session(2)
+        self.assertEqual(to_dicts(session.query(Person).order_by(Person.id)),
+                         [{'id': 0, 'name': 'Person 0',
+                           'born': datetime.date(2000, 1, 1)},
+                          {'id': 1, 'name': 'Person 1',
+                           'born': datetime.date(2000, 1, 2)}])
+
+    def test_query_columns(self):
+        from jcu.common.json import to_dicts
+        session = make_session(2)
+        query = session.query(Person).order_by(Person.id)
+        self.assertEqual(to_dicts(query, columns=['id', 'name']),
+                         [{'id': 0, 'name': 'Person 0'},
+                          {'id': 1, 'name': 'Person 1'}])
+
+    def test_unknown_columns(self):
+        from jcu.common.json import to_dicts
+        session = make_session(1)
+        self.assertRaises(ValueError, to_dicts, session.query(Person).all(),
+                          columns=['password'])
+
+
+class ToColumnsTests(unittest.TestCase):
+
+    def test_objects(self):
+        from jcu.common.json import to_columns
+        people = make_session(2).query(Person).order_by(Person.id).all()
+        self.assertEqual(to_columns(people, columns=['id', 'name']),
+                         {'id': [0, 1], 'name': ['Person 0', 'Person 1']})
+
+    def test_empty(self):
+        from jcu.common.json import to_columns
+        self.assertEqual(to_columns([], columns=['id']), {'id': []})
+        self.assertEqual(to_columns([]), {})
+
+    def test_mixed_classes(self):
+        from jcu.common.json import to_columns
+        person = make_session(1).query(Person).one()
+        self.assertRaises(ValueError, to_columns, [person, object()])
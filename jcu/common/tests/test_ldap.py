@@ -0,0 +1,252 @@
+import unittest
+
+from pyramid import testing
+import pyramid_ldap
+
+from jcu.common import testing as jcu_testing
+
+SETTINGS = {
+    'ldap.setup.uri': 'ldap://localhost',
+    'ldap.groups_query.base_dn': 'ou=org,dc=example,dc=com',
+    'ldap.groups_query.filter_tmpl':
+        '(&(cn=Role*)(roleOccupant=${userdn}))',
+    'ldap.groups_query.scope': 'ldap.SCOPE_SUBTREE',
+}
+
+
+def make_request(settings=None, users=5, groups=2):
+    """ Return a request for an app using a fake directory, and the
+    directory.
+    """
+    all_settings = dict(SETTINGS)
+    all_settings.update(settings or {})
+    config = testing.setUp(settings=all_settings)
+    config.include('jcu.common.ldap')
+    directory = jcu_testing.make_directory(users, groups)
+    config.commit()
+    request = testing.DummyRequest()
+    request.registry = config.registry
+    request.ldap_connector = pyramid_ldap.Connector(config.registry,
+                                                    directory)
+    return request, directory
+
+
+class ResolveLDAPRolesTests(unittest.TestCase):
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _callFUT(self, user_ids, request, **kw):
+        from jcu.common.ldap import resolve_ldap_roles
+        return resolve_ldap_roles(user_ids, request, **kw)
+
+    def test_batch(self):
+        request, directory = make_request()
+        roles = self._callFUT(['jc000000', 'jc000001', 'nobody'], request)
+        expected = [u'cn=Role 0,ou=org,dc=example,dc=com',
+                    u'cn=Role 1,ou=org,dc=example,dc=com']
+        self.assertEqual(sorted(roles['jc000000']), expected)
+        self.assertEqual(sorted(roles['jc000001']), expected)
+        self.assertEqual(roles['nobody'], [])
+        self.assertEqual(directory.searches, 1)
+
+    def test_batch_size(self):
+        request, directory = make_request(users=5)
+        user_ids = ['jc%06d' % i for i in range(5)]
+        roles = self._callFUT(user_ids, request, batch_size=2)
+        self.assertEqual(directory.searches, 3)
+        self.assertTrue(all(len(roles[u]) == 2 for u in user_ids))
+
+    def test_batch_results_decoded(self):
+        request, directory = make_request()
+        roles = self._callFUT(['jc000000', 'jc000001'], request)
+        for dn in roles['jc000000']:
+            self.assertTrue(isinstance(dn, unicode))
+
+    def test_batch_honours_cache_period(self):
+        request, directory = make_request(
+            {'ldap.groups_query.cache_period': '600'})
+        self._callFUT(['jc000000', 'jc000001'], request)
+        self._callFUT(['jc000001', 'jc000000'], request)
+        self.assertEqual(directory.searches, 1)
+
+    def test_batch_uncached_without_cache_period(self):
+        request, directory = make_request()
+        self._callFUT(['jc000000', 'jc000001'], request)
+        self._callFUT(['jc000000', 'jc000001'], request)
+        self.assertEqual(directory.searches, 2)
+
+    def test_single_user_uses_groupfinder(self):
+        request, directory = make_request()
+        finder = jcu_testing.StubGroupFinder(['cn=Stub,dc=example,dc=com'])
+        roles = self._callFUT(['jc000000'], request, _groupfinder=finder)
+        self.assertEqual(roles, {'jc000000': [u'cn=Stub,dc=example,dc=com']})
+        self.assertEqual(directory.searches, 0)
+
+    def test_single_user_honours_cache_period(self):
+        from jcu.common.ldap import verify_ldap_roles
+        request, directory = make_request(
+            {'ldap.groups_query.cache_period': '600'})
+        identity = {'repoze.who.userid': 'jc000000'}
+        first = verify_ldap_roles(identity, request)
+        second = verify_ldap_roles(identity, request)
+        self.assertEqual(len(first), 2)
+        self.assertEqual(first, second)
+        self.assertEqual(directory.searches, 1)
+
+    def test_single_user_lookup_failure(self):
+        import ldap
+        request, directory = make_request()
+        finder = lambda userdn, request: None
+        self.assertRaises(ldap.LDAPError, self._callFUT, ['jc000000'],
+                          request, _groupfinder=finder)
+
+
+class IndexSettingsTests(unittest.TestCase):
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _callFUT(self, settings, prefixes):
+        from jcu.common.ldap import index_settings
+        return index_settings(settings, prefixes)
+
+    def test_grouped(self):
+        index = self._callFUT({'ldap.setup.uri': 'ldap://localhost',
+                               'ldap.roles.cache_size': '10',
+                               'other': 'value'},
+                              ('ldap.setup.', 'ldap.roles.'))
+        self.assertEqual(index, {'ldap.setup.': {'uri': 'ldap://localhost'},
+                                 'ldap.roles.': {'cache_size': '10'}})
+
+    def test_overlapping_prefixes(self):
+        index = self._callFUT({'ldap.uri': 'ldap://localhost',
+                               'ldap.roles.cache_size': '10'},
+                              ('ldap.', 'ldap.roles.'))
+        self.assertEqual(index, {'ldap.': {'uri': 'ldap://localhost'},
+                                 'ldap.roles.': {'cache_size': '10'}})
+
+    def test_overlapping_setup_prefix(self):
+        settings = {'pyramid_ldap.setup.prefix': 'ldap.',
+                    'ldap.uri': 'ldap://localhost',
+                    'ldap.roles.cache_size': '10'}
+        config = testing.setUp(settings=settings)
+        # Roles options would otherwise be rejected as unknown setup options
+        config.include('jcu.common.ldap')
+
+
+class RoleLookupGuardTests(unittest.TestCase):
+
+    def _makeOne(self, **kw):
+        from jcu.common.ldap import RoleLookupGuard
+        from jcu.common.tests.test_cache import Clock
+        self.clock = Clock()
+        kw.setdefault('failure_threshold', 2)
+        kw.setdefault('reset_timeout', 30)
+        return RoleLookupGuard(clock=self.clock, **kw)
+
+    def test_opens_after_threshold(self):
+        guard = self._makeOne()
+        guard.failed()
+        self.assertTrue(guard.allow_lookup())
+        guard.failed()
+        self.assertFalse(guard.allow_lookup())
+
+    def test_half_open_after_reset_timeout(self):
+        guard = self._makeOne()
+        guard.failed()
+        guard.failed()
+        self.clock.now += 30
+        self.assertTrue(guard.allow_lookup())
+        # Only the one probing lookup is let through
+        self.assertFalse(guard.allow_lookup())
+        guard.succeeded({})
+        self.assertTrue(guard.allow_lookup())
+        self.assertEqual(guard.failures, 0)
+
+    def test_no_roles_remembered(self):
+        guard = self._makeOne(negative_ttl=60)
+        guard.succeeded({'jc000001': []})
+        self.assertTrue('jc000001' in guard.no_roles)
+        self.clock.now += 61
+        self.assertFalse('jc000001' in guard.no_roles)
+
+    def test_fallback_last_known(self):
+        guard = self._makeOne(fallback_groups=['cn=Guest, dc=example'])
+        guard.succeeded({'jc000001': ['cn=Staff,dc=example']})
+        fallback = guard.fallback('jc000001')
+        self.assertEqual(fallback, ['cn=Staff,dc=example'])
+        self.assertTrue(fallback.degraded)
+        self.assertEqual(guard.fallback('jc000002'), [u'cn=Guest,dc=example'])
+        self.assertTrue(guard.fallback('jc000002').degraded)
+
+    def test_fallback_max_stale(self):
+        guard = self._makeOne(max_stale=3600)
+        guard.succeeded({'jc000001': ['cn=Staff,dc=example']})
+        self.clock.now += 3601
+        fallback = guard.fallback('jc000001')
+        self.assertEqual(fallback, [])
+        self.assertTrue(fallback.degraded)
+
+
+class GuardedRolesTests(unittest.TestCase):
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _callFUT(self, identity, request, finder):
+        from jcu.common.ldap import verify_ldap_roles
+        return verify_ldap_roles(identity, request, _groupfinder=finder)
+
+    def _request(self):
+        request, directory = make_request({
+            'ldap.roles.failure_threshold': '1',
+            'ldap.roles.fallback_groups': 'cn=Guest,dc=example'})
+        return request
+
+    def test_lookup_not_degraded(self):
+        request = self._request()
+        roles = self._callFUT({'repoze.who.userid': 'jc000001'}, request,
+                              lambda userdn, request: ['cn=Staff,dc=example'])
+        self.assertEqual(roles, [u'cn=Staff,dc=example'])
+        self.assertFalse(getattr(roles, 'degraded', False))
+
+    def test_failure_degraded_and_not_cached(self):
+        from jcu.common.auth import callback_fn
+        from jcu.common.cache import LRUCache
+        from jcu.common.ldap import verify_ldap_roles
+        request = self._request()
+        calls = []
+
+        def finder(userdn, request):
+            calls.append(userdn)
+            return None
+
+        def callback(identity, request):
+            return verify_ldap_roles(identity, request, _groupfinder=finder)
+        cache = LRUCache()
+        auth_callback = callback_fn([callback], cache)
+        identity = {'repoze.who.userid': 'jc000001'}
+        self.assertEqual(auth_callback(identity, request),
+                         set(['group:Authenticated', u'cn=Guest,dc=example']))
+        self.assertEqual(cache.get('jc000001'), None)
+        # The circuit is now open, so LDAP isn't tried again
+        auth_callback(identity, request)
+        self.assertEqual(len(calls), 1)
+
+
+class ImportTests(unittest.TestCase):
+
+    def test_auth_not_imported(self):
+        import subprocess
+        import sys
+        loaded = subprocess.check_output([
+            sys.executable, '-c',
+            'import sys, jcu.common.ldap; '
+            'print(" ".join(sorted(sys.modules)))']).split()
+        self.assertFalse('jcu.common.auth' in loaded)
+        self.assertFalse('pyramid_who' in loaded)
+
+    def test_verify_ldap_roles_io_bound(self):
+        from jcu.common.ldap import verify_ldap_roles
+        self.assertTrue(verify_ldap_roles.io_bound)
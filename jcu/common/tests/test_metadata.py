@@ -0,0 +1,124 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class MemoryBackendTests(unittest.TestCase):
+
+    def test_bounded(self):
+        from jcu.common.metadata import MemoryBackend
+        backend = MemoryBackend(max_size=2)
+        for key in 'abc':
+            backend.store(key, {'key': key})
+        self.assertEqual(backend.fetch('a'), None)
+        self.assertEqual(backend.fetch('c'), {'key': 'c'})
+        self.assertEqual(backend.stats()['size'], 2)
+
+
+class SQLiteBackendTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache', 'metadata.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _makeOne(self, **kw):
+        from jcu.common.metadata import SQLiteBackend
+        return SQLiteBackend(self.path, **kw)
+
+    def test_store_fetch(self):
+        backend = self._makeOne()
+        backend.store('jc123456', {'givenname': ['Test']})
+        self.assertEqual(backend.fetch('jc123456'), {'givenname': ['Test']})
+        self.assertEqual(backend.fetch('missing'), None)
+        self.assertEqual(backend.stats()['hits'], 1)
+
+    def test_shared_between_instances(self):
+        self._makeOne().store('jc123456', {'a': 1})
+        self.assertEqual(self._makeOne().fetch('jc123456'), {'a': 1})
+
+    def test_ttl(self):
+        backend = self._makeOne(ttl=60)
+        backend.store('jc123456', {'a': 1})
+        backend._connection().execute(
+            'UPDATE metadata SET stored = stored - 61')
+        self.assertEqual(backend.fetch('jc123456'), None)
+
+    def test_no_connection_left_from_setup(self):
+        backend = self._makeOne()
+        self.assertEqual(getattr(backend._local, 'conn', None), None)
+
+    def test_connection_replaced_after_fork(self):
+        backend = self._makeOne()
+        conn = backend._connection()
+        self.assertTrue(backend._connection() is conn)
+        # As if the thread's connection were inherited from a parent process
+        backend._local.pid = -1
+        self.assertTrue(backend._connection() is not conn)
+        backend.store('jc123456', {'a': 1})
+        self.assertEqual(backend.fetch('jc123456'), {'a': 1})
+
+    def test_prune(self):
+        backend = self._makeOne(max_size=3)
+        backend.prune_interval = 5
+        for i in range(5):
+            backend.store('user%d' % i, {'i': i})
+        self.assertEqual(backend.stats()['size'], 3)
+
+
+class MakePluginTests(unittest.TestCase):
+
+    def test_memory(self):
+        from jcu.common.metadata import make_plugin, MemoryBackend
+        plugin = make_plugin(max_size='10', ttl='60')
+        self.assertTrue(isinstance(plugin.backend, MemoryBackend))
+        plugin.store('jc123456', {'a': 1})
+        self.assertEqual(plugin.fetch('jc123456'), {'a': 1})
+        self.assertEqual(plugin.fetch('missing'), {})
+
+    def test_sqlite_requires_path(self):
+        from jcu.common.metadata import make_plugin
+        self.assertRaises(ValueError, make_plugin, backend='sqlite')
+
+    def test_unknown_backend(self):
+        from jcu.common.metadata import make_plugin
+        self.assertRaises(ValueError, make_plugin, backend='redis')
+
+
+class WhoTemplateTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _plugin_options(self, **values):
+        from ConfigParser import RawConfigParser
+        from jcu.common.benchmark import WHO_TEMPLATE
+        from jcu.common.testing import write_who_config_from
+        parser = RawConfigParser()
+        parser.read(write_who_config_from(WHO_TEMPLATE, self.directory,
+                                          **values))
+        return dict(parser.items('plugin:metadata_cache'))
+
+    def test_memory_default(self):
+        self.assertEqual(self._plugin_options(), {
+            'use': 'repoze.who.plugins.metadata_cache.memory:make_plugin',
+            'name': 'attributes'})
+
+    def test_sqlite(self):
+        from jcu.common.metadata import make_plugin, SQLiteBackend
+        path = os.path.join(self.directory, 'metadata.db')
+        options = self._plugin_options(
+            metadata_cache_plugin='jcu.common.metadata:make_plugin',
+            metadata_cache_options='backend = sqlite\npath = %s\n'
+                                   'max_size = 10\nttl = 60' % path)
+        self.assertEqual(options.pop('use'),
+                         'jcu.common.metadata:make_plugin')
+        plugin = make_plugin(**options)
+        self.assertTrue(isinstance(plugin.backend, SQLiteBackend))
+        self.assertEqual(plugin.backend.path, path)
@@ -0,0 +1,33 @@
+import unittest
+
+
+class ResolveDottedTests(unittest.TestCase):
+
+    def _callFUT(self, dotted, default=None):
+        from jcu.common.resolver import resolve_dotted
+        return resolve_dotted(dotted, default)
+
+    def test_resolved(self):
+        from jcu.common.cache import LRUCache
+        self.assertTrue(self._callFUT('jcu.common.cache.LRUCache') is
+                        LRUCache)
+
+    def test_default(self):
+        marker = object()
+        self.assertTrue(self._callFUT(None, marker) is marker)
+        self.assertTrue(self._callFUT('', marker) is marker)
+
+    def test_memoised(self):
+        from jcu.common import resolver
+        self._callFUT('jcu.common.cache.LRUCache')
+        marker = object()
+        resolver._resolved['jcu.common.cache.LRUCache'] = marker
+        try:
+            self.assertTrue(self._callFUT('jcu.common.cache.LRUCache') is
+                            marker)
+        finally:
+            del resolver._resolved['jcu.common.cache.LRUCache']
+
+    def test_missing(self):
+        self.assertRaises(ImportError, self._callFUT,
+                          'jcu.common.nonexistent')
@@ -0,0 +1,135 @@
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from webob import Request
+
+CSS = b'body { color: black; }\n' * 50
+
+
+def gunzip(data):
+    return gzip.GzipFile(fileobj=io.BytesIO(data)).read()
+
+
+class ResourcesTestBase(unittest.TestCase):
+
+    def setUp(self):
+        from fanstatic import Library
+        self.directory = tempfile.mkdtemp()
+        self.library = Library('test', self.directory)
+        self.write('style.css', CSS)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, data):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as output:
+            output.write(data)
+        return path
+
+
+class CompressLibraryTests(ResourcesTestBase):
+
+    def _callFUT(self, **kw):
+        from jcu.common.resources import compress_library
+        return compress_library(self.library, **kw)
+
+    def test_compressed(self):
+        path = os.path.join(self.directory, 'style.css')
+        written = self._callFUT()
+        self.assertTrue(path + '.gz' in written)
+        with open(path + '.gz', 'rb') as variant:
+            self.assertEqual(gunzip(variant.read()), CSS)
+
+    def test_stable_output(self):
+        from jcu.common.resources import _gzip
+        self.assertEqual(_gzip(CSS), _gzip(CSS))
+
+    def test_skips_small_and_other_files(self):
+        self.write('small.css', b'a {}')
+        self.write('image.png', CSS)
+        written = self._callFUT()
+        self.assertEqual(sorted(os.path.basename(path) for path in written
+                                if path.endswith('.gz')), ['style.css.gz'])
+
+    def test_only_rewritten_when_changed(self):
+        self.assertTrue(self._callFUT())
+        self.assertEqual(self._callFUT(), [])
+        path = os.path.join(self.directory, 'style.css')
+        later = os.path.getmtime(path + '.gz') + 10
+        os.utime(path, (later, later))
+        self.assertTrue(path + '.gz' in self._callFUT())
+
+    def test_incompressible_variant_removed(self):
+        path = self.write('random.js', os.urandom(1024))
+        self.write('random.js.gz', b'stale')
+        os.utime(path + '.gz', (0, 0))
+        self._callFUT()
+        self.assertFalse(os.path.exists(path + '.gz'))
+
+
+class PrecompressedPublisherTests(ResourcesTestBase):
+
+    def _makeOne(self):
+        from fanstatic import LibraryRegistry, Publisher
+        from jcu.common.resources import PrecompressedPublisher
+        registry = LibraryRegistry([self.library])
+        return PrecompressedPublisher(Publisher(registry), registry)
+
+    def _get(self, path, encoding=None, **headers):
+        if encoding is not None:
+            headers['Accept-Encoding'] = encoding
+        return Request.blank(path, headers=headers).get_response(
+            self._makeOne())
+
+    def test_variant_served(self):
+        from jcu.common.resources import compress_library
+        compress_library(self.library)
+        response = self._get('/test/style.css', 'gzip')
+        self.assertEqual(response.content_encoding, 'gzip')
+        self.assertEqual(gunzip(response.body), CSS)
+        self.assertEqual(list(response.vary), ['Accept-Encoding'])
+
+    def test_original_without_accept_encoding(self):
+        from jcu.common.resources import compress_library
+        compress_library(self.library)
+        response = self._get('/test/style.css')
+        self.assertEqual(response.content_encoding, None)
+        self.assertEqual(response.body, CSS)
+        self.assertEqual(list(response.vary), ['Accept-Encoding'])
+
+    def test_original_without_variant(self):
+        response = self._get('/test/style.css', 'gzip')
+        self.assertEqual(response.content_encoding, None)
+        self.assertEqual(response.body, CSS)
+
+    def test_original_when_edited_since_compressed(self):
+        from jcu.common.resources import compress_library
+        compress_library(self.library)
+        path = self.write('style.css', CSS + b'a { color: red; }\n')
+        later = os.path.getmtime(path + '.gz') + 10
+        os.utime(path, (later, later))
+        response = self._get('/test/style.css', 'gzip')
+        self.assertEqual(response.content_encoding, None)
+        self.assertEqual(response.body, CSS + b'a { color: red; }\n')
+        self.assertEqual(list(response.vary), ['Accept-Encoding'])
+
+    def test_range_served_from_original(self):
+        from jcu.common.resources import compress_library
+        compress_library(self.library)
+        response = self._get('/test/style.css', 'gzip', Range='bytes=0-3')
+        self.assertEqual(response.content_encoding, None)
+        self.assertEqual(response.body, CSS[:4])
+
+    def test_file_path(self):
+        publisher = self._makeOne()
+        path = os.path.join(os.path.abspath(self.directory), 'style.css')
+        self.assertEqual(publisher.file_path('/test/style.css'), path)
+        self.assertEqual(publisher.file_path('/test/:version:abc/style.css'),
+                         path)
+        self.assertEqual(publisher.file_path('/test/../style.css'), None)
+        self.assertEqual(publisher.file_path('/other/style.css'), None)
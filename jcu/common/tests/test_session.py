@@ -0,0 +1,152 @@
+import collections
+import datetime
+import unittest
+
+
+class CompactSerializerTests(unittest.TestCase):
+
+    def _makeOne(self, **kw):
+        from jcu.common.session import CompactSerializer
+        return CompactSerializer(**kw)
+
+    def assertIdentical(self, first, second):
+        """ Assert values are equal and of exactly the same types.
+        """
+        self.assertTrue(type(first) is type(second),
+                        '%r is not %r' % (type(first), type(second)))
+        if isinstance(first, dict):
+            self.assertEqual(sorted(first), sorted(second))
+            for key in first:
+                match = [other for other in second if other == key][0]
+                self.assertTrue(type(key) is type(match))
+                self.assertIdentical(first[key], second[key])
+        elif isinstance(first, (list, tuple)):
+            self.assertEqual(len(first), len(second))
+            for item, other in zip(first, second):
+                self.assertIdentical(item, other)
+        elif first == first:
+            self.assertEqual(first, second)
+
+    def _roundtrip(self, data, **kw):
+        serializer = self._makeOne(**kw)
+        dumped = serializer.dumps(data)
+        self.assertIdentical(serializer.loads(dumped), data)
+        return dumped[1:2]
+
+    def test_json(self):
+        from jcu.common.session import JSON
+        data = {u'user': u'jc123456', u'count': 3, u'ratio': 0.5,
+                u'flags': [True, False, None], u'nested': {u'a': [1, 2]}}
+        self.assertEqual(self._roundtrip(data), JSON)
+
+    def test_lossy_types_pickled(self):
+        from jcu.common.session import PICKLE
+        for data in ({'user': u'jc123456'},
+                     {u'user': 'jc123456'},
+                     {u'pair': (1, 2)},
+                     {1: u'one'},
+                     {u'big': 2 ** 70},
+                     {u'nan': float('nan')},
+                     {u'inf': float('inf')},
+                     collections.OrderedDict([(u'a', 1)]),
+                     {u'when': datetime.date(2000, 1, 1)}):
+            self.assertEqual(self._roundtrip(data), PICKLE)
+
+    def test_compressed(self):
+        from jcu.common.session import JSON_ZLIB, PICKLE_ZLIB
+        data = {u'text': u'x' * 1000}
+        self.assertEqual(self._roundtrip(data, compress_size=128), JSON_ZLIB)
+        data = {'text': 'x' * 1000}
+        self.assertEqual(self._roundtrip(data, compress_size=128),
+                         PICKLE_ZLIB)
+
+    def test_small_not_compressed(self):
+        from jcu.common.session import JSON
+        self.assertEqual(self._roundtrip({u'a': 1}, compress_size=128), JSON)
+
+    def test_legacy_pickle(self):
+        import pickle
+        data = {'user': 'jc123456', 'pair': (1, 2)}
+        self.assertIdentical(self._makeOne().loads(pickle.dumps(data, 2)),
+                             data)
+
+    def test_pack_matches_dumps(self):
+        serializer = self._makeOne()
+        data = {u'text': u'x' * 1000}
+        self.assertEqual(serializer.pack(*serializer.encode(data)),
+                         serializer.dumps(data))
+
+
+class SessionBudgetTests(unittest.TestCase):
+
+    def _makeOne(self, action='log'):
+        from jcu.common.session import SessionBudget
+        return SessionBudget(100, action)
+
+    def test_within_budget(self):
+        budget = self._makeOne()
+        self.assertTrue(budget.check(100, {}))
+        self.assertEqual(budget.oversized, 0)
+
+    def test_oversized_logged(self):
+        budget = self._makeOne()
+        self.assertTrue(budget.check(200, {'big': 'x' * 200}))
+        self.assertEqual((budget.oversized, budget.largest), (1, 200))
+
+    def test_oversized_dropped(self):
+        self.assertFalse(self._makeOne('drop').check(200, {}))
+
+    def test_unknown_action(self):
+        self.assertRaises(ValueError, self._makeOne, 'other')
+
+
+class CompactSessionTests(unittest.TestCase):
+
+    def _makeFactory(self, **kw):
+        from jcu.common.session import CompactSessionFactoryConfig
+        return CompactSessionFactoryConfig(type='memory', **kw)
+
+    def _request(self, cookie=None):
+        from pyramid.request import Request
+        request = Request.blank('/')
+        if cookie:
+            request.headers['Cookie'] = cookie
+        return request
+
+    def _save(self, request):
+        from pyramid.response import Response
+        response = Response()
+        for callback in request.response_callbacks or ():
+            callback(request, response)
+        return response.headers.get('Set-Cookie', '').split(';')[0]
+
+    def test_oversized_counted(self):
+        from jcu.common.instrumentation import MemorySink, Metrics
+        from jcu.common.session import SessionBudget
+        metrics = Metrics([MemorySink()])
+        budget = SessionBudget(64)
+        factory = self._makeFactory(budget=budget, metrics=metrics)
+        request = self._request()
+        session = factory(request)
+        session[u'big'] = u'x' * 1000
+        session.persist()
+        self.assertEqual(budget.oversized, 1)
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['session.oversized'], {'count': 1})
+        self.assertEqual(snapshot['session.serialize']['count'], 1)
+
+    def test_unchanged_not_saveable(self):
+        factory = self._makeFactory()
+        request = self._request()
+        session = factory(request)
+        session[u'user'] = u'jc123456'
+        session.persist()
+        cookie = self._save(request)
+
+        request = self._request(cookie)
+        session = factory(request)
+        self.assertEqual(session[u'user'], u'jc123456')
+        session.changed()
+        self.assertFalse(session.changes_saveable())
+        session[u'user'] = u'jc000001'
+        self.assertTrue(session.changes_saveable())
@@ -0,0 +1,252 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from io import BytesIO
+
+from pyramid import testing
+
+
+class TempStoreTestBase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.config = testing.setUp(settings={
+            'jcu.tempstore.dir': self.directory,
+            'jcu.tempstore.max_age': '60',
+            # Don't sweep in the background whilst testing
+            'jcu.tempstore.sweep_interval': '1e9'})
+
+    def tearDown(self):
+        testing.tearDown()
+        shutil.rmtree(self.directory)
+
+    def age(self, path, seconds):
+        then = time.time() - seconds
+        os.utime(path, (then, then))
+
+
+class SweepTests(TempStoreTestBase):
+
+    def _callFUT(self, max_age):
+        from jcu.common.tempstore import sweep
+        sweep(self.directory, max_age)
+
+    def test_removes_unused(self):
+        old = os.path.join(self.directory, 'old')
+        new = os.path.join(self.directory, 'new')
+        for path in (old, new):
+            open(path, 'wb').close()
+        self.age(old, 120)
+        self._callFUT(60)
+        self.assertEqual(os.listdir(self.directory), ['new'])
+
+    def test_skips_directories(self):
+        os.mkdir(os.path.join(self.directory, 'thumbnails'))
+        self._callFUT(-1)
+        self.assertEqual(os.listdir(self.directory), ['thumbnails'])
+
+
+class DiskFileUploadTempStoreTests(TempStoreTestBase):
+
+    def _makeOne(self, request=None):
+        from jcu.common.tempstore import DiskFileUploadTempStore
+        return DiskFileUploadTempStore(request or testing.DummyRequest())
+
+    def _store(self, store, data=b'data'):
+        store['upload'] = {'filename': 'file.txt', 'fp': BytesIO(data)}
+        return store.tempstore['upload']['digest']
+
+    def test_requires_directory_setting(self):
+        from pyramid.exceptions import ConfigurationError
+        self.config.registry.settings.pop('jcu.tempstore.dir')
+        self.assertRaises(ConfigurationError, self._makeOne)
+
+    def test_store_and_read(self):
+        store = self._makeOne()
+        digest = self._store(store)
+        self.assertEqual(set(store.tempstore['upload']),
+                         set(['filename', 'digest', 'preview_url']))
+        data = store['upload']
+        self.assertEqual(data['fp'].read(), b'data')
+        data['fp'].close()
+        self.assertEqual(os.listdir(self.directory), [digest])
+
+    def test_reading_leaves_session_unchanged(self):
+        from jcu.common.tempstore import SESSION_KEY
+        request = testing.DummyRequest()
+        store = self._makeOne(request)
+        self.assertFalse('upload' in store)
+        self.assertEqual(store.get('upload'), None)
+        self.assertEqual(store.preview_url('upload'), None)
+        self.assertFalse(SESSION_KEY in request.session)
+        self._store(store)
+        self.assertTrue('upload' in request.session[SESSION_KEY])
+
+    def test_identical_uploads_share_file(self):
+        store = self._makeOne()
+        self._store(store)
+        store['other'] = {'filename': 'copy.txt', 'fp': BytesIO(b'data')}
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+
+    def test_read_marks_in_use(self):
+        from jcu.common.tempstore import sweep
+        store = self._makeOne()
+        path = store.path(self._store(store))
+        self.age(path, 120)
+        store['upload']['fp'].close()
+        sweep(self.directory, 60)
+        self.assertTrue(os.path.exists(path))
+
+    def test_swept_upload_missing(self):
+        from jcu.common.tempstore import sweep
+        request = testing.DummyRequest()
+        store = self._makeOne(request)
+        path = store.path(self._store(store))
+        self.age(path, 120)
+        sweep(self.directory, 60)
+        store = self._makeOne(request)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(store.get('upload'), None)
+        self.assertFalse('upload' in store)
+        self.assertRaises(KeyError, store.__getitem__, 'upload')
+
+
+def make_image(path, size=(400, 300), mode='RGB', format='PNG'):
+    from PIL import Image
+    Image.new(mode, size).save(path, format)
+
+
+class ThumbnailCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _makeOne(self, max_entries=10):
+        from jcu.common.tempstore import ThumbnailCache
+        return ThumbnailCache(os.path.join(self.directory, 'thumbnails'),
+                              (100, 100), max_entries)
+
+    def _source(self, name='source', **kw):
+        source = os.path.join(self.directory, name)
+        make_image(source, **kw)
+        return source
+
+    def test_thumbnail(self):
+        from PIL import Image
+        cache = self._makeOne()
+        path = cache.get('a' * 40, self._source(mode='P'))
+        image = Image.open(path)
+        self.assertEqual(image.format, 'JPEG')
+        self.assertEqual(image.size, (100, 75))
+
+    def test_cached(self):
+        cache = self._makeOne()
+        source = self._source()
+        path = cache.get('a' * 40, source)
+        os.remove(source)
+        self.assertEqual(cache.get('a' * 40, source), path)
+
+    def test_not_an_image(self):
+        cache = self._makeOne()
+        source = os.path.join(self.directory, 'source')
+        with open(source, 'wb') as source_file:
+            source_file.write(b'not an image')
+        self.assertEqual(cache.get('a' * 40, source), None)
+        self.assertEqual(os.listdir(cache.directory), [])
+
+    def test_truncated_image(self):
+        cache = self._makeOne()
+        source = self._source(format='JPEG')
+        with open(source, 'rb') as source_file:
+            data = source_file.read()
+        with open(source, 'wb') as source_file:
+            source_file.write(data[:len(data) // 2])
+        self.assertEqual(cache.get('a' * 40, source), None)
+        self.assertEqual(os.listdir(cache.directory), [])
+
+    def test_decompression_bomb(self):
+        from PIL import Image
+        cache = self._makeOne()
+        source = self._source(size=(100, 100))
+        limit = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = 10
+        try:
+            self.assertEqual(cache.get('a' * 40, source), None)
+        finally:
+            Image.MAX_IMAGE_PIXELS = limit
+
+    def test_failed_write_cleaned_up(self):
+        from PIL import Image
+        cache = self._makeOne()
+        source = self._source()
+        save = Image.Image.save
+
+        def failing_save(image, fp, format=None, **params):
+            fp.write(b'partial')
+            raise IOError('disk full')
+        Image.Image.save = failing_save
+        try:
+            self.assertRaises(IOError, cache.get, 'a' * 40, source)
+        finally:
+            Image.Image.save = save
+        self.assertEqual(os.listdir(cache.directory), [])
+
+    def test_evict(self):
+        cache = self._makeOne(max_entries=2)
+        source = self._source()
+        for index, digest in enumerate(('a', 'b', 'c')):
+            path = cache.get(digest * 40, source)
+            then = time.time() - 100 + index
+            os.utime(path, (then, then))
+        cache.evict()
+        self.assertEqual(sorted(os.listdir(cache.directory)),
+                         ['b' * 40 + '.jpg', 'c' * 40 + '.jpg'])
+
+
+class ThumbnailViewTests(TempStoreTestBase):
+
+    def setUp(self):
+        TempStoreTestBase.setUp(self)
+        self.config.include('jcu.common.tempstore')
+
+    def _callFUT(self, request):
+        from jcu.common.tempstore import thumbnail_view
+        return thumbnail_view(request)
+
+    def _request(self, data):
+        from jcu.common.tempstore import DiskFileUploadTempStore
+        request = testing.DummyRequest()
+        store = DiskFileUploadTempStore(request)
+        store['upload'] = {'filename': 'file', 'mimetype': 'image/png',
+                           'fp': BytesIO(data)}
+        request.matchdict = {'digest': store.tempstore['upload']['digest']}
+        return request
+
+    def _image_data(self):
+        path = os.path.join(self.directory, 'image.png')
+        make_image(path)
+        with open(path, 'rb') as image_file:
+            data = image_file.read()
+        os.remove(path)
+        return data
+
+    def test_thumbnail(self):
+        response = self._callFUT(self._request(self._image_data()))
+        self.assertEqual(response.content_type, 'image/jpeg')
+        self.assertTrue(response.cache_control.private)
+
+    def test_not_in_session(self):
+        from pyramid.httpexceptions import HTTPNotFound
+        request = testing.DummyRequest()
+        request.matchdict = {'digest': 'a' * 40}
+        self.assertRaises(HTTPNotFound, self._callFUT, request)
+
+    def test_not_an_image(self):
+        from pyramid.httpexceptions import HTTPUnsupportedMediaType
+        request = self._request(b'not an image')
+        self.assertRaises(HTTPUnsupportedMediaType, self._callFUT, request)
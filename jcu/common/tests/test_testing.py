@@ -0,0 +1,149 @@
+import unittest
+
+
+class ParseFilterTests(unittest.TestCase):
+
+    def _match(self, text, **attrs):
+        from jcu.common.testing import _parse_filter
+        predicate, position = _parse_filter(text)
+        self.assertEqual(position, len(text))
+        return predicate(dict((name.lower(), set(v.lower() for v in values))
+                              for name, values in attrs.items()))
+
+    def test_equality(self):
+        self.assertTrue(self._match('(uid=JC123456)', uid=['jc123456']))
+        self.assertFalse(self._match('(uid=jc123456)', uid=['jc000001']))
+        self.assertFalse(self._match('(uid=jc123456)'))
+
+    def test_presence(self):
+        self.assertTrue(self._match('(uid=*)', uid=['jc123456']))
+        self.assertFalse(self._match('(uid=*)', cn=['Test']))
+
+    def test_wildcard(self):
+        self.assertTrue(self._match('(cn=Role*)', cn=['Role 1']))
+        self.assertTrue(self._match('(cn=*le 1)', cn=['Role 1']))
+        self.assertFalse(self._match('(cn=Role*)', cn=['Other Role']))
+
+    def test_escapes(self):
+        self.assertTrue(self._match(r'(cn=a\28b\29)', cn=['a(b)']))
+        self.assertTrue(self._match(r'(cn=a\2ab)', cn=['a*b']))
+        self.assertFalse(self._match(r'(cn=a\2ab)', cn=['axb']))
+
+    def test_operators(self):
+        attrs = {'cn': ['Role 1'], 'uid': ['jc123456']}
+        self.assertTrue(self._match('(&(cn=Role*)(uid=jc123456))', **attrs))
+        self.assertFalse(self._match('(&(cn=Role*)(uid=other))', **attrs))
+        self.assertTrue(self._match('(|(uid=other)(uid=jc123456))', **attrs))
+        self.assertFalse(self._match('(|(uid=a)(uid=b))', **attrs))
+        self.assertTrue(self._match('(!(uid=other))', **attrs))
+
+    def test_bad_filter(self):
+        from jcu.common.testing import _parse_filter
+        self.assertRaises(ValueError, _parse_filter, 'uid=jc123456')
+
+
+class FakeLDAPDirectoryTests(unittest.TestCase):
+
+    def _makeOne(self):
+        from jcu.common.testing import make_directory
+        return make_directory(users=3, groups=2)
+
+    def _search(self, directory, base, scope, filterstr, attrlist=None):
+        return sorted(directory.search_s(base, scope, filterstr, attrlist))
+
+    def test_search_groups(self):
+        from jcu.common.testing import SCOPE_SUBTREE
+        directory = self._makeOne()
+        results = self._search(
+            directory, 'ou=org,dc=example,dc=com', SCOPE_SUBTREE,
+            '(&(cn=Role*)(roleOccupant=uid=jc000001,ou=users,dc=jcu,'
+            'dc=edu,dc=au))', ['cn'])
+        self.assertEqual(results, [
+            ('cn=Role 0,ou=org,dc=example,dc=com', {'cn': ['Role 0']}),
+            ('cn=Role 1,ou=org,dc=example,dc=com', {'cn': ['Role 1']})])
+        self.assertEqual(directory.searches, 1)
+
+    def test_scopes(self):
+        from jcu.common.testing import (SCOPE_BASE, SCOPE_ONELEVEL,
+                                        SCOPE_SUBTREE)
+        directory = self._makeOne()
+        directory.add('cn=Nested,cn=Role 0,ou=org,dc=example,dc=com',
+                      cn=['Nested'])
+        base = 'ou=org,dc=example,dc=com'
+        self.assertEqual(len(self._search(directory, base, SCOPE_SUBTREE,
+                                          '(cn=*)')), 3)
+        self.assertEqual(len(self._search(directory, base, SCOPE_ONELEVEL,
+                                          '(cn=*)')), 2)
+        self.assertEqual(self._search(directory, 'cn=Role 0,' + base,
+                                      SCOPE_BASE, '(cn=*)')[0][0],
+                         'cn=Role 0,' + base)
+
+    def test_connection(self):
+        directory = self._makeOne()
+        with directory.connection() as conn:
+            self.assertTrue(conn is directory)
+
+
+class FakeCASTests(unittest.TestCase):
+
+    def setUp(self):
+        from jcu.common.testing import serve_fake_cas
+        self.server = serve_fake_cas()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _get(self, path, **params):
+        import urllib
+        import urllib2
+
+        class NoRedirect(urllib2.HTTPRedirectHandler):
+            def redirect_request(self, *args, **kw):
+                return None
+        opener = urllib2.build_opener(NoRedirect)
+        url = self.server.cas_url + path + '?' + urllib.urlencode(params)
+        try:
+            response = opener.open(url)
+        except urllib2.HTTPError as error:
+            return error.code, error.headers, error.read()
+        return response.getcode(), response.headers, response.read()
+
+    def test_login_and_validate_once(self):
+        service = 'http://app.example.com/login'
+        status, headers, body = self._get('login', service=service,
+                                          username='jc123456')
+        self.assertEqual(status, 302)
+        location = headers['Location']
+        self.assertTrue(location.startswith(service + '?ticket=ST-'))
+        ticket = location.split('ticket=')[1]
+        status, headers, body = self._get('serviceValidate', service=service,
+                                          ticket=ticket)
+        self.assertTrue('<cas:user>jc123456</cas:user>' in body)
+        status, headers, body = self._get('serviceValidate', service=service,
+                                          ticket=ticket)
+        self.assertTrue('authenticationFailure' in body)
+        self.assertEqual((self.server.cas.logins,
+                          self.server.cas.validations), (1, 2))
+
+    def test_ticket_for_other_service(self):
+        cas = self.server.cas
+        location = cas.login('http://app.example.com/?a=1', 'jc123456')
+        self.assertTrue('?a=1&ticket=' in location)
+        ticket = location.split('ticket=')[1]
+        self.assertEqual(cas.validate('http://other.example.com/', ticket),
+                         None)
+
+    def test_user_id_escaped(self):
+        cas = self.server.cas
+        self.assertTrue('<cas:user>a&lt;b</cas:user>' in
+                        cas.validation_response('a<b'))
+
+    def test_login_requires_service_and_username(self):
+        status, headers, body = self._get('login', service='http://app/')
+        self.assertEqual(status, 400)
+
+    def test_logout(self):
+        status, headers, body = self._get('logout', service='http://app/')
+        self.assertEqual((status, headers['Location']),
+                         (302, 'http://app/'))
@@ -0,0 +1,357 @@
+import threading
+import time
+import unittest
+from wsgiref.simple_server import make_server, WSGIRequestHandler
+
+import colander
+from pyramid import testing
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubVerifier(object):
+    """ reCAPTCHA verify endpoint with a canned answer, served locally.
+    """
+
+    def __init__(self, body='true\nsuccess', status='200 OK', delay=0):
+        self.body = body
+        self.status = status
+        self.delay = delay
+        self.requests = 0
+        self.server = make_server('127.0.0.1', 0, self,
+                                  handler_class=QuietHandler)
+        self.url = 'http://127.0.0.1:%d/verify' % self.server.server_port
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def __call__(self, environ, start_response):
+        self.requests += 1
+        if self.delay:
+            time.sleep(self.delay)
+        start_response(self.status, [('Content-Type', 'text/plain')])
+        return [self.body]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class VerifyRecaptchaTests(unittest.TestCase):
+
+    def setUp(self):
+        from jcu.common.widgets import _recaptcha_failures
+        _recaptcha_failures.clear()
+        self.verifiers = []
+
+    def tearDown(self):
+        for verifier in self.verifiers:
+            verifier.close()
+
+    def _makeVerifier(self, **kw):
+        verifier = StubVerifier(**kw)
+        self.verifiers.append(verifier)
+        return verifier
+
+    def _callFUT(self, url, remoteip='10.0.0.1', challenge='challenge',
+                 response='response', timeout=5):
+        from jcu.common.widgets import verify_recaptcha
+        return verify_recaptcha(url, 'private', remoteip, challenge,
+                                response, timeout)
+
+    def test_success(self):
+        verifier = self._makeVerifier()
+        self.assertEqual(self._callFUT(verifier.url), (True, 'success'))
+
+    def test_success_never_cached(self):
+        verifier = self._makeVerifier()
+        self._callFUT(verifier.url)
+        verifier.body = 'false\nincorrect-captcha-sol'
+        self.assertEqual(self._callFUT(verifier.url),
+                         (False, 'incorrect-captcha-sol'))
+        self.assertEqual(verifier.requests, 2)
+
+    def test_failure(self):
+        verifier = self._makeVerifier(body='false\nincorrect-captcha-sol')
+        self.assertEqual(self._callFUT(verifier.url),
+                         (False, 'incorrect-captcha-sol'))
+
+    def test_failure_cached_once(self):
+        verifier = self._makeVerifier(body='false\nincorrect-captcha-sol')
+        self._callFUT(verifier.url)
+        self.assertEqual(self._callFUT(verifier.url),
+                         (False, 'incorrect-captcha-sol'))
+        self.assertEqual(verifier.requests, 1)
+        self._callFUT(verifier.url)
+        self.assertEqual(verifier.requests, 2)
+
+    def test_failure_cached_per_remote_ip(self):
+        verifier = self._makeVerifier(body='false\nincorrect-captcha-sol')
+        self._callFUT(verifier.url)
+        self._callFUT(verifier.url, remoteip='10.0.0.2')
+        self.assertEqual(verifier.requests, 2)
+
+    def test_non_200(self):
+        verifier = self._makeVerifier(status='500 Internal Server Error')
+        valid, reason = self._callFUT(verifier.url)
+        self.assertFalse(valid)
+        self.assertTrue('500' in reason)
+        self._callFUT(verifier.url)
+        self.assertEqual(verifier.requests, 2)
+
+    def test_timeout(self):
+        verifier = self._makeVerifier(delay=1)
+        self.assertEqual(self._callFUT(verifier.url, timeout=0.2),
+                         (False, 'Could not connect to the CAPTCHA service.'))
+
+    def test_unreachable(self):
+        verifier = self._makeVerifier()
+        url = verifier.url
+        verifier.close()
+        self.verifiers.remove(verifier)
+        valid, reason = self._callFUT(url, timeout=1)
+        self.assertFalse(valid)
+
+
+class RecaptchaWidgetTests(unittest.TestCase):
+
+    def setUp(self):
+        from jcu.common.widgets import _recaptcha_failures
+        _recaptcha_failures.clear()
+        self.verifier = StubVerifier()
+
+    def tearDown(self):
+        self.verifier.close()
+        testing.tearDown()
+
+    def _makeField(self, **settings):
+        import deform
+        from jcu.common.widgets import recaptcha_widget
+        all_settings = {'recaptcha.public_key': 'public',
+                        'recaptcha.private_key': 'private',
+                        'recaptcha.verify_url': self.verifier.url}
+        all_settings.update(settings)
+        testing.setUp(settings=all_settings)
+        request = testing.DummyRequest()
+        request.remote_addr = '10.0.0.1'
+        node = colander.SchemaNode(colander.String(), name='captcha',
+                                   widget=recaptcha_widget)
+        schema = colander.SchemaNode(colander.Mapping())
+        schema.add(node)
+        form = deform.Form(schema.bind(request=request))
+        return form['captcha']
+
+    def _deserialize(self, field):
+        return field.widget.deserialize(
+            field, {'recaptcha_challenge_field': 'challenge',
+                    'recaptcha_response_field': 'response'})
+
+    def test_valid(self):
+        field = self._makeField()
+        self.assertEqual(self._deserialize(field)['recaptcha_response_field'],
+                         'response')
+
+    def test_invalid(self):
+        self.verifier.body = 'false\nincorrect-captcha-sol'
+        field = self._makeField()
+        self.assertRaises(colander.Invalid, self._deserialize, field)
+
+    def test_missing_response(self):
+        field = self._makeField()
+        self.assertRaises(colander.Invalid, field.widget.deserialize, field,
+                          {'recaptcha_challenge_field': 'challenge'})
+
+    def test_async_pool_per_registry(self):
+        settings = {'recaptcha.verify_async': 'true',
+                    'recaptcha.pool_size': '1'}
+        first = self._makeField(**settings)
+        self._deserialize(first)
+        first_pool = first.widget.request.registry.jcu_recaptcha_pool
+        testing.tearDown()
+        second = self._makeField(**settings)
+        self._deserialize(second)
+        second_pool = second.widget.request.registry.jcu_recaptcha_pool
+        self.assertTrue(first_pool is not second_pool)
+        self._deserialize(second)
+        self.assertTrue(
+            second.widget.request.registry.jcu_recaptcha_pool is second_pool)
+
+    def test_async_timeout(self):
+        self.verifier.delay = 1
+        field = self._makeField(**{'recaptcha.verify_async': 'true',
+                                   'recaptcha.timeout': '0.2'})
+        try:
+            self._deserialize(field)
+        except colander.Invalid as e:
+            self.assertTrue('Could not connect' in e.msg)
+        else:
+            self.fail('Expected Invalid')
+
+
+class CachedRenderTests(unittest.TestCase):
+
+    def setUp(self):
+        from jcu.common.cache import LRUCache
+        from jcu.common.widgets import InlineMappingWidget
+        self.cache = LRUCache(max_size=100)
+        self.widget = InlineMappingWidget(render_cache=self.cache)
+        section = colander.SchemaNode(colander.Mapping(), name='section',
+                                      widget=self.widget)
+        section.add(colander.SchemaNode(colander.String(), name='colour'))
+        section.add(colander.SchemaNode(colander.String(), name='size'))
+        self.schema = colander.SchemaNode(colander.Mapping())
+        self.schema.add(section)
+
+    def _makeForm(self, child_widget=None):
+        import deform
+        from pkg_resources import resource_filename
+        if not hasattr(self, 'renderer'):
+            self.renderer = deform.ZPTRendererFactory(
+                (resource_filename('jcu.common', 'templates/deform'),
+                 resource_filename('deform', 'templates')))
+        form = deform.Form(self.schema, renderer=self.renderer)
+        if child_widget is not None:
+            form['section']['colour'].widget = child_widget
+        return form
+
+    def _render(self, form, readonly=True):
+        return form.render({'section': {'colour': 'red', 'size': 'big'}},
+                           readonly=readonly)
+
+    def _choice(self, **kw):
+        import deform
+        kw.setdefault('values', [('red', 'Crimson'), ('blue', 'Navy')])
+        return deform.widget.SelectWidget(**kw)
+
+    def test_same_state_hits_cache(self):
+        first = self._render(self._makeForm(self._choice()))
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self._render(self._makeForm(self._choice())), first)
+        self.assertEqual(len(self.cache), 1)
+
+    def test_child_values_invalidate(self):
+        self.assertTrue('Crimson' in self._render(
+            self._makeForm(self._choice())))
+        html = self._render(self._makeForm(self._choice(
+            values=[('red', 'Scarlet')])))
+        self.assertTrue('Scarlet' in html)
+        self.assertFalse('Crimson' in html)
+
+    def test_child_assigned_widget_invalidates(self):
+        form = self._makeForm()
+        self.assertFalse('Crimson' in self._render(form))
+        form['section']['colour'].widget = self._choice()
+        self.assertTrue('Crimson' in self._render(form))
+
+    def test_child_template_invalidates(self):
+        import deform
+        plain = self._render(self._makeForm(deform.widget.TextInputWidget()))
+        html = self._render(self._makeForm(deform.widget.TextInputWidget(
+            readonly_template='readonly/password')))
+        self.assertNotEqual(html, plain)
+        self.assertEqual(len(self.cache), 2)
+
+    def test_editable_not_cached(self):
+        self._render(self._makeForm(), readonly=False)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_editable_cached_if_enabled(self):
+        self.widget.render_cache_editable = True
+        self._render(self._makeForm(), readonly=False)
+        self.assertEqual(len(self.cache), 1)
+
+    def test_errors_not_cached(self):
+        form = self._makeForm()
+        form['section']['size'].error = colander.Invalid(
+            form.schema, 'Too big')
+        self._render(form)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_unhashable_state_not_cached(self):
+        class Unhashable(object):
+            __hash__ = None
+        form = self._makeForm(self._choice(option=Unhashable()))
+        self.assertTrue('Crimson' in self._render(form))
+        self.assertEqual(len(self.cache), 0)
+
+
+class CachedRenderIdentityTests(unittest.TestCase):
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _makeField(self, widget, **settings):
+        import deform
+        all_settings = {'pyramid_deform.tempdir': '/tmp'}
+        all_settings.update(settings)
+        testing.setUp(settings=all_settings)
+        request = testing.DummyRequest()
+        node = colander.SchemaNode(colander.String(), name='upload',
+                                   widget=widget)
+        schema = colander.SchemaNode(colander.Mapping())
+        schema.add(node)
+        return deform.Form(schema.bind(request=request))['upload']
+
+    def test_upload_template(self):
+        from jcu.common.widgets import file_upload_widget, image_upload_widget
+        files = self._makeField(file_upload_widget)
+        images = self._makeField(image_upload_widget)
+        self.assertNotEqual(files.widget.render_identity(files),
+                            images.widget.render_identity(images))
+
+    def test_upload_ignores_tmpstore(self):
+        from jcu.common.widgets import file_upload_widget
+        first = self._makeField(file_upload_widget)
+        second = self._makeField(file_upload_widget)
+        self.assertTrue(first.widget.tmpstore is not second.widget.tmpstore)
+        self.assertEqual(first.widget.render_identity(first),
+                         second.widget.render_identity(second))
+
+    def test_recaptcha_public_key(self):
+        from jcu.common.widgets import recaptcha_widget
+        first = self._makeField(recaptcha_widget,
+                                **{'recaptcha.public_key': 'one'})
+        identity = first.widget.render_identity(first)
+        testing.tearDown()
+        second = self._makeField(recaptcha_widget,
+                                 **{'recaptcha.public_key': 'two'})
+        self.assertNotEqual(second.widget.render_identity(second), identity)
+
+
+class SharedRenderCacheTests(unittest.TestCase):
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _callFUT(self, registry):
+        from jcu.common.widgets import shared_render_cache
+        return shared_render_cache(registry)
+
+    def test_per_registry(self):
+        from pyramid.registry import Registry
+        first = testing.setUp(settings={
+            'jcu.widgets.render_cache_size': '10'}).registry
+        cache = self._callFUT(first)
+        self.assertTrue(self._callFUT(first) is cache)
+        self.assertEqual(cache.max_size, 10)
+        other = self._callFUT(Registry())
+        self.assertFalse(other is cache)
+        self.assertEqual(other.max_size, 1000)
+
+    def test_current_registry_used_for_true(self):
+        import deform
+        from jcu.common.widgets import InlineMappingWidget
+        registry = testing.setUp().registry
+        schema = colander.SchemaNode(colander.Mapping())
+        section = colander.SchemaNode(
+            colander.Mapping(), name='section',
+            widget=InlineMappingWidget(render_cache=True))
+        section.add(colander.SchemaNode(colander.String(), name='colour'))
+        schema.add(section)
+        deform.Form(schema).render({'section': {'colour': 'red'}},
+                                   readonly=True)
+        self.assertEqual(len(self._callFUT(registry)), 1)
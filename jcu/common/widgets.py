@@ -1,14 +1,179 @@
 
-from pyramid_deform import SessionFileUploadTempStore
+import hashlib
+import threading
+
 import deform.widget
 import colander
+from pyramid.settings import asbool
+from pyramid.threadlocal import get_current_registry
+
+from jcu.common.cache import LRUCache
+
+RENDER_CACHE = 'jcu.widgets.render_cache'
+RENDER_CACHE_SIZE = 'jcu.widgets.render_cache_size'
+
+_render_cache_lock = threading.Lock()
+
+
+def shared_render_cache(registry):
+    """ Return the render cache shared by widgets of ``registry``'s
+    application with ``render_cache=True``.
+
+    The cache is created on first use, holding up to
+    ``jcu.widgets.render_cache_size`` renderings (default 1000).  Each
+    application's registry has its own cache, so applications in one
+    process may use different sizes.
+    """
+    with _render_cache_lock:
+        cache = getattr(registry, 'jcu_render_cache', None)
+        if cache is None:
+            settings = registry.settings or {}
+            cache = registry.jcu_render_cache = LRUCache(
+                max_size=int(settings.get(RENDER_CACHE_SIZE, 1000)))
+    return cache
+
+
+def _freeze(value):
+    """ Return ``value`` as nested tuples that repr() consistently.
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item))
+                            for key, item in value.items()))
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = tuple(_freeze(item) for item in value)
+        return tuple(sorted(items)) if isinstance(value, (set, frozenset)) \
+            else items
+    return value
+
+
+def _has_errors(field):
+    if field.error is not None:
+        return True
+    for child in field.children:
+        if _has_errors(child):
+            return True
+    return False
+
+
+def _widget_state(widget, exclude=()):
+    """ Return a widget's type and instance attributes, other than those
+    named in ``exclude``, for use in render cache keys.
+    """
+    return (type(widget), _freeze(dict(
+        (name, value) for name, value in vars(widget).items()
+        if name not in exclude)))
+
+
+def _children_identity(field):
+    """ Return the identities of the widgets of all ``field``'s descendants,
+    which are rendered within its output.
+
+    Widgets (eg deferred ones) may be created or configured for each
+    request, so this is computed on every rendering.  Default widgets
+    that haven't been created yet depend only on the schema node, so
+    aren't created here.
+    """
+    identities = []
+    for child in field.children:
+        widget = child.__dict__.get('widget') or \
+            getattr(child.schema, 'widget', None)
+        if widget is None:
+            identity = None
+        elif isinstance(widget, CachedRenderMixin):
+            identity = widget.render_identity(child)
+        else:
+            identity = _widget_state(widget)
+        identities.append((child.oid, identity, _children_identity(child)))
+    return tuple(identities)
+
+
+class CachedRenderMixin(object):
+    """ Mixin for deform widgets caching their rendered output.
+
+    Caching is opt-in: set ``render_cache`` to an
+    :class:`jcu.common.cache.LRUCache`, or ``True`` for the current
+    application's cache from :func:`shared_render_cache`.  Output is keyed
+    on the identity from :meth:`render_identity` of this widget and those
+    of all descendant fields, the field's oid, template, renderer, keyword
+    arguments and a hash of the cstruct.  Fields with errors aren't
+    cached.
+
+    Only readonly renderings are cached unless ``render_cache_editable``
+    is set, as some widgets (eg for uploads) have side effects when
+    serialised.  For mappings, this applies to all child widgets too.
+    """
+    render_cache = None
+    render_cache_editable = False
+
+    def render_identity(self, field):
+        """ Return what output is cached against besides the field's oid,
+        template and cstruct.
+
+        By default, this is the schema node and the widget's attributes.
+        """
+        return (field.schema, _widget_state(self))
+
+    def serialize(self, field, cstruct, **kw):
+        serialize = super(CachedRenderMixin, self).serialize
+        cache = self.render_cache
+        readonly = kw.get('readonly', getattr(self, 'readonly', False))
+        if cache is None or cache is False or \
+                not (readonly or self.render_cache_editable) or \
+                _has_errors(field):
+            return serialize(field, cstruct, **kw)
+        if cache is True:
+            cache = shared_render_cache(get_current_registry())
+        template = readonly and self.readonly_template or self.template
+        digest = hashlib.sha1(repr(_freeze(cstruct))).hexdigest()
+        key = (self.render_identity(field), _children_identity(field),
+               field.oid, template, field.renderer, _freeze(kw), digest)
+        try:
+            html = cache.get(key)
+        except TypeError:
+            # Widget attributes that can't be used in a key
+            return serialize(field, cstruct, **kw)
+        if html is None:
+            html = serialize(field, cstruct, **kw)
+            cache.set(key, html)
+        return html
+
+
+def _cache_options(request):
+    """ Return widget options enabling render caching, if configured.
+    """
+    settings = request.registry.settings
+    if not asbool(settings.get(RENDER_CACHE, False)):
+        return {}
+    return {'render_cache': shared_render_cache(request.registry)}
+
+
+class FileUploadWidget(CachedRenderMixin, deform.widget.FileUploadWidget):
+    """ Upload widget, whose readonly output may be cached.
+
+    As deferred widgets are created for each binding of a schema, output is
+    cached against the schema node's name and type rather than the node,
+    and the widget's attributes other than its per-request temporary store.
+    """
+
+    def render_identity(self, field):
+        return (field.schema.name, type(field.schema.typ),
+                _widget_state(self, exclude=('tmpstore',)))
 
 
 @colander.deferred
 def file_upload_widget(node, kw):
+    """ Upload widget storing files on disk if ``jcu.tempstore.dir`` is set,
+    else in the session.  Readonly output is cached if
+    ``jcu.widgets.render_cache`` is set.
+    """
     request = kw['request']
-    tmpstore = SessionFileUploadTempStore(request)
-    return deform.widget.FileUploadWidget(tmpstore)
+    if request.registry.settings.get('jcu.tempstore.dir'):
+        from jcu.common.tempstore import DiskFileUploadTempStore
+        tmpstore = DiskFileUploadTempStore(request)
+    else:
+        from pyramid_deform import SessionFileUploadTempStore
+        tmpstore = SessionFileUploadTempStore(request)
+    return FileUploadWidget(tmpstore, **_cache_options(request))
 
 
 @colander.deferred
@@ -18,24 +183,109 @@ def image_upload_widget(node, kw):
     return widget
 
 
-class InlineMappingWidget(deform.widget.MappingWidget):
+class InlineMappingWidget(CachedRenderMixin, deform.widget.MappingWidget):
+    """ Mapping widget rendering its children inline.
+
+    Pass ``render_cache=True`` to cache readonly output; see
+    :class:`CachedRenderMixin`.
+    """
     template = "inline_mapping"
     error_class = "deform-error"
 
 
-import httplib2
+import socket
+from multiprocessing import TimeoutError
 from urllib import urlencode
 from deform.widget import CheckedInputWidget
 
+RECAPTCHA_URL = "https://www.google.com/recaptcha/api/verify"
+RECAPTCHA_HEADERS = {'Content-type': 'application/x-www-form-urlencoded'}
+
+_recaptcha_clients = threading.local()
+_recaptcha_pool_lock = threading.Lock()
+#: Recent failed verifications, so resubmitting a form doesn't re-verify
+_recaptcha_failures = LRUCache(max_size=1000, ttl=120)
+
+
+def _recaptcha_client(timeout):
+    """ Return this thread's keep-alive HTTP client for the given timeout.
+
+    ``httplib2.Http`` objects aren't thread-safe, so each thread keeps its
+    own, reusing open connections to the verification server.
+    """
+    import httplib2
+    clients = getattr(_recaptcha_clients, 'clients', None)
+    if clients is None:
+        clients = _recaptcha_clients.clients = {}
+    client = clients.get(timeout)
+    if client is None:
+        client = clients[timeout] = httplib2.Http(timeout=timeout)
+    return client
+
+
+def _recaptcha_verify_pool(registry, size):
+    """ Return the thread pool of ``size`` threads verifying solutions for
+    ``registry``, created on first use.
+
+    Each application's registry has its own pool, so applications in one
+    process may use different sizes.
+    """
+    from multiprocessing.pool import ThreadPool
+    with _recaptcha_pool_lock:
+        pool = getattr(registry, 'jcu_recaptcha_pool', None)
+        if pool is None:
+            pool = registry.jcu_recaptcha_pool = ThreadPool(size)
+    return pool
+
+
+def verify_recaptcha(url, privatekey, remoteip, challenge, response,
+                     timeout=10):
+    """ Check a reCAPTCHA solution, returning a tuple ``(valid, reason)``.
+
+    ``reason`` is the error code returned by the server, or a message
+    describing why the server couldn't be contacted.  Solutions the server
+    rejects are remembered briefly, so one identical resubmission fails
+    without asking the server again.  Successes are never remembered, so
+    a solution can't be replayed.
+    """
+    import httplib2
+    key = (privatekey, remoteip, challenge, response)
+    result = _recaptcha_failures.get(key)
+    if result is not None:
+        _recaptcha_failures.invalidate(key)
+        return result
+
+    data = urlencode(dict(privatekey=privatekey,
+                          remoteip=remoteip,
+                          challenge=challenge,
+                          response=response))
+    try:
+        resp, content = _recaptcha_client(timeout).request(
+            url, "POST", headers=RECAPTCHA_HEADERS, body=data)
+    except (AttributeError, socket.error, httplib2.HttpLib2Error):
+        ## XXX: catch a possible httplib regression in 2.7 where
+        ## XXX: there is no connection made to the socket so
+        ## XXX sock is still None when makefile is called.
+        return False, "Could not connect to the CAPTCHA service."
+    if not resp['status'] == '200':
+        return False, ("There was an error talking to the reCAPTCHA "
+                       "server {0}".format(resp['status']))
+    valid, reason = (content.split('\n') + [''])[:2]
+    result = (valid == 'true', reason)
+    if not result[0]:
+        _recaptcha_failures.set(key, result)
+    return result
+
+
 @colander.deferred
 def recaptcha_widget(node, kw):
     request = kw['request']
-    class RecaptchaWidget(CheckedInputWidget):
+    class BaseRecaptchaWidget(CheckedInputWidget):
         template = 'recaptcha'
         readonly_template = 'recaptcha'
         requirements = ()
-        url = "https://www.google.com/recaptcha/api/verify"
-        headers={'Content-type': 'application/x-www-form-urlencoded'}
+        url = RECAPTCHA_URL
+        headers = RECAPTCHA_HEADERS
 
         def serialize(self, field, cstruct, readonly=False):
             if cstruct in (colander.null, None):
@@ -62,37 +312,38 @@ def recaptcha_widget(node, kw):
                 raise colander.Invalid(
                     field.schema,
                     'Challenge data was missing.')
-            privatekey = self.request.registry.settings['recaptcha.private_key']
-            remoteip = self.request.remote_addr
-            data = urlencode(dict(privatekey=privatekey,
-                                  remoteip=remoteip,
-                                  challenge=challenge,
-                                  response=response))
-            timeout = int(
-                self.request.registry.settings.get('recaptcha.timeout', 10))
-            h = httplib2.Http(timeout=timeout)
-            try:
-                resp, content = h.request(self.url,
-                                          "POST",
-                                          headers=self.headers,
-                                          body=data)
-            except AttributeError as e:
-                if e=="'NoneType' object has no attribute 'makefile'":
-                    ## XXX: catch a possible httplib regression in 2.7 where
-                    ## XXX: there is no connection made to the socket so
-                    ## XXX sock is still None when makefile is called.
-                    raise colander.Invalid(field.schema,
-                                  "Could not connect to the CAPTCHA service.")
-            if not resp['status'] == '200':
-                raise colander.Invalid(field.schema,
-                              "There was an error talking to the reCAPTCHA \
-                              server{0}".format(resp['status']))
-            valid, reason = content.split('\n')
-            if not valid == 'true':
+            settings = self.request.registry.settings
+            args = (settings.get('recaptcha.verify_url', self.url),
+                    settings['recaptcha.private_key'],
+                    self.request.remote_addr,
+                    challenge,
+                    response,
+                    float(settings.get('recaptcha.timeout', 10)))
+            if asbool(settings.get('recaptcha.verify_async', False)):
+                # Bound the total time spent, not just each socket operation
+                pool = _recaptcha_verify_pool(
+                    self.request.registry,
+                    int(settings.get('recaptcha.pool_size', 4)))
+                try:
+                    valid, reason = pool.apply_async(
+                        verify_recaptcha, args).get(args[-1])
+                except TimeoutError:
+                    valid, reason = \
+                        False, "Could not connect to the CAPTCHA service."
+            else:
+                valid, reason = verify_recaptcha(*args)
+            if not valid:
                 if reason == 'incorrect-captcha-sol':
                     reason = "Please retry and enter the characters you see below."
                 raise colander.Invalid(field.schema,
                                        reason.replace('\\n', ' ').strip("'"))
             return pstruct
 
-    return RecaptchaWidget(request=request)
+    class RecaptchaWidget(CachedRenderMixin, BaseRecaptchaWidget):
+
+        def render_identity(self, field):
+            return ('recaptcha', field.schema.name,
+                    self.request.registry.settings['recaptcha.public_key'],
+                    _widget_state(self, exclude=('request',)))
+
+    return RecaptchaWidget(request=request, **_cache_options(request))
@@ -42,7 +42,10 @@ setup(name='jcu.common',
                    'repoze.who.plugins.metadata_cache'],
           'ldap': ['pyramid_ldap'],
           'forms': ['deform'],
+          'images': ['Pillow'],
           'static': ['fanstatic'],
+          'brotli': ['fanstatic', 'Brotli'],
+          'session': ['pyramid_beaker'],
       },
       setup_requires=[
           'setuptools-git',
@@ -51,6 +54,12 @@ setup(name='jcu.common',
       [fanstatic.libraries]
       jcu_common = jcu.common.resources:library
 
+      [paste.filter_app_factory]
+      fanstatic = jcu.common.resources:make_fanstatic
+
+      [console_scripts]
+      jcu-compress-static = jcu.common.resources:main
+
       # -*- Entry points: -*-
       """,
       )